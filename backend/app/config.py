@@ -12,6 +12,95 @@ class Settings(BaseSettings):
     chunk_size: int = 300
     chunk_overlap: int = 30
     top_k: int = 5
+    # "rpc": pgvector match_document_chunks; "numpy": in-process exact search per subject
+    # (app/rag/vector_index.py), evicted LRU past the memory budget.
+    retrieval_backend: str = "rpc"
+    vector_index_memory_mb: int = 512
+    # Directory for memory-mapped index files; empty keeps indexes in RAM only.
+    vector_index_dir: str = ""
+    vector_index_refresh_seconds: float = 300.0
+    # Candidate search on compact vectors ("none", "int8" or "binary"), then exact
+    # re-ranking of the best `vector_rerank_candidates`. Applies to both backends:
+    # the rpc backend uses the embedding_bq column when set to "binary", which only
+    # exists after supabase_migration_binary_quantization.sql.
+    vector_quantization: str = "none"
+    # rpc backend: subjects with at most this many chunks are scanned exactly instead of via HNSW.
+    exact_scan_threshold: int = 5000
+    vector_rerank_candidates: int = 200
+    # Hybrid retrieval: BM25 over chunk text fused with vector search by reciprocal rank
+    # fusion. Each ranker contributes top_k * hybrid_candidate_multiplier candidates.
+    # Off by default: each worker keeps BM25 postings for up to lexical_index_max_subjects.
+    hybrid_retrieval: bool = False
+    hybrid_candidate_multiplier: int = 4
+    rrf_k: int = 60
+    lexical_index_max_subjects: int = 64
+    # A subject's BM25 index is built in the background; queries wait this long for it
+    # before falling back to vector-only results.
+    lexical_index_warmup_wait: float = 0.5
+    # Quiz/notes retrieval: take the best `mmr_fetch_k` chunks and keep a diverse subset by
+    # maximal marginal relevance (1.0 = relevance only, lower = more coverage).
+    mmr_enabled: bool = True
+    mmr_fetch_k: int = 30
+    mmr_lambda: float = 0.5
+    # Context tokens per prompt. Adjacent chunks are merged without their overlap and the
+    # most relevant passages are packed until the budget is reached; 0 = no limit.
+    ask_context_tokens: int = 1500
+    quiz_context_tokens: int = 3000
+    notes_context_tokens: int = 3000
+    # /ask/batch: LLM generations in flight at once (retrieval for all questions runs concurrently).
+    ask_batch_llm_concurrency: int = 2
+    # Ollama admission control (app/rag/llm_scheduler.py): calls in flight at once, and
+    # waiting calls per lane (interactive / generation) before new ones get 429.
+    llm_max_in_flight: int = 2
+    llm_max_queue: int = 16
+    llm_min_retry_after: int = 2
+    # Ollama /api/embed: inputs per request and number of requests in flight.
+    embed_batch_size: int = 32
+    embed_max_concurrency: int = 4
+    # Persistent SQLite cache of embeddings keyed by (model, sha256 of normalized text).
+    embedding_cache_enabled: bool = True
+    embedding_cache_path: str = ".cache/embeddings.sqlite3"
+    embedding_cache_max_entries: int = 200_000
+    # In-process LRU/TTL cache of query embeddings used by the retriever.
+    query_cache_enabled: bool = True
+    query_cache_max_entries: int = 1024
+    query_cache_ttl: float = 3600.0
+    # /ask answers reused for questions within `answer_cache_threshold` cosine similarity
+    # of a cached question in the same subject; dropped when the subject's documents change.
+    answer_cache_enabled: bool = True
+    answer_cache_threshold: float = 0.95
+    answer_cache_max_per_subject: int = 256
+    answer_cache_max_subjects: int = 512
+    answer_cache_ttl: float = 86400.0
+    # Opt-in SQLite cache of quiz/notes LLM completions keyed by (subject, model, messages,
+    # options); LRU-evicted past the entry cap and dropped when the subject's documents change.
+    completion_cache_enabled: bool = False
+    completion_cache_path: str = ".cache/completions.sqlite3"
+    completion_cache_max_entries: int = 5000
+    completion_cache_ttl: float = 604800.0
+    # document_chunks rows per PostgREST insert during ingestion, with retries.
+    chunk_insert_batch_size: int = 200
+    chunk_insert_max_retries: int = 3
+    chunk_insert_retry_backoff: float = 0.5
+    # PyMuPDF text extraction runs in a process pool of this many workers.
+    pdf_parse_workers: int = 2
+    # Streaming ingestion: pages per extraction task and items buffered between stages.
+    pdf_stream_batch_pages: int = 32
+    ingest_queue_size: int = 256
+    # Background ingestion workers (app/services/ingestion_service.py).
+    ingestion_workers: int = 2
+    ingestion_queue_size: int = 100
+    # Documents re-indexed at once after chunking/embedding settings change.
+    reindex_max_concurrency: int = 1
+    # Seconds without progress before a "processing" job is considered orphaned.
+    ingestion_stale_after: int = 600
+    # Shared pooled HTTP client for Ollama (see app/utils/http_client.py).
+    ollama_max_connections: int = 20
+    ollama_max_keepalive_connections: int = 10
+    ollama_keepalive_expiry: float = 30.0
+    ollama_connect_timeout: float = 30.0
+    ollama_read_timeout: float = 300.0
+    ollama_embed_timeout: float = 120.0
     cors_origins: str = "http://localhost:3000"
     # Supabase Storage bucket for original PDFs (preview). Create bucket "documents" in dashboard.
     documents_bucket: str = "documents"
@@ -1,14 +1,44 @@
+import asyncio
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from app.config import get_settings
-from app.routers import subjects, organizations, documents, ask, quiz, notes, chats
+from app.routers import subjects, organizations, documents, ask, quiz, notes, chats, metrics
+from app.rag.completion_cache import close_completion_cache
+from app.rag.embedding_cache import close_embedding_cache
+from app.rag.pdf_parser import shutdown_pdf_executor
+from app.rag.retriever import warm_query_cache
+from app.services.notes_service import DEFAULT_NOTES_QUERY
+from app.services.quiz_service import DEFAULT_QUIZ_QUERY
+from app.services.ingestion_service import start_ingestion_workers, stop_ingestion_workers
+from app.utils.http_client import close_http_client, init_http_client
 
 settings = get_settings()
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await init_http_client()
+    await start_ingestion_workers()
+    # In the background so a slow or absent Ollama does not delay startup.
+    warm_up = asyncio.create_task(warm_query_cache([DEFAULT_QUIZ_QUERY, DEFAULT_NOTES_QUERY]))
+    try:
+        yield
+    finally:
+        warm_up.cancel()
+        await stop_ingestion_workers()
+        shutdown_pdf_executor()
+        await close_http_client()
+        close_embedding_cache()
+        close_completion_cache()
+
+
 app = FastAPI(
     title="EduRAG API",
     version="1.0.0",
     description="EduRAG — AI-powered RAG system for teachers",
+    lifespan=lifespan,
 )
 
 app.add_middleware(
@@ -26,6 +56,7 @@ app.include_router(ask.router)
 app.include_router(quiz.router)
 app.include_router(notes.router)
 app.include_router(chats.router)
+app.include_router(metrics.router)
 
 
 @app.get("/health")
@@ -56,6 +56,28 @@ class DocumentResponse(BaseModel):
     chunk_count: int
     created_at: str
     storage_path: Optional[str] = None
+    status: str = "ready"
+    index_version: Optional[str] = None
+
+
+class IngestionJobResponse(BaseModel):
+    id: str
+    teacher_id: str
+    subject_id: str
+    document_id: Optional[str] = None
+    filename: str
+    kind: str = "ingest"
+    status: str
+    progress: int = 0
+    processed_chunks: int = 0
+    total_chunks: int = 0
+    error: Optional[str] = None
+    created_at: str
+    updated_at: Optional[str] = None
+
+
+class ReindexRequest(BaseModel):
+    subject_id: Optional[str] = None
 
 
 class DocumentPreviewUrlResponse(BaseModel):
@@ -75,6 +97,24 @@ class AskRequest(BaseModel):
 class AskResponse(BaseModel):
     answer: str
     sources: list[dict]
+    cached: bool = False
+
+
+class AskBatchRequest(BaseModel):
+    subject_id: str
+    questions: list[str] = Field(..., min_length=1, max_length=50)
+
+
+class AskBatchItem(BaseModel):
+    question: str
+    answer: Optional[str] = None
+    sources: list[dict] = []
+    cached: bool = False
+    error: Optional[str] = None
+
+
+class AskBatchResponse(BaseModel):
+    results: list[AskBatchItem]
 
 
 # ── Quiz ──────────────────────────────────────────────────────────────
@@ -86,6 +126,8 @@ class QuizRequest(BaseModel):
     short_count: int = 0
     long_count: int = 0
     fill_blanks_count: int = 0
+    # Skip the completion cache and generate afresh.
+    no_cache: bool = False
 
 class QuizQuestion(BaseModel):
     type: str = "mcq" # mcq, short, long, fill_blanks
@@ -102,6 +144,14 @@ class QuizResponse(BaseModel):
 class NotesRequest(BaseModel):
     subject_id: str
     topic: Optional[str] = None
+    # Skip the completion cache and generate afresh.
+    no_cache: bool = False
+
+
+class NotesStreamRequest(NotesRequest):
+    # Store the finished notes via save_notes (title defaults to the topic).
+    save: bool = False
+    title: Optional[str] = None
 
 
 class NotesResponse(BaseModel):
@@ -0,0 +1,154 @@
+from __future__ import annotations
+
+import time
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+from app.config import get_settings
+from app.rag.corpus_events import on_corpus_change
+
+
+class _SubjectAnswers:
+    """Cached answers of one subject with their unit-normalized question embeddings."""
+
+    def __init__(self) -> None:
+        self.vectors: Optional[np.ndarray] = None  # (n, dim) float32
+        self.entries: list[dict] = []
+
+
+class SemanticAnswerCache:
+    """
+    Per-subject cache of /ask answers looked up by question similarity.
+
+    A question hits when the cosine similarity between its embedding and a cached
+    question's embedding is at least `threshold`. Each subject keeps at most
+    `max_per_subject` answers (oldest dropped first) and at most `max_subjects`
+    subjects are held (least recently used dropped first). Entries older than
+    `ttl` seconds are ignored; a subject's entries are dropped when its corpus changes.
+    """
+
+    def __init__(self, threshold: float, max_per_subject: int, max_subjects: int, ttl: float):
+        self.threshold = threshold
+        self.max_per_subject = max(1, max_per_subject)
+        self.max_subjects = max(1, max_subjects)
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._subjects: OrderedDict[str, _SubjectAnswers] = OrderedDict()
+        # Bumped on every invalidation so answers computed across a corpus change are not stored.
+        self._generations: dict[str, int] = {}
+
+    @staticmethod
+    def _unit(embedding: list[float]) -> np.ndarray:
+        vec = np.asarray(embedding, dtype=np.float32)
+        norm = float(np.linalg.norm(vec))
+        return vec / norm if norm else vec
+
+    def _expire(self, subject: _SubjectAnswers) -> None:
+        if self.ttl <= 0 or not subject.entries:
+            return
+        cutoff = time.time() - self.ttl
+        keep = [i for i, e in enumerate(subject.entries) if e["stored_at"] >= cutoff]
+        if len(keep) != len(subject.entries):
+            subject.entries = [subject.entries[i] for i in keep]
+            subject.vectors = subject.vectors[keep] if keep else None
+
+    def get(self, subject_id: str, embedding: list[float]) -> Optional[dict]:
+        subject = self._subjects.get(subject_id)
+        if subject is not None:
+            self._subjects.move_to_end(subject_id)
+            self._expire(subject)
+        if subject is None or subject.vectors is None:
+            self.misses += 1
+            return None
+        query = self._unit(embedding)
+        if subject.vectors.shape[1] != query.shape[0]:
+            # Embedding model changed; these answers can no longer be matched.
+            self._subjects.pop(subject_id, None)
+            self.misses += 1
+            return None
+        scores = subject.vectors @ query
+        best = int(np.argmax(scores))
+        if float(scores[best]) < self.threshold:
+            self.misses += 1
+            return None
+        self.hits += 1
+        entry = subject.entries[best]
+        return {**entry["result"], "similarity": round(float(scores[best]), 4)}
+
+    def generation(self, subject_id: str) -> int:
+        return self._generations.get(subject_id, 0)
+
+    def put(
+        self,
+        subject_id: str,
+        embedding: list[float],
+        result: dict,
+        generation: Optional[int] = None,
+    ) -> None:
+        if generation is not None and generation != self.generation(subject_id):
+            return
+        subject = self._subjects.get(subject_id)
+        if subject is None:
+            subject = self._subjects[subject_id] = _SubjectAnswers()
+        self._subjects.move_to_end(subject_id)
+        vec = self._unit(embedding)[None, :]
+        if subject.vectors is not None and subject.vectors.shape[1] != vec.shape[1]:
+            subject.vectors, subject.entries = None, []
+        subject.vectors = vec if subject.vectors is None else np.vstack([subject.vectors, vec])
+        subject.entries.append({"stored_at": time.time(), "result": result})
+        overflow = len(subject.entries) - self.max_per_subject
+        if overflow > 0:
+            subject.vectors = subject.vectors[overflow:]
+            subject.entries = subject.entries[overflow:]
+        while len(self._subjects) > self.max_subjects:
+            self._subjects.popitem(last=False)
+
+    def invalidate(self, subject_id: str) -> None:
+        self._generations[subject_id] = self.generation(subject_id) + 1
+        if self._subjects.pop(subject_id, None) is not None:
+            self.invalidations += 1
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "subjects": len(self._subjects),
+            "entries": sum(len(s.entries) for s in self._subjects.values()),
+            "threshold": self.threshold,
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+_cache: Optional[SemanticAnswerCache] = None
+
+
+def get_answer_cache() -> Optional[SemanticAnswerCache]:
+    """Process-wide cache, or None when ANSWER_CACHE_ENABLED is false."""
+    global _cache
+    settings = get_settings()
+    if not settings.answer_cache_enabled:
+        return None
+    if _cache is None:
+        _cache = SemanticAnswerCache(
+            settings.answer_cache_threshold,
+            settings.answer_cache_max_per_subject,
+            settings.answer_cache_max_subjects,
+            settings.answer_cache_ttl,
+        )
+    return _cache
+
+
+@on_corpus_change
+def _invalidate_subject(subject_id: str, document_id: Optional[str], change: str) -> None:
+    if _cache is not None:
+        _cache.invalidate(subject_id)
+
+
+def answer_cache_stats() -> Optional[dict]:
+    cache = get_answer_cache()
+    return cache.stats() if cache is not None else None
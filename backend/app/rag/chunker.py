@@ -1,8 +1,30 @@
+from bisect import bisect_right
+from typing import AsyncIterator, Iterable, Optional
+
 import tiktoken
 
+ENCODING_NAME = "cl100k_base"
+PAGE_SEPARATOR = "\n"
+# Bump whenever chunk boundaries or page attribution change, so existing chunks are re-indexed.
+CHUNKER_VERSION = 2
+
+_encoder: Optional[tiktoken.Encoding] = None
+
+
+def get_encoder() -> tiktoken.Encoding:
+    # Loaded lazily: the first load may download the BPE file.
+    global _encoder
+    if _encoder is None:
+        _encoder = tiktoken.get_encoding(ENCODING_NAME)
+    return _encoder
 
-def count_tokens(text: str, model: str = "cl100k_base") -> int:
-    encoder = tiktoken.get_encoding(model)
+
+def chunker_version(chunk_size: int, chunk_overlap: int) -> str:
+    return f"v{CHUNKER_VERSION}:{chunk_size}:{chunk_overlap}"
+
+
+def count_tokens(text: str, model: str = ENCODING_NAME) -> int:
+    encoder = get_encoder() if model == ENCODING_NAME else tiktoken.get_encoding(model)
     return len(encoder.encode(text))
 
 
@@ -11,7 +33,7 @@ def chunk_text(
     chunk_size: int = 800,
     chunk_overlap: int = 150,
 ) -> list[str]:
-    encoder = tiktoken.get_encoding("cl100k_base")
+    encoder = get_encoder()
     tokens = encoder.encode(text)
 
     chunks: list[str] = []
@@ -27,6 +49,73 @@ def chunk_text(
     return chunks
 
 
+class _PageTokens:
+    """
+    Token stream of consecutive pages with the absolute token offset where each
+    page's own tokens begin. The separator between two pages sits just before the
+    later page's offset and is attributed to neither, so spans never pick up a
+    page whose only contribution to a chunk is whitespace.
+    """
+
+    def __init__(self) -> None:
+        self.tokens: list[int] = []
+        self.base = 0  # absolute index of tokens[0]
+        self.offsets: list[int] = []
+        self.page_numbers: list[int] = []
+        self._separator = get_encoder().encode(PAGE_SEPARATOR)
+
+    def __len__(self) -> int:
+        return len(self.tokens)
+
+    def add_page(self, page_number: int, text: str) -> None:
+        if self.offsets:
+            self.tokens.extend(self._separator)
+        self.offsets.append(self.base + len(self.tokens))
+        self.page_numbers.append(page_number)
+        self.tokens.extend(get_encoder().encode(text))
+
+    def page_span(self, start: int, end: int) -> tuple[int, int]:
+        """Pages holding the first and last non-separator tokens of [start, end) (absolute)."""
+        sep = len(self._separator)
+        first = bisect_right(self.offsets, start) - 1
+        nxt = first + 1
+        if nxt < len(self.offsets) and start >= self.offsets[nxt] - sep:
+            first = nxt  # window starts on the separator before the next page
+        last = bisect_right(self.offsets, end - 1) - 1
+        return self.page_numbers[max(first, 0)], self.page_numbers[max(last, first, 0)]
+
+    def window(self, start: int, chunk_size: int, overlap: int = 0) -> Optional[dict]:
+        rel = start - self.base
+        window = self.tokens[rel:rel + chunk_size]
+        content = get_encoder().decode(window).strip()
+        if not content:
+            return None
+        page_start, page_end = self.page_span(start, start + len(window))
+        return {
+            "content": content,
+            "page_number": page_start,
+            "page_end": page_end,
+            "token_count": len(window),
+            # Tokens shared with the previous window, dropped when packing them together.
+            "overlap_tokens": min(overlap, start, len(window)),
+        }
+
+    def drop_before(self, start: int) -> None:
+        """Forget tokens before absolute index `start` and pages that ended before it."""
+        del self.tokens[:start - self.base]
+        self.base = start
+        keep = max(bisect_right(self.offsets, start) - 1, 0)
+        del self.offsets[:keep]
+        del self.page_numbers[:keep]
+
+
+def _non_empty_pages(pages: Iterable[dict]) -> Iterable[tuple[int, str]]:
+    for page in pages:
+        page_text = page["text"].strip()
+        if page_text:
+            yield page["page_number"], page_text
+
+
 def extract_page_chunks(
     pages: list[dict],
     chunk_size: int = 800,
@@ -34,54 +123,55 @@ def extract_page_chunks(
 ) -> list[dict]:
     """
     Takes a list of {"page_number": int, "text": str} and returns
-    chunked items with page_number preserved.
+    chunked items with the page span of each chunk:
+    {"content", "page_number" (first page), "page_end" (last page),
+    "token_count", "overlap_tokens" (shared with the previous chunk)}.
+
+    Pages are encoded one at a time while recording their token offsets, so the
+    whole pass is linear in document length.
     """
+    stream = _PageTokens()
+    for page_number, page_text in _non_empty_pages(pages):
+        stream.add_page(page_number, page_text)
+
+    step = max(1, chunk_size - chunk_overlap)
     result: list[dict] = []
+    for start in range(0, len(stream), step):
+        chunk = stream.window(start, chunk_size, chunk_size - step)
+        if chunk:
+            result.append(chunk)
+    return result
 
-    accumulated_text = ""
-    current_page = 1
 
-    for page in pages:
-        page_num = page["page_number"]
+async def iter_page_chunks(
+    pages: AsyncIterator[dict],
+    chunk_size: int = 800,
+    chunk_overlap: int = 150,
+) -> AsyncIterator[dict]:
+    """
+    Streaming counterpart of `extract_page_chunks`: chunks are emitted as soon as
+    enough tokens have arrived, so only about one window of tokens is held at a time.
+    """
+    step = max(1, chunk_size - chunk_overlap)
+    stream = _PageTokens()
+    start = 0
+
+    async for page in pages:
         page_text = page["text"].strip()
         if not page_text:
             continue
-
-        if accumulated_text:
-            accumulated_text += "\n" + page_text
-        else:
-            accumulated_text = page_text
-            current_page = page_num
-
-    if not accumulated_text:
-        return result
-
-    raw_chunks = chunk_text(accumulated_text, chunk_size, chunk_overlap)
-
-    text_cursor = 0
-    page_idx = 0
-    page_boundaries: list[int] = []
-    running = 0
-    for page in pages:
-        running += len(page["text"])
-        page_boundaries.append(running)
-
-    for chunk in raw_chunks:
-        chunk_start = accumulated_text.find(chunk[:50], text_cursor)
-        if chunk_start == -1:
-            chunk_start = text_cursor
-
-        best_page = 1
-        for i, boundary in enumerate(page_boundaries):
-            if chunk_start < boundary:
-                best_page = pages[i]["page_number"]
-                break
-            best_page = pages[-1]["page_number"]
-
-        result.append({
-            "content": chunk,
-            "page_number": best_page,
-        })
-        text_cursor = max(text_cursor, chunk_start + 1)
-
-    return result
+        stream.add_page(page["page_number"], page_text)
+
+        while stream.base + len(stream) - start >= chunk_size:
+            chunk = stream.window(start, chunk_size, chunk_size - step)
+            if chunk:
+                yield chunk
+            start += step
+            stream.drop_before(start)
+
+    # Flush the tail the same way chunk_text does: every window start below the end.
+    while start < stream.base + len(stream):
+        chunk = stream.window(start, chunk_size, chunk_size - step)
+        if chunk:
+            yield chunk
+        start += step
@@ -0,0 +1,245 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+from app.config import get_settings
+from app.rag.corpus_events import on_corpus_change
+
+# Set per request by the quiz/notes services; generate_response only caches inside a scope.
+_subject: ContextVar[Optional[str]] = ContextVar("completion_subject", default=None)
+_bypass: ContextVar[bool] = ContextVar("completion_no_cache", default=False)
+
+# puts between expiry sweeps and full row counts; in between, the count is kept in memory.
+_RECOUNT_EVERY = 100
+
+
+def set_completion_scope(subject_id: str, no_cache: bool = False) -> None:
+    """Cache LLM completions made from the current task under `subject_id`.
+
+    With `no_cache` the cache is neither read nor written.
+    """
+    _subject.set(subject_id)
+    _bypass.set(no_cache)
+
+
+def completion_scope() -> Optional[str]:
+    """Subject whose completions may be cached right now, or None."""
+    if _bypass.get():
+        return None
+    return _subject.get()
+
+
+class CompletionCache:
+    """
+    Persistent cache of LLM completions keyed by (subject, hash of model, messages and
+    options). Entries expire after `ttl` seconds; past `max_entries` the least
+    recently used are evicted. A subject's entries are dropped when its documents change:
+    `mark_stale` hides them at once without touching the database, `invalidate` deletes them.
+    Everything else does SQLite I/O, opening included: call it off the event loop.
+    """
+
+    def __init__(self, path: str, max_entries: int, ttl: float):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        # subject -> time of its last corpus change; older entries are never served.
+        self._stale: dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS completions (
+                subject_id TEXT NOT NULL,
+                request_key TEXT NOT NULL,
+                model TEXT NOT NULL,
+                response TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (subject_id, request_key)
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_completions_last_used ON completions(last_used)"
+        )
+        self._conn.commit()
+        self._puts = 0
+        self._count = self._row_count()
+
+    def _row_count(self) -> int:
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM completions").fetchone()
+        return count
+
+    def get(self, subject_id: str, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, created_at FROM completions "
+                "WHERE subject_id = ? AND request_key = ?",
+                (subject_id, key),
+            ).fetchone()
+            if row is not None and (
+                now - row[1] > self.ttl or row[1] < self._stale.get(subject_id, 0.0)
+            ):
+                self._count -= self._conn.execute(
+                    "DELETE FROM completions WHERE subject_id = ? AND request_key = ?",
+                    (subject_id, key),
+                ).rowcount
+                self._conn.commit()
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute(
+                "UPDATE completions SET last_used = ? WHERE subject_id = ? AND request_key = ?",
+                (now, subject_id, key),
+            )
+            self._conn.commit()
+            self.hits += 1
+        return row[0]
+
+    def put(
+        self,
+        subject_id: str,
+        key: str,
+        model: str,
+        response: str,
+        created_at: Optional[float] = None,
+    ) -> None:
+        """`created_at` is when generation started; output begun before a corpus change is dropped."""
+        now = time.time()
+        created_at = now if created_at is None else created_at
+        with self._lock:
+            if created_at < self._stale.get(subject_id, 0.0):
+                return
+            updated = self._conn.execute(
+                "UPDATE completions SET model = ?, response = ?, created_at = ?, last_used = ? "
+                "WHERE subject_id = ? AND request_key = ?",
+                (model, response, created_at, now, subject_id, key),
+            ).rowcount
+            if not updated:
+                self._conn.execute(
+                    "INSERT INTO completions "
+                    "(subject_id, request_key, model, response, created_at, last_used) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (subject_id, key, model, response, created_at, now),
+                )
+                self._count += 1
+            self._puts += 1
+            if self._puts % _RECOUNT_EVERY == 0:
+                # `get` never serves expired rows; sweeping them now and then is enough.
+                self._conn.execute(
+                    "DELETE FROM completions WHERE created_at < ?", (now - self.ttl,)
+                )
+                # Other processes sharing the file insert and evict too.
+                self._count = self._row_count()
+            excess = self._count - self.max_entries
+            if excess > 0:
+                self._count -= self._conn.execute(
+                    "DELETE FROM completions WHERE rowid IN "
+                    "(SELECT rowid FROM completions ORDER BY last_used LIMIT ?)",
+                    (excess,),
+                ).rowcount
+            self._conn.commit()
+
+    def mark_stale(self, subject_id: str, changed_at: float) -> None:
+        # No lock: called on the event loop, where waiting on a thread's SQLite write would block.
+        self._stale[subject_id] = max(self._stale.get(subject_id, 0.0), changed_at)
+
+    def invalidate(self, subject_id: str, changed_at: Optional[float] = None) -> None:
+        """Delete the subject's entries created before `changed_at` (default: now)."""
+        changed_at = time.time() if changed_at is None else changed_at
+        self.mark_stale(subject_id, changed_at)
+        with self._lock:
+            self._count -= self._conn.execute(
+                "DELETE FROM completions WHERE subject_id = ? AND created_at < ?",
+                (subject_id, changed_at),
+            ).rowcount
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        # No lock or query: read on the event loop, from counters kept in memory.
+        lookups = self.hits + self.misses
+        return {
+            "entries": self._count,
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+_cache: Optional[CompletionCache] = None
+_open_lock = threading.Lock()
+
+
+def get_completion_cache() -> Optional[CompletionCache]:
+    """Process-wide cache, or None unless COMPLETION_CACHE_ENABLED is true.
+
+    The first call opens the database; async callers run it in a thread.
+    """
+    global _cache
+    settings = get_settings()
+    if not settings.completion_cache_enabled:
+        return None
+    with _open_lock:
+        if _cache is None:
+            _cache = CompletionCache(
+                settings.completion_cache_path,
+                settings.completion_cache_max_entries,
+                settings.completion_cache_ttl,
+            )
+    return _cache
+
+
+def close_completion_cache() -> None:
+    global _cache
+    if _cache is not None:
+        _cache.close()
+        _cache = None
+
+
+def _delete_subject(subject_id: str, changed_at: float) -> None:
+    try:
+        cache = get_completion_cache()
+        if cache is not None:
+            cache.invalidate(subject_id, changed_at)
+    except Exception as e:
+        print(f"[COMPLETION CACHE] invalidation of subject {subject_id} failed: {e}")
+
+
+@on_corpus_change
+def _invalidate_subject(subject_id: str, document_id: Optional[str], change: str) -> None:
+    if not get_settings().completion_cache_enabled:
+        return
+    changed_at = time.time()
+    if _cache is not None:
+        _cache.mark_stale(subject_id, changed_at)
+    # Listeners must not block: the DELETE (and opening the cache, if needed) runs off the loop.
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        _delete_subject(subject_id, changed_at)
+        return
+    loop.run_in_executor(None, _delete_subject, subject_id, changed_at)
+
+
+async def completion_cache_stats() -> Optional[dict]:
+    cache = await asyncio.to_thread(get_completion_cache)
+    return cache.stats() if cache is not None else None
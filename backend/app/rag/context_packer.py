@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+# "[Source n, Pages a-b]" header plus the "---" separator between sources.
+SOURCE_OVERHEAD_TOKENS = 12
+# Size estimate for chunks stored before token_count existed (no re-tokenizing here).
+CHARS_PER_TOKEN = 4
+# Rows without chunk_index are only merged when at least this much text repeats.
+MIN_LEGACY_OVERLAP_CHARS = 16
+
+
+def chunk_tokens(chunk: dict) -> int:
+    count = chunk.get("token_count")
+    if count is not None:
+        return count
+    return max(1, len(chunk["content"]) // CHARS_PER_TOKEN)
+
+
+def text_overlap(left: str, right: str) -> int:
+    """Length of the longest suffix of `left` that is also a prefix of `right`."""
+    if not left or not right:
+        return 0
+    start = max(0, len(left) - len(right))
+    while True:
+        pos = left.find(right[0], start)
+        if pos < 0:
+            return 0
+        if right.startswith(left[pos:]):
+            return len(left) - pos
+        start = pos + 1
+
+
+def _adjacent(run: dict, chunk: dict) -> bool:
+    if chunk["document_id"] != run["document_id"]:
+        return False
+    index, last = chunk.get("chunk_index"), run["_last_index"]
+    if index is not None and last is not None:
+        return index == last + 1
+    # Rows without chunk_index: only neighbours on touching pages whose texts overlap.
+    return chunk.get("page_number", 0) <= (run.get("page_end") or run.get("page_number", 0)) + 1
+
+
+def _extend(run: dict, chunk: dict) -> bool:
+    indexed = chunk.get("chunk_index") is not None
+    overlap = 0
+    if not indexed or chunk.get("overlap_tokens"):
+        overlap = text_overlap(run["content"], chunk["content"])
+    if not indexed and overlap < MIN_LEGACY_OVERLAP_CHARS:
+        return False
+    if overlap:
+        run["content"] += chunk["content"][overlap:]
+        if indexed:
+            run["token_count"] += max(0, chunk_tokens(chunk) - chunk["overlap_tokens"])
+        else:
+            run["token_count"] += chunk_tokens({"content": chunk["content"][overlap:]})
+    else:
+        run["content"] += "\n" + chunk["content"]
+        run["token_count"] += chunk_tokens(chunk)
+    run["page_end"] = max(
+        run.get("page_end") or run["page_number"], chunk.get("page_end") or chunk["page_number"]
+    )
+    run["chunk_ids"].append(chunk["id"])
+    run["similarity"] = max(run.get("similarity", 0.0), chunk.get("similarity", 0.0))
+    run["_rank"] = min(run["_rank"], chunk["_rank"])
+    run["_last_index"] = chunk.get("chunk_index")
+    return True
+
+
+def _start_run(chunk: dict) -> dict:
+    return {
+        **chunk,
+        "token_count": chunk_tokens(chunk),
+        "chunk_ids": [chunk["id"]],
+        "_last_index": chunk.get("chunk_index"),
+    }
+
+
+def merge_adjacent(chunks: list[dict]) -> list[dict]:
+    """
+    Join consecutive chunks of the same document into single passages, dropping the
+    text repeated by chunk overlap. Passages keep the rank of their best chunk.
+    """
+    ranked: dict[str, dict] = {}
+    for rank, chunk in enumerate(chunks):
+        ranked.setdefault(chunk["id"], {**chunk, "_rank": rank})
+    ordered = sorted(
+        ranked.values(),
+        key=lambda c: (
+            str(c.get("document_id")),
+            c.get("chunk_index") if c.get("chunk_index") is not None else -1,
+            c.get("page_number") or 0,
+            c.get("page_end") or 0,
+        ),
+    )
+    runs: list[dict] = []
+    for chunk in ordered:
+        if runs and _adjacent(runs[-1], chunk) and _extend(runs[-1], chunk):
+            continue
+        runs.append(_start_run(chunk))
+    return runs
+
+
+def pack_chunks(chunks: list[dict], token_budget: int) -> list[dict]:
+    """
+    Most relevant passages (see `merge_adjacent`) that fit in `token_budget` tokens
+    of context, best first. Passages that do not fit are skipped so smaller, less
+    relevant ones can still fill the remainder; the best one is truncated rather
+    than returning nothing when it alone exceeds the budget.
+    """
+    runs = sorted(merge_adjacent(chunks), key=lambda r: r["_rank"])
+    by_id: dict[str, dict] = {}
+    ranks: dict[str, int] = {}
+    for rank, chunk in enumerate(chunks):
+        by_id.setdefault(chunk["id"], chunk)
+        ranks.setdefault(chunk["id"], rank)
+    packed: list[dict] = []
+    used = 0
+    for run in runs:
+        cost = run["token_count"] + SOURCE_OVERHEAD_TOKENS
+        if used + cost > token_budget and len(run["chunk_ids"]) > 1:
+            # The merged passage is too long; fall back to its best single chunk.
+            best = by_id[min(run["chunk_ids"], key=ranks.__getitem__)]
+            run = _start_run({**best, "_rank": run["_rank"]})
+            cost = run["token_count"] + SOURCE_OVERHEAD_TOKENS
+        if used + cost <= token_budget:
+            packed.append(run)
+            used += cost
+        elif not packed:
+            keep = max(1, token_budget - SOURCE_OVERHEAD_TOKENS)
+            chars = len(run["content"]) * keep // max(run["token_count"], 1)
+            packed.append({**run, "content": run["content"][:chars], "token_count": keep})
+            used = token_budget
+    for run in packed:
+        run.pop("_rank", None)
+        run.pop("_last_index", None)
+    return packed
+
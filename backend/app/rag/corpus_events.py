@@ -0,0 +1,32 @@
+from typing import Callable, Optional
+
+# What happened to a subject's indexed chunks.
+DOCUMENT_ADDED = "added"  # a document became ready (upload or duplicate clone)
+DOCUMENT_REPLACED = "replaced"  # a document's chunks were swapped by a re-index
+DOCUMENT_REMOVED = "removed"  # a document and its chunks were deleted
+SUBJECT_REMOVED = "subject_removed"  # the whole subject was deleted (document_id is None)
+
+# Called as listener(subject_id, document_id, change).
+CorpusListener = Callable[[str, Optional[str], str], None]
+
+_listeners: list[CorpusListener] = []
+
+
+def on_corpus_change(listener: CorpusListener) -> CorpusListener:
+    """Register a listener; usable as a decorator. Listeners must be quick and non-blocking."""
+    if listener not in _listeners:
+        _listeners.append(listener)
+    return listener
+
+
+def notify_corpus_change(
+    subject_id: str,
+    document_id: Optional[str] = None,
+    change: str = DOCUMENT_ADDED,
+) -> None:
+    """Tell caches and indexes built from a subject's chunks that they are out of date."""
+    for listener in list(_listeners):
+        try:
+            listener(subject_id, document_id, change)
+        except Exception as e:
+            print(f"[CORPUS] listener {getattr(listener, '__name__', listener)} failed: {e}")
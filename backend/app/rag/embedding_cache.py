@@ -0,0 +1,164 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+import numpy as np
+from app.config import get_settings
+
+# put_many calls between full row counts; in between, the count is kept in memory.
+_RECOUNT_EVERY = 100
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(text.split())
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Persistent embedding cache keyed by (embed model, sha256(normalized text)).
+
+    Backed by SQLite so it survives restarts and is shared by server processes on
+    one host. Holds at most `max_entries` vectors, evicting least recently used. Opening
+    and every read or write do SQLite I/O: call them off the event loop.
+    """
+
+    def __init__(self, path: str, max_entries: int):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                embedding BLOB NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (model, text_hash)
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings(last_used)"
+        )
+        self._conn.commit()
+        self._puts = 0
+        self._count = self._row_count()
+
+    def _row_count(self) -> int:
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        return count
+
+    def get_many(self, model: str, texts: list[str]) -> list[Optional[list[float]]]:
+        hashes = [text_hash(t) for t in texts]
+        found: dict[str, list[float]] = {}
+        with self._lock:
+            unique = list(dict.fromkeys(hashes))
+            # Stay under SQLite's bound-parameter limit.
+            for i in range(0, len(unique), 500):
+                part = unique[i:i + 500]
+                placeholders = ",".join("?" * len(part))
+                rows = self._conn.execute(
+                    f"SELECT text_hash, embedding FROM embeddings "
+                    f"WHERE model = ? AND text_hash IN ({placeholders})",
+                    [model, *part],
+                ).fetchall()
+                for h, blob in rows:
+                    found[h] = np.frombuffer(blob, dtype=np.float32).tolist()
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE model = ? AND text_hash = ?",
+                    [(now, model, h) for h in found],
+                )
+                self._conn.commit()
+            results = [found.get(h) for h in hashes]
+            hit_count = sum(1 for r in results if r is not None)
+            self.hits += hit_count
+            self.misses += len(results) - hit_count
+        return results
+
+    def put_many(self, model: str, texts: list[str], embeddings: list[list[float]]) -> None:
+        now = time.time()
+        rows = [
+            (model, text_hash(t), np.asarray(e, dtype=np.float32).tobytes(), now)
+            for t, e in zip(texts, embeddings)
+        ]
+        with self._lock:
+            # Rows stored meanwhile by another request or process are kept as they are.
+            added = self._conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (model, text_hash, embedding, last_used) "
+                "VALUES (?, ?, ?, ?)",
+                rows,
+            ).rowcount
+            self._count += added
+            self._puts += 1
+            if self._puts % _RECOUNT_EVERY == 0:
+                # Other processes sharing the file insert and evict too.
+                self._count = self._row_count()
+            excess = self._count - self.max_entries
+            if excess > 0:
+                self._count -= self._conn.execute(
+                    "DELETE FROM embeddings WHERE rowid IN "
+                    "(SELECT rowid FROM embeddings ORDER BY last_used LIMIT ?)",
+                    (excess,),
+                ).rowcount
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        # No lock or query: read on the event loop, from counters kept in memory.
+        lookups = self.hits + self.misses
+        return {
+            "entries": self._count,
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+_cache: Optional[EmbeddingCache] = None
+_open_lock = threading.Lock()
+
+
+def get_embedding_cache() -> Optional[EmbeddingCache]:
+    """Process-wide cache, or None when EMBEDDING_CACHE_ENABLED is false.
+
+    The first call opens the database; async callers run it in a thread.
+    """
+    global _cache
+    settings = get_settings()
+    if not settings.embedding_cache_enabled:
+        return None
+    with _open_lock:
+        if _cache is None:
+            _cache = EmbeddingCache(
+                settings.embedding_cache_path, settings.embedding_cache_max_entries
+            )
+    return _cache
+
+
+def close_embedding_cache() -> None:
+    global _cache
+    if _cache is not None:
+        _cache.close()
+        _cache = None
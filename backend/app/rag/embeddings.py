@@ -1,32 +1,163 @@
+import asyncio
+import time
+from typing import Optional
+
 import httpx
 from app.config import get_settings
+from app.rag.embedding_cache import get_embedding_cache, text_hash
+from app.rag.llm_scheduler import get_llm_scheduler
+from app.rag.single_flight import SingleFlight
+from app.utils.http_client import get_http_client
 
 MAX_EMBED_CHARS = 2000
 
+# None until the first batch call; False once Ollama answered 404 on /api/embed
+# (builds older than 0.3.4 only expose the single-prompt /api/embeddings).
+_batch_endpoint_supported: Optional[bool] = None
 
-async def generate_embedding(text: str) -> list[float]:
+# Time spent in Ollama per embedded input, used to estimate what cache hits save.
+_ollama_seconds = 0.0
+_ollama_inputs = 0
+
+_flights = SingleFlight()
+
+
+def _embed_timeout() -> httpx.Timeout:
     settings = get_settings()
+    return httpx.Timeout(settings.ollama_embed_timeout, connect=settings.ollama_connect_timeout)
+
+
+def _truncate(text: str) -> str:
     if len(text) > MAX_EMBED_CHARS:
-        text = text[:MAX_EMBED_CHARS]
-
-    timeout = httpx.Timeout(120.0, connect=30.0)
-    async with httpx.AsyncClient(timeout=timeout) as client:
-        response = await client.post(
-            f"{settings.ollama_base_url}/api/embeddings",
-            json={
-                "model": settings.ollama_embed_model,
-                "prompt": text,
-            },
+        return text[:MAX_EMBED_CHARS]
+    return text
+
+
+async def _embed_single(client: httpx.AsyncClient, text: str) -> list[float]:
+    settings = get_settings()
+    response = await client.post(
+        f"{settings.ollama_base_url}/api/embeddings",
+        json={
+            "model": settings.ollama_embed_model,
+            "prompt": text,
+        },
+        timeout=_embed_timeout(),
+    )
+    if response.status_code != 200:
+        print(f"[EMBEDDING ERROR] Status: {response.status_code}, Body: {response.text[:500]}")
+        response.raise_for_status()
+    return response.json()["embedding"]
+
+
+async def _embed_many(
+    client: httpx.AsyncClient, texts: list[str]
+) -> Optional[list[list[float]]]:
+    """One /api/embed request for many inputs. Returns None when the endpoint is missing."""
+    global _batch_endpoint_supported
+    settings = get_settings()
+    response = await client.post(
+        f"{settings.ollama_base_url}/api/embed",
+        json={
+            "model": settings.ollama_embed_model,
+            "input": texts,
+        },
+        timeout=_embed_timeout(),
+    )
+    if response.status_code == 404 and "model" not in response.text.lower():
+        _batch_endpoint_supported = False
+        return None
+    if response.status_code != 200:
+        print(f"[EMBEDDING ERROR] Status: {response.status_code}, Body: {response.text[:500]}")
+        response.raise_for_status()
+    _batch_endpoint_supported = True
+    embeddings = response.json()["embeddings"]
+    if len(embeddings) != len(texts):
+        raise ValueError(
+            f"Ollama returned {len(embeddings)} embeddings for {len(texts)} inputs"
         )
-        if response.status_code != 200:
-            print(f"[EMBEDDING ERROR] Status: {response.status_code}, Body: {response.text[:500]}")
-            response.raise_for_status()
-        return response.json()["embedding"]
+    return embeddings
+
+
+async def _embed_uncached(texts: list[str]) -> list[list[float]]:
+    global _ollama_seconds, _ollama_inputs
+    settings = get_settings()
+    batch_size = max(1, settings.embed_batch_size)
+    semaphore = asyncio.Semaphore(max(1, settings.embed_max_concurrency))
+    client = get_http_client()
+    scheduler = get_llm_scheduler()
+
+    async def run_batch(batch: list[str]) -> list[list[float]]:
+        async with semaphore, scheduler.slot():
+            if _batch_endpoint_supported is not False:
+                embeddings = await _embed_many(client, batch)
+                if embeddings is not None:
+                    return embeddings
+            # Older Ollama: fall back to one request per input.
+            return [await _embed_single(client, t) for t in batch]
+
+    started = time.perf_counter()
+    if len(texts) == 1:
+        async with scheduler.slot():
+            results = [[await _embed_single(client, texts[0])]]
+    else:
+        batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+        results = await asyncio.gather(*(run_batch(b) for b in batches))
+    _ollama_seconds += time.perf_counter() - started
+    _ollama_inputs += len(texts)
+
+    return [emb for batch in results for emb in batch]
+
+
+async def generate_embedding(text: str) -> list[float]:
+    return (await generate_embeddings_batch([text]))[0]
 
 
 async def generate_embeddings_batch(texts: list[str]) -> list[list[float]]:
-    embeddings = []
-    for text in texts:
-        emb = await generate_embedding(text)
-        embeddings.append(emb)
-    return embeddings
+    """
+    Embed many texts using Ollama's multi-input /api/embed endpoint.
+
+    The persistent embedding cache is consulted first; only misses (deduplicated)
+    go to Ollama, split into batches of `embed_batch_size` with at most
+    `embed_max_concurrency` batches in flight. Results are returned in input order.
+    """
+    if not texts:
+        return []
+
+    settings = get_settings()
+    model = settings.ollama_embed_model
+    inputs = [_truncate(t) for t in texts]
+    cache = await asyncio.to_thread(get_embedding_cache)
+    if cache is None:
+        results = [None] * len(inputs)
+    else:
+        results = await asyncio.to_thread(cache.get_many, model, inputs)
+
+    async def embed_and_store(batch: list[str]) -> list[list[float]]:
+        embeddings = await _embed_uncached(batch)
+        if cache is not None:
+            await asyncio.to_thread(cache.put_many, model, batch, embeddings)
+        return embeddings
+
+    missing = list(dict.fromkeys(t for t, r in zip(inputs, results) if r is None))
+    if missing:
+        # Texts another request is already embedding are awaited, not sent again.
+        fresh = await _flights.do_many(
+            missing, lambda t: (model, text_hash(t)), embed_and_store
+        )
+        by_text = dict(zip(missing, fresh))
+        results = [r if r is not None else by_text[t] for t, r in zip(inputs, results)]
+    return results
+
+
+async def embedding_cache_stats() -> Optional[dict]:
+    cache = await asyncio.to_thread(get_embedding_cache)
+    if cache is None:
+        return None
+    stats = cache.stats()
+    per_input = _ollama_seconds / _ollama_inputs if _ollama_inputs else 0.0
+    stats["estimated_ollama_seconds_saved"] = round(stats["hits"] * per_input, 2)
+    return stats
+
+
+def embedding_single_flight_stats() -> dict:
+    return _flights.stats()
@@ -0,0 +1,238 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import math
+import re
+import time
+from collections import Counter
+from typing import Optional
+
+import numpy as np
+from app.config import get_settings
+from app.rag.corpus_events import DOCUMENT_REMOVED, on_corpus_change
+from app.rag.vector_index import (
+    CHUNK_COLUMNS,
+    SubjectIndexStore,
+    fetch_chunk_rows,
+    top_k_indices,
+    unready_document_ids,
+)
+
+# Words, numbers and dotted/hyphenated compounds such as "3.2", "h2o", "x-ray", "e.g".
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:[.\-'][a-z0-9]+)*")
+MAX_TERM_LENGTH = 40
+STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have in into is it its of on or "
+    "that the their there these this to was were which will with".split()
+)
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def tokenize(text: str) -> list[str]:
+    terms: list[str] = []
+    for token in _TOKEN_RE.findall(text.lower()):
+        if len(token) > MAX_TERM_LENGTH or token in STOPWORDS:
+            continue
+        terms.append(token)
+        # Also index the parts of compounds so "x-ray" matches "ray" and "3.2" matches "3".
+        if any(sep in token for sep in ".-'"):
+            terms.extend(p for p in re.split(r"[.\-']", token) if p and p not in STOPWORDS)
+    return terms
+
+
+def term_frequencies(text: str) -> dict[str, int]:
+    """Per-chunk term counts stored in document_chunks.lexical_terms at ingestion."""
+    return dict(Counter(tokenize(text)))
+
+
+def _row_terms(row: dict) -> dict[str, int]:
+    terms = row.pop("lexical_terms", None)
+    if isinstance(terms, str):
+        terms = json.loads(terms)
+    # Chunks ingested before lexical_terms existed are tokenized on load.
+    return terms if terms is not None else term_frequencies(row["content"])
+
+
+class SubjectLexicalIndex:
+    """BM25 over one subject's chunks, as term → (row indices, term counts) postings."""
+
+    def __init__(self, subject_id: str, rows: list[dict], terms: list[dict[str, int]]):
+        self.subject_id = subject_id
+        self.rows = rows
+        self.terms = terms
+        self.checked_at = time.monotonic()
+        lengths = np.array([sum(t.values()) for t in terms], dtype=np.float32)
+        self._norm = (
+            BM25_K1 * (1 - BM25_B + BM25_B * lengths / max(float(lengths.mean()), 1.0))
+            if len(terms) else lengths
+        )
+        postings: dict[str, tuple[list[int], list[int]]] = {}
+        for i, counts in enumerate(terms):
+            for term, count in counts.items():
+                entry = postings.setdefault(term, ([], []))
+                entry[0].append(i)
+                entry[1].append(count)
+        self._postings = {
+            term: (np.array(idx, dtype=np.int64), np.array(tf, dtype=np.float32))
+            for term, (idx, tf) in postings.items()
+        }
+
+    def search(self, query: str, k: int) -> list[dict]:
+        n = len(self.rows)
+        if not n:
+            return []
+        scores = np.zeros(n, dtype=np.float32)
+        for term in set(tokenize(query)):
+            posting = self._postings.get(term)
+            if posting is None:
+                continue
+            idx, tf = posting
+            idf = math.log(1 + (n - len(idx) + 0.5) / (len(idx) + 0.5))
+            scores[idx] += idf * tf * (BM25_K1 + 1) / (tf + self._norm[idx])
+        order = [i for i in top_k_indices(scores, k) if scores[i] > 0]
+        return [{**self.rows[i], "lexical_score": float(scores[i])} for i in order]
+
+    def updated(self, ops: list[tuple[str, str]]) -> SubjectLexicalIndex:
+        """A new index with the given (document_id, change) events applied."""
+        changed = {document_id for document_id, _ in ops}
+        keep = [i for i, row in enumerate(self.rows) if row["document_id"] not in changed]
+        rows = [self.rows[i] for i in keep]
+        terms = [self.terms[i] for i in keep]
+        latest = dict(ops)
+        for document_id, change in latest.items():
+            if change == DOCUMENT_REMOVED:
+                continue
+            for row in fetch_chunk_rows("document_id", document_id, f"{CHUNK_COLUMNS}, lexical_terms"):
+                terms.append(_row_terms(row))
+                rows.append(row)
+        return SubjectLexicalIndex(self.subject_id, rows, terms)
+
+
+class LexicalIndexStore(SubjectIndexStore):
+    """
+    Lazily built per-subject BM25 indexes, kept for the `max_subjects` most recently
+    used subjects.
+    """
+
+    def __init__(
+        self,
+        max_subjects: int,
+        refresh_seconds: float = 300.0,
+        warmup_wait: float = 0.5,
+    ):
+        super().__init__(refresh_seconds)
+        self.max_subjects = max(1, max_subjects)
+        self.warmup_wait = warmup_wait
+        self.searches = 0
+        self.not_ready = 0
+        self._warming: dict[str, asyncio.Task] = {}
+
+    def _load(self, subject_id: str) -> SubjectLexicalIndex:
+        unready = unready_document_ids(subject_id)
+        rows = [
+            row for row in fetch_chunk_rows("subject_id", subject_id, f"{CHUNK_COLUMNS}, lexical_terms")
+            if row["document_id"] not in unready
+        ]
+        terms = [_row_terms(row) for row in rows]
+        self.loads += 1
+        return SubjectLexicalIndex(subject_id, rows, terms)
+
+    def _apply(self, index: SubjectLexicalIndex, ops: list[tuple[str, str]]) -> SubjectLexicalIndex:
+        return index.updated(ops)
+
+    def _over_capacity(self) -> bool:
+        return len(self._indexes) > self.max_subjects
+
+    async def _warm(self, subject_id: str) -> None:
+        try:
+            await self._get_index(subject_id)
+        except Exception as e:
+            print(f"[LEXICAL INDEX] Loading subject {subject_id} failed: {e}")
+        finally:
+            self._warming.pop(subject_id, None)
+
+    async def search(
+        self, subject_id: str, teacher_id: str, query: str, top_k: int
+    ) -> Optional[list[dict]]:
+        """
+        BM25 hits for the query, or None while the subject's index is still loading.
+
+        A subject that is not loaded yet is built in the background; the search waits
+        up to `warmup_wait` seconds for it rather than fetching every chunk's terms on
+        the request path.
+        """
+        if subject_id not in self._indexes:
+            task = self._warming.get(subject_id)
+            if task is None:
+                task = asyncio.ensure_future(self._warm(subject_id))
+                self._warming[subject_id] = task
+            await asyncio.wait({task}, timeout=self.warmup_wait)
+            if subject_id not in self._indexes:
+                self.not_ready += 1
+                return None
+        index = await self._get_index(subject_id)
+        self.searches += 1
+        return [c for c in index.search(query, top_k) if c["teacher_id"] == teacher_id]
+
+    def stats(self) -> dict:
+        return {
+            "subjects": len(self._indexes),
+            "chunks": sum(len(index.rows) for index in self._indexes.values()),
+            "terms": sum(len(index._postings) for index in self._indexes.values()),
+            "loads": self.loads,
+            "evictions": self.evictions,
+            "searches": self.searches,
+            "not_ready": self.not_ready,
+        }
+
+
+_store: Optional[LexicalIndexStore] = None
+
+
+def get_lexical_index() -> LexicalIndexStore:
+    global _store
+    if _store is None:
+        settings = get_settings()
+        _store = LexicalIndexStore(
+            settings.lexical_index_max_subjects,
+            settings.vector_index_refresh_seconds,
+            settings.lexical_index_warmup_wait,
+        )
+    return _store
+
+
+@on_corpus_change
+def _on_corpus_change(subject_id: str, document_id: Optional[str], change: str) -> None:
+    if _store is not None:
+        _store.on_change(subject_id, document_id, change)
+
+
+def lexical_index_stats() -> Optional[dict]:
+    if not get_settings().hybrid_retrieval:
+        return None
+    return get_lexical_index().stats()
+
+
+def reciprocal_rank_fusion(rankings: list[list[dict]], k: int, top_k: int) -> list[dict]:
+    """
+    Merge ranked chunk lists by RRF: score(c) = Σ 1 / (k + rank_i(c)).
+
+    Fields from every list are merged per chunk id, so vector `similarity` and
+    `lexical_score` both survive when a chunk appears in both rankings. Chunks found
+    only by BM25 have no `similarity`; the caller fills in their cosine similarity.
+    """
+    scores: dict[str, float] = {}
+    merged: dict[str, dict] = {}
+    for ranking in rankings:
+        for rank, chunk in enumerate(ranking, 1):
+            chunk_id = chunk["id"]
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (k + rank)
+            merged[chunk_id] = {**chunk, **merged.get(chunk_id, {})}
+    order = sorted(scores, key=lambda cid: scores[cid], reverse=True)[:top_k]
+    return [
+        {**merged[cid], "rrf_score": scores[cid]}
+        for cid in order
+    ]
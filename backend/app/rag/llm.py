@@ -1,8 +1,14 @@
+import asyncio
 import httpx
 import json
-from typing import Optional
+import time
+from typing import AsyncIterator, Callable, Optional
 
 from app.config import get_settings
+from app.rag.completion_cache import completion_scope, get_completion_cache
+from app.rag.llm_scheduler import get_llm_scheduler
+from app.rag.single_flight import SingleFlight, request_key
+from app.utils.http_client import get_http_client
 
 
 def _ollama_missing_model_message(
@@ -26,45 +32,105 @@ def _ollama_missing_model_message(
     return None
 
 
-async def generate_response(prompt: str, system_prompt: str = "") -> str:
-    settings = get_settings()
+# Default styling instructions to ensure list-based, scannable output
+STYLE_MANDATE = (
+    "\n\nFORMATTING RULES:\n"
+    "- Use clear Markdown headers (##, ###).\n"
+    "- Use ORDERED (numbered) lists (1., 2., 3.) for all main points.\n"
+    "- **Bold** key terms and important concepts.\n"
+    "- Avoid long paragraphs; keep explanations concise."
+)
 
-    # Default styling instructions to ensure list-based, scannable output
-    style_mandate = (
-        "\n\nFORMATTING RULES:\n"
-        "- Use clear Markdown headers (##, ###).\n"
-        "- Use ORDERED (numbered) lists (1., 2., 3.) for all main points.\n"
-        "- **Bold** key terms and important concepts.\n"
-        "- Avoid long paragraphs; keep explanations concise."
-    )
+GENERATION_OPTIONS = {
+    "temperature": 0.3,  # Low temperature keeps it focused
+    "num_predict": 4096,
+}
+
+
+_flights = SingleFlight()
 
-    messages = []
+
+def _system_content(prompt: str, system_prompt: str) -> str:
     # If no system prompt is provided, we use a default educational one
     if not system_prompt:
         system_prompt = "You are a helpful assistant that provides structured, easy-to-read educational content."
-    
+
     # We only append styling if we're not asking for a structured JSON format to avoid parsing errors
     is_json_request = "json" in system_prompt.lower() or "json" in prompt.lower()
-    final_system_content = system_prompt + (style_mandate if not is_json_request else "")
-    
-    messages.append({"role": "system", "content": final_system_content})
-    messages.append({"role": "user", "content": prompt})
-
-    timeout = httpx.Timeout(300.0, connect=30.0)
-    async with httpx.AsyncClient(timeout=timeout) as client:
-        try:
-            chat_payload = {
-                "model": settings.ollama_llm_model,
-                "messages": messages,
-                "stream": False,
-                "options": {
-                    "temperature": 0.3,  # Low temperature keeps it focused
-                    "num_predict": 4096,
-                },
-            }
+    return system_prompt + (STYLE_MANDATE if not is_json_request else "")
+
+
+async def generate_response(
+    prompt: str,
+    system_prompt: str = "",
+    validate: Optional[Callable[[str], bool]] = None,
+) -> str:
+    """
+    Completion for `prompt`. Inside a completion-cache scope the result is cached;
+    with `validate`, only text it accepts is stored or served from the cache.
+    """
+    settings = get_settings()
+    final_system_content = _system_content(prompt, system_prompt)
+    messages = [
+        {"role": "system", "content": final_system_content},
+        {"role": "user", "content": prompt},
+    ]
+
+    key = request_key(settings.ollama_llm_model, messages, GENERATION_OPTIONS)
+    subject_id = completion_scope()
+    cache = await asyncio.to_thread(get_completion_cache) if subject_id else None
+    started_at = time.time()
+    if cache is not None:
+        cached = await asyncio.to_thread(cache.get, subject_id, key)
+        if cached is not None and (validate is None or validate(cached)):
+            return cached
+
+    async def run() -> str:
+        # Admission control happens before the try: a full queue surfaces as HTTP 429,
+        # not as an "**Error:**" answer.
+        async with get_llm_scheduler().slot():
+            text = await _complete(prompt, final_system_content, messages)
+        storable = text and not text.startswith("**Error:**")
+        if cache is not None and storable and (validate is None or validate(text)):
+            await asyncio.to_thread(
+                cache.put, subject_id, key, settings.ollama_llm_model, text, started_at
+            )
+        return text
+
+    # Identical concurrent requests (e.g. a class opening the same notes) share one run.
+    return await _flights.do(key, run)
+
+
+async def _complete(prompt: str, final_system_content: str, messages: list[dict]) -> str:
+    settings = get_settings()
+    client = get_http_client()
+    try:
+        chat_payload = {
+            "model": settings.ollama_llm_model,
+            "messages": messages,
+            "stream": False,
+            "options": GENERATION_OPTIONS,
+        }
+        response = await client.post(
+            f"{settings.ollama_base_url}/api/chat",
+            json=chat_payload,
+        )
+        if response.status_code == 404:
+            missing = _ollama_missing_model_message(
+                response.status_code, response.text, settings.ollama_llm_model
+            )
+            if missing:
+                return missing
+            # Older Ollama builds may not expose /api/chat; fallback to /api/generate.
+            generate_prompt = f"System:\n{final_system_content}\n\nUser:\n{prompt}"
             response = await client.post(
-                f"{settings.ollama_base_url}/api/chat",
-                json=chat_payload,
+                f"{settings.ollama_base_url}/api/generate",
+                json={
+                    "model": settings.ollama_llm_model,
+                    "prompt": generate_prompt,
+                    "stream": False,
+                    "options": GENERATION_OPTIONS,
+                },
             )
             if response.status_code == 404:
                 missing = _ollama_missing_model_message(
@@ -72,34 +138,135 @@ async def generate_response(prompt: str, system_prompt: str = "") -> str:
                 )
                 if missing:
                     return missing
-                # Older Ollama builds may not expose /api/chat; fallback to /api/generate.
-                generate_prompt = f"System:\n{final_system_content}\n\nUser:\n{prompt}"
-                response = await client.post(
-                    f"{settings.ollama_base_url}/api/generate",
-                    json={
-                        "model": settings.ollama_llm_model,
-                        "prompt": generate_prompt,
-                        "stream": False,
-                        "options": chat_payload["options"],
-                    },
-                )
-                if response.status_code == 404:
-                    missing = _ollama_missing_model_message(
-                        response.status_code, response.text, settings.ollama_llm_model
+            response.raise_for_status()
+            data = response.json()
+            return data.get("response", "").strip()
+
+        response.raise_for_status()
+        data = response.json()
+        return data["message"]["content"].strip()
+    except httpx.HTTPStatusError as e:
+        return f"**Error:** The LLM service returned an error: {e}"
+    except Exception as e:
+        return f"**Error:** An unexpected error occurred: {e}"
+
+
+def _stream_stats(data: dict) -> dict:
+    """Token counts and durations (ms) from Ollama's final streamed object."""
+    eval_count = data.get("eval_count") or 0
+    eval_ns = data.get("eval_duration") or 0
+    return {
+        "prompt_tokens": data.get("prompt_eval_count"),
+        "completion_tokens": eval_count,
+        "load_ms": round((data.get("load_duration") or 0) / 1e6, 1),
+        "prompt_eval_ms": round((data.get("prompt_eval_duration") or 0) / 1e6, 1),
+        "eval_ms": round(eval_ns / 1e6, 1),
+        "tokens_per_second": round(eval_count / (eval_ns / 1e9), 2) if eval_ns else None,
+    }
+
+
+async def _stream_lines(response: httpx.Response, key: str) -> AsyncIterator[dict]:
+    # Ollama streams one JSON object per line; `key` is "message" (/api/chat) or "response".
+    async for line in response.aiter_lines():
+        if not line.strip():
+            continue
+        data = json.loads(line)
+        if data.get("error"):
+            raise RuntimeError(f"Ollama error: {data['error']}")
+        text = data["message"].get("content", "") if key == "message" else data.get("response", "")
+        if text:
+            yield {"token": text}
+        if data.get("done"):
+            yield {"done": True, **_stream_stats(data)}
+            return
+
+
+async def stream_response(prompt: str, system_prompt: str = "") -> AsyncIterator[dict]:
+    """
+    Streaming counterpart of `generate_response`: yields {"token": str} items as
+    Ollama produces them, then one {"done": True, ...} item with token counts and
+    timings. Falls back to a streamed /api/generate on builds without /api/chat.
+    Transport errors are raised rather than returned as text. Shares the completion
+    cache with `generate_response`; a hit is yielded as one token.
+    """
+    settings = get_settings()
+    messages = [
+        {"role": "system", "content": _system_content(prompt, system_prompt)},
+        {"role": "user", "content": prompt},
+    ]
+    key = request_key(settings.ollama_llm_model, messages, GENERATION_OPTIONS)
+    subject_id = completion_scope()
+    cache = await asyncio.to_thread(get_completion_cache) if subject_id else None
+    started_at = time.time()
+    if cache is not None:
+        cached = await asyncio.to_thread(cache.get, subject_id, key)
+        if cached is not None:
+            yield {"token": cached}
+            yield {"done": True, "cached": True}
+            return
+
+    parts: list[str] = []
+    # The scheduler slot is held for the whole generation, until the stream is closed.
+    async with get_llm_scheduler().slot():
+        async for item in _stream(prompt, system_prompt):
+            if "token" in item:
+                parts.append(item["token"])
+            elif cache is not None and "eval_ms" in item:
+                # Only a completed Ollama stream is stored, never the missing-model notice.
+                text = "".join(parts).strip()
+                if text:
+                    await asyncio.to_thread(
+                        cache.put, subject_id, key, settings.ollama_llm_model, text, started_at
                     )
-                    if missing:
-                        return missing
-                response.raise_for_status()
-                data = response.json()
-                return data.get("response", "").strip()
+            yield item
+
 
+async def _stream(prompt: str, system_prompt: str) -> AsyncIterator[dict]:
+    settings = get_settings()
+    final_system_content = _system_content(prompt, system_prompt)
+    client = get_http_client()
+    chat_payload = {
+        "model": settings.ollama_llm_model,
+        "messages": [
+            {"role": "system", "content": final_system_content},
+            {"role": "user", "content": prompt},
+        ],
+        "stream": True,
+        "options": GENERATION_OPTIONS,
+    }
+    async with client.stream("POST", f"{settings.ollama_base_url}/api/chat", json=chat_payload) as response:
+        if response.status_code != 404:
             response.raise_for_status()
-            data = response.json()
-            return data["message"]["content"].strip()
-        except httpx.HTTPStatusError as e:
-            return f"**Error:** The LLM service returned an error: {e}"
-        except Exception as e:
-            return f"**Error:** An unexpected error occurred: {e}"
+            async for item in _stream_lines(response, "message"):
+                yield item
+            return
+        missing = _ollama_missing_model_message(
+            404, (await response.aread()).decode(errors="replace"), settings.ollama_llm_model
+        )
+    if missing:
+        yield {"token": missing}
+        yield {"done": True}
+        return
+
+    # Older Ollama builds may not expose /api/chat; fallback to /api/generate.
+    generate_payload = {
+        "model": settings.ollama_llm_model,
+        "prompt": f"System:\n{final_system_content}\n\nUser:\n{prompt}",
+        "stream": True,
+        "options": GENERATION_OPTIONS,
+    }
+    async with client.stream("POST", f"{settings.ollama_base_url}/api/generate", json=generate_payload) as response:
+        if response.status_code == 404:
+            missing = _ollama_missing_model_message(
+                404, (await response.aread()).decode(errors="replace"), settings.ollama_llm_model
+            )
+            if missing:
+                yield {"token": missing}
+                yield {"done": True}
+                return
+        response.raise_for_status()
+        async for item in _stream_lines(response, "response"):
+            yield item
 
 
 async def generate_quiz_json(
@@ -144,8 +311,11 @@ async def generate_quiz_json(
         f"Final Check: Ensure EVERY question is relevant to the topic '{topic or 'general concepts'}' and follows style '{instructions or 'standard academic'}' before returning."
     )
 
-    raw = await generate_response(prompt, system_prompt)
+    raw = await generate_response(prompt, system_prompt, validate=_is_quiz_json)
+    return _parse_quiz_json(raw)
+
 
+def _parse_quiz_json(raw: str) -> list[dict]:
     start = raw.find("[")
     end = raw.rfind("]") + 1
     if start == -1 or end == 0:
@@ -154,7 +324,16 @@ async def generate_quiz_json(
     return json.loads(raw[start:end])
 
 
-async def generate_notes_text(context: str, topic: str) -> str:
+def _is_quiz_json(raw: str) -> bool:
+    # Unparseable quiz output must not be cached, or every retry would get it back.
+    try:
+        _parse_quiz_json(raw)
+    except ValueError:
+        return False
+    return True
+
+
+def _notes_prompts(context: str, topic: str) -> tuple[str, str]:
     system_prompt = (
         "You are an expert academic content creator. Your goal is to transform teaching materials into "
         "highly professional, scannable, and aesthetically pleasing study notes using Markdown.\n\n"
@@ -183,6 +362,19 @@ async def generate_notes_text(context: str, topic: str) -> str:
         f"Generate the notes now using the strict formatting rules provided."
     )
 
-    notes = await generate_response(prompt, system_prompt)
-    print(f"\n--- GENERATED NOTES START ---\n{notes}\n--- GENERATED NOTES END ---\n")
-    return notes
+    return prompt, system_prompt
+
+
+async def generate_notes_text(context: str, topic: str) -> str:
+    prompt, system_prompt = _notes_prompts(context, topic)
+    return await generate_response(prompt, system_prompt)
+
+
+def stream_notes_text(context: str, topic: str) -> AsyncIterator[dict]:
+    """Notes as `stream_response` items, for progressive rendering."""
+    prompt, system_prompt = _notes_prompts(context, topic)
+    return stream_response(prompt, system_prompt)
+
+
+def llm_single_flight_stats() -> dict:
+    return _flights.stats()
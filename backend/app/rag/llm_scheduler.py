@@ -0,0 +1,257 @@
+from __future__ import annotations
+
+import asyncio
+import math
+import time
+from collections import Counter, OrderedDict, deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import AsyncIterator, Optional
+
+from fastapi import HTTPException
+from app.config import get_settings
+
+# Priority lanes, highest first.
+LANE_INTERACTIVE = "interactive"  # /ask
+LANE_GENERATION = "generation"    # quiz, notes, /ask/batch
+LANE_INGESTION = "ingestion"      # document embeddings
+LANES = (LANE_INTERACTIVE, LANE_GENERATION, LANE_INGESTION)
+
+# Set per request/task by the services; every Ollama call made from there inherits them.
+_lane: ContextVar[str] = ContextVar("llm_lane", default=LANE_GENERATION)
+_teacher: ContextVar[str] = ContextVar("llm_teacher", default="")
+
+WAIT_SAMPLES = 1000
+
+
+def set_llm_priority(lane: str, teacher_id: str = "") -> None:
+    """Lane and teacher for Ollama calls made from the current task (and tasks it spawns)."""
+    _lane.set(lane)
+    _teacher.set(teacher_id)
+
+
+def current_lane() -> str:
+    shared = _shared.get()
+    return shared.lane if shared is not None else _lane.get()
+
+
+class SharedPriority:
+    """
+    Lane of one call that several callers wait on (see SingleFlight): the highest lane
+    among the callers currently joined. A call already queued in the scheduler moves
+    to the new lane when that changes, so an /ask caller that joins a call started by
+    ingestion does not wait at ingestion priority.
+    """
+
+    def __init__(self) -> None:
+        self.lane = current_lane()
+        self._callers: Counter[str] = Counter()
+        # (scheduler, teacher, future) while the call waits for a slot.
+        self._queued: Optional[tuple[LLMScheduler, str, asyncio.Future]] = None
+
+    @property
+    def background(self) -> bool:
+        """True while an ingestion caller waits too; such calls are never rejected."""
+        return LANE_INGESTION in self._callers
+
+    def bind(self) -> None:
+        """Make Ollama calls from the current task use this priority."""
+        _shared.set(self)
+
+    def join(self) -> str:
+        """Add the current task as a caller; returns its lane for `leave`."""
+        lane = current_lane()
+        self._callers[lane] += 1
+        self._update()
+        return lane
+
+    def leave(self, lane: str) -> None:
+        self._callers[lane] -= 1
+        if self._callers[lane] <= 0:
+            del self._callers[lane]
+        self._update()
+
+    def _update(self) -> None:
+        if not self._callers:
+            return
+        lane = min(self._callers, key=LANES.index)
+        if lane == self.lane:
+            return
+        previous, self.lane = self.lane, lane
+        if self._queued is not None:
+            scheduler, teacher_id, future = self._queued
+            scheduler._move(previous, lane, teacher_id, future)
+
+
+_shared: ContextVar[Optional[SharedPriority]] = ContextVar("llm_shared_priority", default=None)
+
+
+class LLMOverloaded(HTTPException):
+    def __init__(self, lane: str, retry_after: int):
+        super().__init__(
+            status_code=429,
+            detail=f"The model is busy ({lane} queue is full). Please retry in {retry_after}s.",
+            headers={"Retry-After": str(retry_after)},
+        )
+        self.retry_after = retry_after
+
+
+class _LaneStats:
+    def __init__(self) -> None:
+        self.admitted = 0
+        self.rejected = 0
+        self.waits: deque[float] = deque(maxlen=WAIT_SAMPLES)
+
+    def snapshot(self, queued: int) -> dict:
+        waits = sorted(self.waits)
+        return {
+            "queued": queued,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "wait_ms_mean": round(sum(waits) / len(waits) * 1000, 1) if waits else 0.0,
+            "wait_ms_p95": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))] * 1000, 1) if waits else 0.0,
+        }
+
+
+class LLMScheduler:
+    """
+    Admission control for Ollama: at most `max_in_flight` calls run at once. Waiting
+    calls are served strictly by lane priority, and within a lane round-robin across
+    teachers so one teacher's burst cannot starve the others. A lane whose queue
+    already holds `max_queue` calls rejects new ones with LLMOverloaded (429);
+    the ingestion lane is background work and never rejects.
+    """
+
+    def __init__(self, max_in_flight: int, max_queue: int, min_retry_after: int = 1):
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_queue = max(0, max_queue)
+        self.min_retry_after = max(1, min_retry_after)
+        self.in_flight = 0
+        # lane -> teacher -> waiters (futures resolved when a slot is handed over)
+        self._waiting: dict[str, OrderedDict[str, deque[asyncio.Future]]] = {
+            lane: OrderedDict() for lane in LANES
+        }
+        self._queued = {lane: 0 for lane in LANES}
+        self._stats = {lane: _LaneStats() for lane in LANES}
+        self._service_seconds = 0.0  # moving average of how long a slot is held
+
+    def _retry_after(self) -> int:
+        queued = sum(self._queued.values())
+        estimate = self._service_seconds * (queued + 1) / self.max_in_flight
+        return max(self.min_retry_after, math.ceil(estimate))
+
+    def _dispatch(self) -> None:
+        for lane in LANES:
+            teachers = self._waiting[lane]
+            while teachers and self.in_flight < self.max_in_flight:
+                teacher, waiters = next(iter(teachers.items()))
+                future = waiters.popleft()
+                if waiters:
+                    teachers.move_to_end(teacher)
+                else:
+                    del teachers[teacher]
+                self._queued[lane] -= 1
+                if not future.done():
+                    self.in_flight += 1
+                    future.set_result(None)
+
+    async def acquire(
+        self, lane: str, teacher_id: str, shared: Optional[SharedPriority] = None
+    ) -> None:
+        """Wait for a slot. With `shared`, the call follows that priority while it waits."""
+        if shared is not None:
+            lane = shared.lane
+        if self.in_flight < self.max_in_flight and not any(self._queued.values()):
+            self.in_flight += 1
+            self._stats[lane].admitted += 1
+            self._stats[lane].waits.append(0.0)
+            return
+        background = lane == LANE_INGESTION or (shared is not None and shared.background)
+        if not background and self._queued[lane] >= self.max_queue:
+            self._stats[lane].rejected += 1
+            raise LLMOverloaded(lane, self._retry_after())
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiting[lane].setdefault(teacher_id, deque()).append(future)
+        self._queued[lane] += 1
+        if shared is not None:
+            shared._queued = (self, teacher_id, future)
+        started = time.monotonic()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release()  # the slot was handed over just as we were cancelled
+            else:
+                self._forget(shared.lane if shared is not None else lane, teacher_id, future)
+            raise
+        finally:
+            if shared is not None:
+                shared._queued = None
+        if shared is not None:
+            lane = shared.lane
+        self._stats[lane].admitted += 1
+        self._stats[lane].waits.append(time.monotonic() - started)
+
+    def _forget(self, lane: str, teacher_id: str, future: asyncio.Future) -> None:
+        waiters = self._waiting[lane].get(teacher_id)
+        if waiters is not None and future in waiters:
+            waiters.remove(future)
+            self._queued[lane] -= 1
+            if not waiters:
+                del self._waiting[lane][teacher_id]
+
+    def _move(self, lane: str, new_lane: str, teacher_id: str, future: asyncio.Future) -> None:
+        waiters = self._waiting[lane].get(teacher_id)
+        if waiters is None or future not in waiters:
+            return
+        self._forget(lane, teacher_id, future)
+        self._waiting[new_lane].setdefault(teacher_id, deque()).append(future)
+        self._queued[new_lane] += 1
+
+    def release(self, held_seconds: Optional[float] = None) -> None:
+        self.in_flight -= 1
+        if held_seconds is not None:
+            self._service_seconds = 0.8 * self._service_seconds + 0.2 * held_seconds
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, lane: Optional[str] = None, teacher_id: Optional[str] = None) -> AsyncIterator[None]:
+        """Hold one in-flight slot; lane and teacher default to the current context."""
+        shared = _shared.get() if lane is None else None
+        lane = lane or _lane.get()
+        teacher_id = _teacher.get() if teacher_id is None else teacher_id
+        await self.acquire(lane, teacher_id, shared)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - started)
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "max_queue": self.max_queue,
+            "avg_service_ms": round(self._service_seconds * 1000, 1),
+            "lanes": {lane: self._stats[lane].snapshot(self._queued[lane]) for lane in LANES},
+        }
+
+
+_scheduler: Optional[LLMScheduler] = None
+
+
+def get_llm_scheduler() -> LLMScheduler:
+    global _scheduler
+    if _scheduler is None:
+        settings = get_settings()
+        _scheduler = LLMScheduler(
+            settings.llm_max_in_flight,
+            settings.llm_max_queue,
+            settings.llm_min_retry_after,
+        )
+    return _scheduler
+
+
+def llm_scheduler_stats() -> dict:
+    return get_llm_scheduler().stats()
@@ -0,0 +1,36 @@
+from __future__ import annotations
+
+import numpy as np
+from app.rag.vector_index import normalize_rows
+
+
+def mmr_select(query: np.ndarray, candidates: np.ndarray, k: int, lambda_mult: float) -> list[int]:
+    """
+    Maximal marginal relevance: indices of `k` candidate rows, in selection order.
+
+    Each step picks argmax λ·sim(q, c) − (1 − λ)·max sim(c, selected). λ = 1 is plain
+    relevance order; lower values trade relevance for coverage of different passages.
+    """
+    n = candidates.shape[0]
+    k = min(k, n)
+    if k <= 0:
+        return []
+    vectors = normalize_rows(np.asarray(candidates, dtype=np.float32))
+    norm = float(np.linalg.norm(query))
+    query = np.asarray(query, dtype=np.float32) / (norm or 1.0)
+
+    relevance = vectors @ query
+    pairwise = vectors @ vectors.T
+    first = int(np.argmax(relevance))
+    selected = [first]
+    redundancy = pairwise[first].copy()
+    available = np.ones(n, dtype=bool)
+    available[first] = False
+    while len(selected) < k:
+        scores = lambda_mult * relevance - (1.0 - lambda_mult) * redundancy
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        np.maximum(redundancy, pairwise[best], out=redundancy)
+    return selected
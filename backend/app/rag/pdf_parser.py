@@ -1,16 +1,135 @@
-import fitz  # PyMuPDF
+from __future__ import annotations
+
+import asyncio
+import multiprocessing
+import os
+import tempfile
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor
+from contextlib import asynccontextmanager
 from io import BytesIO
+from typing import AsyncIterator, Optional, Union
+
+import fitz  # PyMuPDF
+from app.config import get_settings
+
+_executor: Optional[ProcessPoolExecutor] = None
+
+# PDF content, or the path of a file holding it (see `spooled_pdf`).
+PdfSource = Union[bytes, str]
 
 
-def extract_pages_from_pdf(pdf_bytes: bytes) -> list[dict]:
-    doc = fitz.open(stream=BytesIO(pdf_bytes), filetype="pdf")
+def _open_pdf(source: PdfSource) -> fitz.Document:
+    if isinstance(source, str):
+        # Opened from disk, PyMuPDF only reads the parts of the file it needs.
+        return fitz.open(source, filetype="pdf")
+    return fitz.open(stream=BytesIO(source), filetype="pdf")
+
+
+def get_page_count(source: PdfSource) -> int:
+    doc = _open_pdf(source)
+    try:
+        return len(doc)
+    finally:
+        doc.close()
+
+
+def extract_page_range(source: PdfSource, start: int, end: int) -> list[dict]:
+    """Extract text for pages [start, end) (0-based). Top-level so worker processes can run it."""
+    doc = _open_pdf(source)
     pages = []
-    for page_num in range(len(doc)):
-        page = doc.load_page(page_num)
-        text = page.get_text("text")
-        pages.append({
-            "page_number": page_num + 1,
-            "text": text,
-        })
-    doc.close()
+    try:
+        for page_num in range(start, min(end, len(doc))):
+            page = doc.load_page(page_num)
+            text = page.get_text("text")
+            pages.append({
+                "page_number": page_num + 1,
+                "text": text,
+            })
+    finally:
+        doc.close()
     return pages
+
+
+def get_pdf_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        settings = get_settings()
+        # spawn: forking a process that runs an event loop and HTTP pools is unsafe.
+        _executor = ProcessPoolExecutor(
+            max_workers=max(1, settings.pdf_parse_workers),
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _executor
+
+
+def shutdown_pdf_executor() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def _write_temp_pdf(pdf_bytes: bytes) -> str:
+    fd, path = tempfile.mkstemp(suffix=".pdf", prefix="edurag-")
+    with os.fdopen(fd, "wb") as f:
+        f.write(pdf_bytes)
+    return path
+
+
+@asynccontextmanager
+async def spooled_pdf(pdf_bytes: bytes) -> AsyncIterator[str]:
+    """
+    Path of a temporary copy of the PDF, removed on exit. Worker processes are
+    handed the path instead of the bytes, so a large upload is not pickled to a
+    worker again for every page range.
+    """
+    path = await asyncio.to_thread(_write_temp_pdf, pdf_bytes)
+    try:
+        yield path
+    finally:
+        try:
+            os.remove(path)
+        except OSError as e:
+            print(f"[PDF] could not remove temporary file {path}: {e}")
+
+
+async def get_page_count_async(source: PdfSource, executor: Optional[Executor] = None) -> int:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor or get_pdf_executor(), get_page_count, source)
+
+
+async def iter_pages_async(
+    source: PdfSource,
+    page_count: int,
+    executor: Optional[Executor] = None,
+    workers: Optional[int] = None,
+) -> AsyncIterator[dict]:
+    """
+    Yield pages in order while later page ranges are still being extracted.
+
+    At most `workers` (default `pdf_parse_workers`) ranges of `pdf_stream_batch_pages` pages are in
+    flight, so memory stays bounded regardless of document length. Pass a
+    `spooled_pdf` path rather than bytes for anything but small documents.
+    """
+    settings = get_settings()
+    if executor is None:
+        executor = get_pdf_executor()
+    loop = asyncio.get_running_loop()
+    batch = max(1, settings.pdf_stream_batch_pages)
+    in_flight = max(1, workers or settings.pdf_parse_workers)
+
+    ranges = deque((s, min(s + batch, page_count)) for s in range(0, page_count, batch))
+    pending: deque = deque()
+    try:
+        while ranges or pending:
+            while ranges and len(pending) < in_flight:
+                start, end = ranges.popleft()
+                pending.append(
+                    loop.run_in_executor(executor, extract_page_range, source, start, end)
+                )
+            for page in await pending.popleft():
+                yield page
+    finally:
+        for fut in pending:
+            fut.cancel()
@@ -0,0 +1,82 @@
+from __future__ import annotations
+
+import asyncio
+from typing import AsyncIterator, Awaitable, Callable
+
+from app.rag.chunker import iter_page_chunks
+from app.rag.embeddings import generate_embeddings_batch
+
+_DONE = object()
+
+
+async def run_ingestion_pipeline(
+    pages: AsyncIterator[dict],
+    flush: Callable[[list[dict]], Awaitable[None]],
+    chunk_size: int,
+    chunk_overlap: int,
+    embed_batch_size: int,
+    flush_batch_size: int,
+    queue_size: int,
+) -> int:
+    """
+    Stream pages → chunks → embeddings → storage with bounded queues between stages.
+
+    Pages are chunked as they arrive, chunks are embedded in batches, and every
+    `flush_batch_size` embedded chunks are handed to `flush` as
+    the chunk dicts of `iter_page_chunks` plus `"embedding"`. Parsing, embedding and
+    storing overlap in time while at most `queue_size` items wait between stages.
+    Returns the number of chunks stored.
+    """
+    chunk_q: asyncio.Queue = asyncio.Queue(maxsize=max(1, queue_size))
+    row_q: asyncio.Queue = asyncio.Queue(maxsize=max(1, queue_size))
+    stored = 0
+
+    async def chunk_stage() -> None:
+        async for chunk in iter_page_chunks(pages, chunk_size, chunk_overlap):
+            await chunk_q.put(chunk)
+        await chunk_q.put(_DONE)
+
+    async def embed_stage() -> None:
+        done = False
+        while not done:
+            batch = []
+            while len(batch) < embed_batch_size:
+                item = await chunk_q.get()
+                if item is _DONE:
+                    done = True
+                    break
+                batch.append(item)
+            if batch:
+                embeddings = await generate_embeddings_batch([c["content"] for c in batch])
+                for chunk, embedding in zip(batch, embeddings):
+                    await row_q.put({**chunk, "embedding": embedding})
+        await row_q.put(_DONE)
+
+    async def store_stage() -> None:
+        nonlocal stored
+        buffer: list[dict] = []
+        while True:
+            item = await row_q.get()
+            if item is not _DONE:
+                buffer.append(item)
+            if buffer and (item is _DONE or len(buffer) >= flush_batch_size):
+                await flush(buffer)
+                stored += len(buffer)
+                buffer = []
+            if item is _DONE:
+                return
+
+    tasks = [
+        asyncio.create_task(chunk_stage()),
+        asyncio.create_task(embed_stage()),
+        asyncio.create_task(store_stage()),
+    ]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        # One stage failed (or we were cancelled): stop the others instead of leaving them blocked.
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+    return stored
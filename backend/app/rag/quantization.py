@@ -0,0 +1,78 @@
+from __future__ import annotations
+
+from typing import Optional
+
+import numpy as np
+
+QUANTIZATIONS = ("none", "int8", "binary")
+# Rows scored per block, so the float32 upcast of int8 codes stays small.
+BLOCK_ROWS = 8192
+
+# Set bits per byte value, for Hamming distance on packed codes.
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def quantize_int8(matrix: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Symmetric per-dimension scalar quantization: matrix ≈ codes * scales."""
+    scales = np.abs(matrix).max(axis=0).astype(np.float32) / 127.0
+    scales[scales == 0] = 1.0
+    codes = np.empty(matrix.shape, dtype=np.int8)
+    for start in range(0, matrix.shape[0], BLOCK_ROWS):
+        block = np.asarray(matrix[start:start + BLOCK_ROWS], dtype=np.float32)
+        codes[start:start + BLOCK_ROWS] = np.clip(np.rint(block / scales), -127, 127)
+    return codes, scales
+
+
+def int8_scores(codes: np.ndarray, scales: np.ndarray, query: np.ndarray) -> np.ndarray:
+    # codes @ (scales * query) == (codes * scales) @ query, without dequantizing the matrix.
+    folded = (scales * query).astype(np.float32)
+    scores = np.empty(codes.shape[0], dtype=np.float32)
+    for start in range(0, codes.shape[0], BLOCK_ROWS):
+        scores[start:start + BLOCK_ROWS] = codes[start:start + BLOCK_ROWS].astype(np.float32) @ folded
+    return scores
+
+
+def quantize_binary(matrix: np.ndarray) -> np.ndarray:
+    """1 bit per dimension (sign), packed 8 dimensions per byte."""
+    return np.packbits(np.asarray(matrix) > 0, axis=1)
+
+
+def hamming_scores(codes: np.ndarray, query: np.ndarray) -> np.ndarray:
+    """Negated Hamming distance, so higher is more similar like cosine scores."""
+    query_bits = np.packbits(query > 0)
+    scores = np.empty(codes.shape[0], dtype=np.float32)
+    for start in range(0, codes.shape[0], BLOCK_ROWS):
+        xor = np.bitwise_xor(codes[start:start + BLOCK_ROWS], query_bits)
+        scores[start:start + BLOCK_ROWS] = -_POPCOUNT[xor].sum(axis=1, dtype=np.int32)
+    return scores
+
+
+class QuantizedVectors:
+    """Compact copy of a unit-vector matrix used for candidate search before exact re-ranking."""
+
+    def __init__(self, matrix: np.ndarray, kind: str):
+        if kind not in ("int8", "binary"):
+            raise ValueError(f"Unknown quantization {kind!r}; expected one of {QUANTIZATIONS}")
+        self.kind = kind
+        self.scales: Optional[np.ndarray] = None
+        if kind == "int8":
+            self.codes, self.scales = quantize_int8(matrix)
+        else:
+            self.codes = quantize_binary(matrix)
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.codes.nbytes + (self.scales.nbytes if self.scales is not None else 0))
+
+    def scores(self, query: np.ndarray) -> np.ndarray:
+        if self.kind == "int8":
+            return int8_scores(self.codes, self.scales, query)
+        return hamming_scores(self.codes, query)
+
+
+def rerank(
+    matrix: np.ndarray, candidates: np.ndarray, query: np.ndarray
+) -> tuple[np.ndarray, np.ndarray]:
+    """Exact scores for `candidates` rows only; with a memory-mapped matrix only those rows are read."""
+    order = np.sort(candidates)
+    return order, np.asarray(matrix[order], dtype=np.float32) @ query
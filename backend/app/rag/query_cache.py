@@ -0,0 +1,76 @@
+from __future__ import annotations
+
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from app.config import get_settings
+from app.rag.embedding_cache import normalize_text
+
+
+class QueryEmbeddingCache:
+    """
+    In-process LRU cache of query embeddings keyed by (embed model, normalized query).
+
+    Entries expire `ttl` seconds after they were stored. Unlike the persistent
+    chunk cache this one is a plain dict lookup, so hot queries never leave the
+    event loop.
+    """
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self._entries: OrderedDict[tuple[str, str], tuple[float, list[float]]] = OrderedDict()
+
+    def get(self, model: str, query: str) -> Optional[list[float]]:
+        key = (model, normalize_text(query))
+        entry = self._entries.get(key)
+        if entry is not None and self.ttl > 0 and time.monotonic() - entry[0] > self.ttl:
+            del self._entries[key]
+            self.expired += 1
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, model: str, query: str, embedding: list[float]) -> None:
+        key = (model, normalize_text(query))
+        self._entries[key] = (time.monotonic(), embedding)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "expired": self.expired,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+_cache: Optional[QueryEmbeddingCache] = None
+
+
+def get_query_cache() -> Optional[QueryEmbeddingCache]:
+    """Process-wide cache, or None when QUERY_CACHE_ENABLED is false."""
+    global _cache
+    settings = get_settings()
+    if not settings.query_cache_enabled:
+        return None
+    if _cache is None:
+        _cache = QueryEmbeddingCache(settings.query_cache_max_entries, settings.query_cache_ttl)
+    return _cache
@@ -1,40 +1,220 @@
 from __future__ import annotations
 
-from typing import Optional
+import asyncio
+from typing import Iterable, Optional
+
+import numpy as np
 from app.utils.supabase_client import get_supabase
-from app.rag.embeddings import generate_embedding
+from app.rag.embeddings import generate_embedding, generate_embeddings_batch
+from app.rag.context_packer import pack_chunks
+from app.rag.lexical_index import get_lexical_index, reciprocal_rank_fusion
+from app.rag.mmr import mmr_select
+from app.rag.query_cache import get_query_cache
+from app.rag.vector_index import get_vector_index, normalize_rows, parse_embedding
 from app.config import get_settings
 
 
+async def embed_query(query: str) -> list[float]:
+    """Embedding for a retrieval query, served from the in-process query cache when possible."""
+    model = get_settings().ollama_embed_model
+    cache = get_query_cache()
+    if cache is not None:
+        cached = cache.get(model, query)
+        if cached is not None:
+            return cached
+    embedding = await generate_embedding(query)
+    if cache is not None:
+        cache.put(model, query, embedding)
+    return embedding
+
+
+async def embed_queries(queries: list[str]) -> list[list[float]]:
+    """Embeddings for many queries: query-cache hits plus one batched call for the rest."""
+    model = get_settings().ollama_embed_model
+    cache = get_query_cache()
+    embeddings: list[Optional[list[float]]] = [
+        cache.get(model, query) if cache is not None else None for query in queries
+    ]
+    missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+    if missing:
+        fresh = await generate_embeddings_batch([queries[i] for i in missing])
+        for i, embedding in zip(missing, fresh):
+            embeddings[i] = embedding
+            if cache is not None:
+                cache.put(model, queries[i], embedding)
+    return embeddings
+
+
+async def warm_query_cache(queries: Iterable[str]) -> None:
+    """Pre-embed common queries (e.g. the quiz/notes defaults) in one batch."""
+    cache = get_query_cache()
+    queries = list(dict.fromkeys(queries))
+    if cache is None or not queries:
+        return
+    model = get_settings().ollama_embed_model
+    try:
+        embeddings = await generate_embeddings_batch(queries)
+    except Exception as e:
+        # Ollama may still be starting; the first real request will fill the cache instead.
+        print(f"[QUERY CACHE] Warm-up skipped: {e}")
+        return
+    for query, embedding in zip(queries, embeddings):
+        cache.put(model, query, embedding)
+    print(f"[QUERY CACHE] Warmed {len(queries)} queries")
+
+
+def query_cache_stats() -> Optional[dict]:
+    cache = get_query_cache()
+    return cache.stats() if cache is not None else None
+
+
+async def _vector_search(
+    subject_id: str,
+    teacher_id: str,
+    query_embedding: list[float],
+    top_k: int,
+) -> list[dict]:
+    settings = get_settings()
+    if settings.retrieval_backend == "numpy":
+        return await get_vector_index().search(subject_id, teacher_id, query_embedding, top_k)
+
+    params = {
+        "query_embedding": query_embedding,
+        "match_count": top_k,
+        "filter_subject_id": subject_id,
+        "filter_teacher_id": teacher_id,
+    }
+    if settings.vector_quantization == "binary":
+        # Hamming search over binary_quantize(embedding), then exact cosine re-rank in SQL.
+        function = "match_document_chunks_bq"
+        params["candidate_count"] = max(top_k, settings.vector_rerank_candidates)
+    else:
+        function = "match_document_chunks"
+        params["exact_scan_threshold"] = settings.exact_scan_threshold
+
+    supabase = get_supabase()
+    # The Supabase client is synchronous; keep concurrent retrievals off the event loop.
+    result = await asyncio.to_thread(supabase.rpc(function, params).execute)
+
+    return result.data if result.data else []
+
+
 async def retrieve_relevant_chunks(
     query: str,
     subject_id: str,
     teacher_id: str,
     top_k: Optional[int] = None,
+    query_embedding: Optional[list[float]] = None,
 ) -> list[dict]:
     settings = get_settings()
     if top_k is None:
         top_k = settings.top_k
 
-    query_embedding = await generate_embedding(query)
+    if query_embedding is None:
+        query_embedding = await embed_query(query)
 
-    supabase = get_supabase()
-    result = supabase.rpc(
-        "match_document_chunks",
-        {
-            "query_embedding": query_embedding,
-            "match_count": top_k,
-            "filter_subject_id": subject_id,
-            "filter_teacher_id": teacher_id,
-        },
-    ).execute()
+    if not settings.hybrid_retrieval:
+        return await _vector_search(subject_id, teacher_id, query_embedding, top_k)
 
-    return result.data if result.data else []
+    # Exact terms (formula names, chapter numbers, acronyms) that embeddings blur
+    # are caught by BM25; RRF merges both rankings without tuning score scales.
+    candidates = top_k * max(1, settings.hybrid_candidate_multiplier)
+    vector_hits, lexical_hits = await asyncio.gather(
+        _vector_search(subject_id, teacher_id, query_embedding, candidates),
+        get_lexical_index().search(subject_id, teacher_id, query, candidates),
+    )
+    if lexical_hits is None:
+        print(f"[HYBRID] BM25 index for subject {subject_id} still loading; vector results only")
+        return vector_hits[:top_k]
+    fused = reciprocal_rank_fusion([vector_hits, lexical_hits], settings.rrf_k, top_k)
+    lexical_only = [c for c in fused if "similarity" not in c]
+    if lexical_only:
+        # Report a real cosine similarity for BM25-only hits, like every other source.
+        vectors = await _chunk_embeddings(subject_id, [c["id"] for c in lexical_only])
+        query_vector = normalize_rows(np.asarray([query_embedding], dtype=np.float32))[0]
+        for chunk in lexical_only:
+            vector = vectors.get(chunk["id"])
+            chunk["similarity"] = (
+                float(normalize_rows(vector[None, :])[0] @ query_vector)
+                if vector is not None and vector.shape == query_vector.shape
+                else 0.0
+            )
+    return fused
+
+
+async def _chunk_embeddings(subject_id: str, chunk_ids: list[str]) -> dict[str, np.ndarray]:
+    if get_settings().retrieval_backend == "numpy":
+        return await get_vector_index().vectors(subject_id, chunk_ids)
+
+    def fetch() -> dict[str, np.ndarray]:
+        result = (
+            get_supabase().table("document_chunks")
+            .select("id, embedding")
+            .eq("subject_id", subject_id)
+            .in_("id", chunk_ids)
+            .execute()
+        )
+        return {row["id"]: parse_embedding(row["embedding"]) for row in result.data}
+
+    return await asyncio.to_thread(fetch)
+
+
+async def retrieve_diverse_chunks(
+    query: str,
+    subject_id: str,
+    teacher_id: str,
+    top_k: int,
+    query_embedding: Optional[list[float]] = None,
+) -> list[dict]:
+    """
+    `top_k` chunks picked by maximal marginal relevance from the best `mmr_fetch_k`
+    candidates, so near-duplicate passages (chunk overlap, repeated material) are
+    not all sent to the model. Falls back to plain retrieval when MMR is disabled.
+    """
+    settings = get_settings()
+    if query_embedding is None:
+        query_embedding = await embed_query(query)
+    if not settings.mmr_enabled:
+        return await retrieve_relevant_chunks(
+            query, subject_id, teacher_id, top_k=top_k, query_embedding=query_embedding
+        )
+
+    candidates = await retrieve_relevant_chunks(
+        query, subject_id, teacher_id,
+        top_k=max(top_k, settings.mmr_fetch_k),
+        query_embedding=query_embedding,
+    )
+    if len(candidates) <= top_k:
+        return candidates
+
+    vectors = await _chunk_embeddings(subject_id, [c["id"] for c in candidates])
+    candidates = [c for c in candidates if c["id"] in vectors]
+    if not candidates:
+        return []
+    picks = mmr_select(
+        np.asarray(query_embedding, dtype=np.float32),
+        np.stack([vectors[c["id"]] for c in candidates]),
+        top_k,
+        settings.mmr_lambda,
+    )
+    return [candidates[i] for i in picks]
 
 
-def format_context(chunks: list[dict]) -> str:
+def format_context(chunks: list[dict], token_budget: Optional[int] = None) -> str:
+    """
+    Numbered sources for the prompt. With `token_budget`, adjacent chunks are merged
+    without their overlap and only the most relevant passages that fit are kept
+    (see app/rag/context_packer.py); pass already packed chunks to skip that.
+    """
+    if token_budget:
+        chunks = pack_chunks(chunks, token_budget)
     parts = []
     for i, chunk in enumerate(chunks, 1):
         page = chunk.get("page_number", "?")
-        parts.append(f"[Source {i}, Page {page}]\n{chunk['content']}")
+        page_end = chunk.get("page_end")
+        if page_end and page_end != page:
+            label = f"Pages {page}-{page_end}"
+        else:
+            label = f"Page {page}"
+        parts.append(f"[Source {i}, {label}]\n{chunk['content']}")
     return "\n\n---\n\n".join(parts)
@@ -0,0 +1,119 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+from typing import Awaitable, Callable, Hashable, TypeVar
+
+from app.rag.llm_scheduler import SharedPriority
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+def request_key(*parts) -> str:
+    """Stable hash of JSON-serialisable request parts (model, messages, options, ...)."""
+    blob = json.dumps(parts, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class _Flight:
+    def __init__(self, task: asyncio.Task, keys: list[Hashable], priority: SharedPriority):
+        self.task = task
+        self.keys = keys
+        self.priority = priority
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent calls: the first caller for a key starts the work
+    in its own task, and callers arriving while it runs await that task instead of
+    starting another. The work is cancelled only once every caller waiting on it is
+    gone, so a cancelled leader does not fail its followers. Failures are shared
+    with everyone waiting at the time; the next call for the key starts afresh.
+
+    The work's Ollama calls are scheduled at the highest LLM lane among the callers
+    waiting on it, not at the lane of whoever started it.
+    """
+
+    def __init__(self) -> None:
+        self._calls: dict[Hashable, tuple[_Flight, int]] = {}
+        self.started = 0
+        self.coalesced = 0
+
+    def _forget(self, flight: _Flight) -> None:
+        for key in flight.keys:
+            if self._calls.get(key, (None,))[0] is flight:
+                del self._calls[key]
+
+    def _finish(self, flight: _Flight) -> None:
+        self._forget(flight)
+        if not flight.task.cancelled():
+            flight.task.exception()  # retrieved here so an unawaited failure is not logged
+
+    def _leave(self, flight: _Flight) -> None:
+        flight.waiters -= 1
+        if flight.waiters == 0 and not flight.task.done():
+            flight.task.cancel()
+            # Callers arriving while the cancellation unwinds start a new call.
+            self._forget(flight)
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[R]]) -> R:
+        async def run(_keys: list[Hashable]) -> list[R]:
+            return [await fn()]
+
+        return (await self.do_many([key], lambda k: k, run))[0]
+
+    async def do_many(
+        self,
+        items: list[T],
+        key: Callable[[T], Hashable],
+        fn: Callable[[list[T]], Awaitable[list[R]]],
+    ) -> list[R]:
+        """
+        Results for `items` in order. Items whose key is already in flight join that
+        call; the rest are passed to one `fn` call, which must return one result each.
+        """
+        keys = [key(item) for item in items]
+        fresh: dict[Hashable, T] = {}
+        for k, item in zip(keys, items):
+            if k not in self._calls:
+                fresh.setdefault(k, item)
+        self.coalesced += len(set(keys)) - len(fresh)
+        if fresh:
+            priority = SharedPriority()
+
+            async def run_flight(batch: list[T]) -> list[R]:
+                priority.bind()
+                return await fn(batch)
+
+            flight = _Flight(
+                asyncio.ensure_future(run_flight(list(fresh.values()))), list(fresh), priority
+            )
+            for i, k in enumerate(fresh):
+                self._calls[k] = (flight, i)
+            flight.task.add_done_callback(lambda _task, f=flight: self._finish(f))
+            self.started += 1
+
+        joined = {k: self._calls[k] for k in keys}
+        flights = list({id(f): f for f, _ in joined.values()}.values())
+        lanes = []
+        for flight in flights:
+            flight.waiters += 1
+            lanes.append(flight.priority.join())
+        try:
+            for flight in flights:
+                await asyncio.shield(flight.task)
+        finally:
+            for flight, lane in zip(flights, lanes):
+                flight.priority.leave(lane)
+                self._leave(flight)
+        return [flight.task.result()[i] for flight, i in (joined[k] for k in keys)]
+
+    def stats(self) -> dict:
+        return {
+            "keys_in_flight": len(self._calls),
+            "started": self.started,
+            "coalesced": self.coalesced,
+        }
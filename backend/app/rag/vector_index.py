@@ -0,0 +1,463 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+from app.config import get_settings
+from app.rag.corpus_events import DOCUMENT_REMOVED, SUBJECT_REMOVED, on_corpus_change
+from app.rag.quantization import QuantizedVectors, rerank
+from app.utils.supabase_client import get_supabase
+
+# Columns kept next to each vector and returned by search (same shape as match_document_chunks).
+CHUNK_COLUMNS = (
+    "id, teacher_id, subject_id, document_id, content, page_number, page_end, "
+    "chunk_index, token_count, overlap_tokens"
+)
+FETCH_PAGE_SIZE = 1000
+
+
+def parse_embedding(value) -> np.ndarray:
+    # PostgREST returns pgvector columns as text, e.g. "[0.1,0.2,...]".
+    if isinstance(value, str):
+        value = json.loads(value)
+    return np.asarray(value, dtype=np.float32)
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (matrix / norms).astype(np.float32, copy=False)
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores, best first, in O(n + k log k)."""
+    k = min(k, scores.shape[0])
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if k < scores.shape[0]:
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(scores.shape[0])
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+def fetch_chunk_rows(column: str, value: str, select: str) -> list[dict]:
+    supabase = get_supabase()
+    rows: list[dict] = []
+    start = 0
+    while True:
+        page = (
+            supabase.table("document_chunks")
+            .select(select)
+            .eq(column, value)
+            .order("id")
+            .range(start, start + FETCH_PAGE_SIZE - 1)
+            .execute()
+            .data
+        )
+        rows.extend(page)
+        if len(page) < FETCH_PAGE_SIZE:
+            return rows
+        start += FETCH_PAGE_SIZE
+
+
+def unready_document_ids(subject_id: str) -> set[str]:
+    # Chunks of documents still being ingested (or failing) are visible in the table
+    # but must not be searchable; they are added when the document becomes ready.
+    supabase = get_supabase()
+    result = (
+        supabase.table("documents")
+        .select("id")
+        .eq("subject_id", subject_id)
+        .neq("status", "ready")
+        .execute()
+    )
+    return {row["id"] for row in result.data}
+
+
+def searchable_chunk_ids(subject_id: str) -> list[str]:
+    """Sorted ids of the subject's chunks that belong to ready documents."""
+    unready = unready_document_ids(subject_id)
+    rows = fetch_chunk_rows("subject_id", subject_id, "id, document_id")
+    return sorted(row["id"] for row in rows if row["document_id"] not in unready)
+
+
+def _split_rows(rows: list[dict]) -> tuple[list[dict], np.ndarray]:
+    if not rows:
+        return [], np.empty((0, 0), dtype=np.float32)
+    matrix = np.stack([parse_embedding(row.pop("embedding")) for row in rows])
+    return rows, normalize_rows(matrix)
+
+
+class SubjectIndex:
+    """
+    One subject's chunks: a contiguous (n, dim) float32 matrix of unit vectors plus row metadata.
+
+    With `quantization` "int8" or "binary", candidates are found on a compact copy of
+    the matrix and only the best `rerank_candidates` are re-scored in full precision.
+    """
+
+    def __init__(
+        self,
+        subject_id: str,
+        rows: list[dict],
+        matrix: np.ndarray,
+        quantization: str = "none",
+        rerank_candidates: int = 200,
+    ):
+        self.subject_id = subject_id
+        self.rows = rows
+        self.matrix = matrix
+        self.quantization = quantization
+        self.rerank_candidates = rerank_candidates
+        self.quantized: Optional[QuantizedVectors] = None
+        self.checked_at = time.monotonic()
+        self._positions: Optional[dict[str, int]] = None
+
+    def prepare(self) -> None:
+        """Build the compact vectors (blocking; done off the event loop)."""
+        if self.quantization != "none" and self.rows and self.quantized is None:
+            self.quantized = QuantizedVectors(self.matrix, self.quantization)
+
+    @property
+    def nbytes(self) -> int:
+        if self.quantized is None:
+            return int(self.matrix.nbytes)
+        # A memory-mapped full matrix is only paged in for re-ranked rows.
+        full = 0 if isinstance(self.matrix, np.memmap) else int(self.matrix.nbytes)
+        return full + self.quantized.nbytes
+
+    def search(self, query: np.ndarray, k: int) -> list[dict]:
+        rows, matrix, quantized = self.rows, self.matrix, self.quantized
+        if not rows or matrix.shape[1] != query.shape[0]:
+            return []
+        if quantized is None:
+            scores = matrix @ query
+            return [
+                {**rows[i], "similarity": float(scores[i])}
+                for i in top_k_indices(scores, k)
+            ]
+        candidates = top_k_indices(quantized.scores(query), max(k, self.rerank_candidates))
+        candidate_rows, scores = rerank(matrix, candidates, query)
+        return [
+            {**rows[candidate_rows[i]], "similarity": float(scores[i])}
+            for i in top_k_indices(scores, k)
+        ]
+
+    def vectors(self, chunk_ids: list[str]) -> dict[str, np.ndarray]:
+        """Full-precision unit vectors of the given chunks that are in this index."""
+        if self._positions is None:
+            self._positions = {row["id"]: i for i, row in enumerate(self.rows)}
+        positions = self._positions
+        return {cid: np.asarray(self.matrix[positions[cid]]) for cid in chunk_ids if cid in positions}
+
+    def remove_document(self, document_id: str) -> None:
+        keep = [i for i, row in enumerate(self.rows) if row["document_id"] != document_id]
+        if len(keep) != len(self.rows):
+            self.rows = [self.rows[i] for i in keep]
+            self.matrix = np.ascontiguousarray(self.matrix[keep])
+            self.quantized = None
+            self._positions = None
+
+    def add_rows(self, rows: list[dict], matrix: np.ndarray) -> None:
+        if not rows:
+            return
+        self.quantized = None
+        self._positions = None
+        if not self.rows:
+            self.rows, self.matrix = list(rows), matrix
+            return
+        self.rows = self.rows + rows
+        self.matrix = np.concatenate([self.matrix, matrix])
+
+
+class SubjectIndexStore(ABC):
+    """
+    Lazily loaded per-subject indexes in LRU order, shared by the vector and lexical
+    stores. Upload/delete/re-index events are queued per subject and applied at the
+    next lookup. Every `refresh_seconds` a background task compares the chunk ids with
+    the database and reloads the index if other processes changed them; lookups keep
+    using the current index meanwhile.
+
+    Subclasses build an index (`_load`), apply queued (document_id, change) events to
+    a copy of one (`_apply`) and say when the store holds too much (`_over_capacity`).
+    Loaded indexes must expose `subject_id`, `rows` and `checked_at`.
+    """
+
+    def __init__(self, refresh_seconds: float = 300.0):
+        self.refresh_seconds = refresh_seconds
+        self.loads = 0
+        self.evictions = 0
+        self._indexes: OrderedDict = OrderedDict()
+        self._pending: dict[str, list[tuple[str, str]]] = {}
+        self._locks: dict[str, asyncio.Lock] = {}
+        # subject -> events received since its background refresh started loading.
+        self._refreshing: dict[str, list[tuple[str, str]]] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+    @abstractmethod
+    def _load(self, subject_id: str):
+        """Build the subject's index from the database (blocking; run in a thread)."""
+
+    @abstractmethod
+    def _apply(self, index, ops: list[tuple[str, str]]):
+        """A new index with the (document_id, change) events applied (blocking)."""
+
+    @abstractmethod
+    def _over_capacity(self) -> bool:
+        """True while the loaded indexes exceed the store's budget."""
+
+    def _drop(self, subject_id: str) -> None:
+        """Called when a subject is deleted, after its index is forgotten."""
+
+    def _is_current(self, index) -> bool:
+        return sorted(row["id"] for row in index.rows) == searchable_chunk_ids(index.subject_id)
+
+    def put(self, index) -> None:
+        """Install a prebuilt index (e.g. for warm-up or benchmarks)."""
+        self._indexes[index.subject_id] = index
+        self._indexes.move_to_end(index.subject_id)
+        self._evict(keep=index.subject_id)
+
+    def on_change(self, subject_id: str, document_id: Optional[str], change: str) -> None:
+        if change == SUBJECT_REMOVED or document_id is None:
+            self._pending.pop(subject_id, None)
+            self._indexes.pop(subject_id, None)
+            self._refreshing.pop(subject_id, None)
+            self._drop(subject_id)
+            return
+        if subject_id in self._locks:  # loaded, or being loaded right now
+            self._pending.setdefault(subject_id, []).append((document_id, change))
+        if subject_id in self._refreshing:
+            self._refreshing[subject_id].append((document_id, change))
+
+    def _spawn(self, coro) -> None:
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _refresh(self, subject_id: str) -> None:
+        index = self._indexes.get(subject_id)
+        if index is None or subject_id in self._refreshing:
+            return
+        self._refreshing[subject_id] = []
+        try:
+            if await asyncio.to_thread(self._is_current, index):
+                return
+            fresh = await asyncio.to_thread(self._load, subject_id)
+            lock = self._locks.get(subject_id)
+            if lock is None:  # evicted while loading
+                return
+            async with lock:
+                if subject_id not in self._indexes or subject_id not in self._refreshing:
+                    return
+                # The reload already reflects earlier events; replay only the later ones.
+                self._indexes[subject_id] = fresh
+                ops = self._refreshing[subject_id]
+                if ops:
+                    self._pending[subject_id] = ops
+                else:
+                    self._pending.pop(subject_id, None)
+                self._evict(keep=subject_id)
+        except Exception as e:
+            print(f"[INDEX] Refresh of subject {subject_id} failed: {e}")
+        finally:
+            self._refreshing.pop(subject_id, None)
+
+    async def _get_index(self, subject_id: str):
+        lock = self._locks.setdefault(subject_id, asyncio.Lock())
+        async with lock:
+            index = self._indexes.get(subject_id)
+            if index is not None and time.monotonic() - index.checked_at > self.refresh_seconds:
+                index.checked_at = time.monotonic()
+                self._spawn(self._refresh(subject_id))
+            if index is None:
+                self._pending.pop(subject_id, None)
+                index = await asyncio.to_thread(self._load, subject_id)
+            ops = self._pending.pop(subject_id, None)
+            if ops:
+                index = await asyncio.to_thread(self._apply, index, ops)
+            self._indexes[subject_id] = index
+            self._indexes.move_to_end(subject_id)
+            self._evict(keep=subject_id)
+            return index
+
+    def _evict(self, keep: str) -> None:
+        while self._over_capacity() and len(self._indexes) > 1:
+            subject_id = next(iter(self._indexes))
+            if subject_id == keep:
+                break
+            del self._indexes[subject_id]
+            self._pending.pop(subject_id, None)
+            self._locks.pop(subject_id, None)
+            self.evictions += 1
+
+
+class VectorIndexStore(SubjectIndexStore):
+    """
+    Per-subject indexes for exact in-process top-k search.
+
+    Indexes are evicted once their matrices exceed `memory_budget` bytes. With
+    `directory` set, matrices are persisted as .npy files and memory-mapped, so
+    restarts and cold subjects load without refetching embeddings.
+    """
+
+    def __init__(
+        self,
+        memory_budget: int,
+        directory: str = "",
+        refresh_seconds: float = 300.0,
+        quantization: str = "none",
+        rerank_candidates: int = 200,
+    ):
+        super().__init__(refresh_seconds)
+        self.memory_budget = memory_budget
+        self.directory = directory
+        self.quantization = quantization
+        self.rerank_candidates = rerank_candidates
+        self.searches = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _new_index(self, subject_id: str, rows: list[dict], matrix: np.ndarray) -> SubjectIndex:
+        return SubjectIndex(subject_id, rows, matrix, self.quantization, self.rerank_candidates)
+
+    # ── persistence ───────────────────────────────────────────────────
+    def _paths(self, subject_id: str) -> tuple[str, str]:
+        base = os.path.join(self.directory, subject_id)
+        return f"{base}.npy", f"{base}.json"
+
+    def _save(self, index: SubjectIndex) -> None:
+        if not self.directory:
+            return
+        matrix_path, rows_path = self._paths(index.subject_id)
+        np.save(f"{matrix_path}.tmp.npy", np.ascontiguousarray(index.matrix))
+        with open(f"{rows_path}.tmp", "w", encoding="utf-8") as f:
+            json.dump(index.rows, f)
+        os.replace(f"{matrix_path}.tmp.npy", matrix_path)
+        os.replace(f"{rows_path}.tmp", rows_path)
+        index.matrix = np.load(matrix_path, mmap_mode="r")
+
+    def _load_saved(self, subject_id: str, chunk_ids: list[str]) -> Optional[SubjectIndex]:
+        if not self.directory:
+            return None
+        matrix_path, rows_path = self._paths(subject_id)
+        if not (os.path.exists(matrix_path) and os.path.exists(rows_path)):
+            return None
+        with open(rows_path, encoding="utf-8") as f:
+            rows = json.load(f)
+        if sorted(row["id"] for row in rows) != chunk_ids:
+            return None
+        return self._new_index(subject_id, rows, np.load(matrix_path, mmap_mode="r"))
+
+    def _drop(self, subject_id: str) -> None:
+        if not self.directory:
+            return
+        for path in self._paths(subject_id):
+            if os.path.exists(path):
+                os.remove(path)
+
+    # ── loading and updates (blocking; run in a thread) ───────────────
+    def _load(self, subject_id: str) -> SubjectIndex:
+        if self.directory:
+            saved = self._load_saved(subject_id, searchable_chunk_ids(subject_id))
+            if saved is not None:
+                saved.prepare()
+                return saved
+        unready = unready_document_ids(subject_id)
+        rows = [
+            row for row in fetch_chunk_rows("subject_id", subject_id, f"{CHUNK_COLUMNS}, embedding")
+            if row["document_id"] not in unready
+        ]
+        index = self._new_index(subject_id, *_split_rows(rows))
+        self._save(index)
+        index.prepare()
+        self.loads += 1
+        return index
+
+    def _apply(self, index: SubjectIndex, ops: list[tuple[str, str]]) -> SubjectIndex:
+        # Work on a copy: searches keep using the published index meanwhile.
+        updated = self._new_index(index.subject_id, list(index.rows), np.array(index.matrix))
+        for document_id, change in ops:
+            updated.remove_document(document_id)
+            if change != DOCUMENT_REMOVED:
+                rows = fetch_chunk_rows("document_id", document_id, f"{CHUNK_COLUMNS}, embedding")
+                updated.add_rows(*_split_rows(rows))
+        self._save(updated)
+        updated.prepare()
+        return updated
+
+    def _over_capacity(self) -> bool:
+        return sum(index.nbytes for index in self._indexes.values()) > self.memory_budget
+
+    # ── public API ────────────────────────────────────────────────────
+    def put(self, index: SubjectIndex) -> None:
+        index.prepare()
+        super().put(index)
+
+    async def search(
+        self,
+        subject_id: str,
+        teacher_id: str,
+        query_embedding: list[float],
+        top_k: int,
+    ) -> list[dict]:
+        index = await self._get_index(subject_id)
+        self.searches += 1
+        query = np.asarray(query_embedding, dtype=np.float32)
+        norm = float(np.linalg.norm(query))
+        if norm:
+            query = query / norm
+        return [c for c in index.search(query, top_k) if c["teacher_id"] == teacher_id]
+
+    async def vectors(self, subject_id: str, chunk_ids: list[str]) -> dict[str, np.ndarray]:
+        index = await self._get_index(subject_id)
+        return index.vectors(chunk_ids)
+
+    def stats(self) -> dict:
+        return {
+            "subjects": len(self._indexes),
+            "chunks": sum(len(index.rows) for index in self._indexes.values()),
+            "bytes": sum(index.nbytes for index in self._indexes.values()),
+            "memory_budget_bytes": self.memory_budget,
+            "memory_mapped": bool(self.directory),
+            "quantization": self.quantization,
+            "loads": self.loads,
+            "evictions": self.evictions,
+            "searches": self.searches,
+        }
+
+
+_store: Optional[VectorIndexStore] = None
+
+
+def get_vector_index() -> VectorIndexStore:
+    global _store
+    if _store is None:
+        settings = get_settings()
+        _store = VectorIndexStore(
+            memory_budget=settings.vector_index_memory_mb * 1024 * 1024,
+            directory=settings.vector_index_dir,
+            refresh_seconds=settings.vector_index_refresh_seconds,
+            quantization=settings.vector_quantization,
+            rerank_candidates=settings.vector_rerank_candidates,
+        )
+    return _store
+
+
+@on_corpus_change
+def _on_corpus_change(subject_id: str, document_id: Optional[str], change: str) -> None:
+    if _store is not None:
+        _store.on_change(subject_id, document_id, change)
+
+
+def vector_index_stats() -> Optional[dict]:
+    if get_settings().retrieval_backend != "numpy":
+        return None
+    return get_vector_index().stats()
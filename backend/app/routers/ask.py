@@ -1,8 +1,17 @@
 from fastapi import APIRouter, Depends, HTTPException
-from app.models.schemas import AskRequest, AskResponse, TokenPayload
-from app.services.ask_service import ask_question
+from fastapi.responses import StreamingResponse
+from app.models.schemas import (
+    AskBatchRequest,
+    AskBatchResponse,
+    AskRequest,
+    AskResponse,
+    TokenPayload,
+)
+from app.rag.llm_scheduler import LLMOverloaded
+from app.services.ask_service import ask_question, ask_question_stream, ask_questions
 from app.services.subject_service import get_subject_by_id
 from app.utils.auth import get_current_teacher
+from app.utils.sse import SSE_HEADERS, sse_event
 
 router = APIRouter(tags=["ask"])
 
@@ -19,5 +28,52 @@ async def ask_endpoint(
     try:
         result = await ask_question(body.question, body.subject_id, teacher.sub)
         return result
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/ask/batch", response_model=AskBatchResponse)
+async def ask_batch_endpoint(
+    body: AskBatchRequest,
+    teacher: TokenPayload = Depends(get_current_teacher),
+):
+    questions = [q.strip() for q in body.questions]
+    if any(not q or len(q) > 2000 for q in questions):
+        raise HTTPException(status_code=422, detail="Each question must be 1-2000 characters")
+
+    subject = await get_subject_by_id(body.subject_id, teacher.sub)
+    if not subject:
+        raise HTTPException(status_code=404, detail="Subject not found")
+
+    try:
+        results = await ask_questions(questions, body.subject_id, teacher.sub)
+        return {"results": results}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/ask/stream")
+async def ask_stream_endpoint(
+    body: AskRequest,
+    teacher: TokenPayload = Depends(get_current_teacher),
+):
+    """Server-Sent Events: `sources`, then `token` events, then `done` (or `error`)."""
+    subject = await get_subject_by_id(body.subject_id, teacher.sub)
+    if not subject:
+        raise HTTPException(status_code=404, detail="Subject not found")
+
+    async def events():
+        try:
+            async for event, data in ask_question_stream(body.question, body.subject_id, teacher.sub):
+                yield sse_event(event, data)
+        except LLMOverloaded as e:
+            yield sse_event("error", {"detail": e.detail, "retry_after": e.retry_after})
+        except Exception as e:
+            print(f"[ASK STREAM] Failed: {e}")
+            yield sse_event("error", {"detail": str(e)})
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
@@ -3,15 +3,23 @@ from app.models.schemas import (
     DocumentPreviewUrlResponse,
     DocumentResponse,
     DocumentUpdate,
+    IngestionJobResponse,
+    ReindexRequest,
     TokenPayload,
 )
 from app.services.document_service import (
     delete_document,
     get_document_preview_signed_url,
     get_documents,
-    process_and_store_pdf,
     update_document_filename,
 )
+from app.services.ingestion_service import (
+    IngestionQueueFull,
+    cancel_job,
+    enqueue_pdf_ingestion,
+    get_job,
+    start_reindex,
+)
 from app.services.subject_service import get_subject_by_id
 from app.utils.auth import get_current_teacher
 
@@ -53,7 +61,7 @@ async def update_document_endpoint(
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@router.post("/upload", response_model=DocumentResponse)
+@router.post("/upload", response_model=IngestionJobResponse, status_code=202)
 async def upload_document(
     file: UploadFile = File(...),
     subject_id: str = Form(...),
@@ -68,12 +76,56 @@ async def upload_document(
 
     try:
         pdf_bytes = await file.read()
-        result = await process_and_store_pdf(
+        return await enqueue_pdf_ingestion(
             pdf_bytes, file.filename, subject_id, teacher.sub
         )
-        return result
+    except IngestionQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "30"})
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to queue PDF: {str(e)}")
+
+
+@router.post("/reindex", response_model=list[IngestionJobResponse], status_code=202)
+async def reindex_documents(
+    body: ReindexRequest,
+    teacher: TokenPayload = Depends(get_current_teacher),
+):
+    if body.subject_id:
+        subject = await get_subject_by_id(body.subject_id, teacher.sub)
+        if not subject:
+            raise HTTPException(status_code=404, detail="Subject not found")
+
+    try:
+        return await start_reindex(teacher.sub, body.subject_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/jobs/{job_id}", response_model=IngestionJobResponse)
+async def get_ingestion_job(
+    job_id: str,
+    teacher: TokenPayload = Depends(get_current_teacher),
+):
+    job = await get_job(job_id, teacher.sub)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@router.post("/jobs/{job_id}/cancel", response_model=IngestionJobResponse)
+async def cancel_ingestion_job(
+    job_id: str,
+    teacher: TokenPayload = Depends(get_current_teacher),
+):
+    try:
+        job = await cancel_job(job_id, teacher.sub)
+        if not job:
+            raise HTTPException(status_code=404, detail="Job not found")
+        return job
+    except HTTPException:
+        raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to process PDF: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
 
 
 @router.get("/{subject_id}", response_model=list[DocumentResponse])
@@ -0,0 +1,30 @@
+from fastapi import APIRouter, Depends
+from app.rag.answer_cache import answer_cache_stats
+from app.rag.completion_cache import completion_cache_stats
+from app.rag.embeddings import embedding_cache_stats, embedding_single_flight_stats
+from app.rag.lexical_index import lexical_index_stats
+from app.rag.llm import llm_single_flight_stats
+from app.rag.llm_scheduler import llm_scheduler_stats
+from app.rag.retriever import query_cache_stats
+from app.rag.vector_index import vector_index_stats
+from app.utils.auth import get_current_teacher
+
+# Server-wide internals (queue depths, cache sizes): signed-in users only.
+router = APIRouter(tags=["metrics"], dependencies=[Depends(get_current_teacher)])
+
+
+@router.get("/metrics")
+async def get_metrics():
+    return {
+        "embedding_cache": await embedding_cache_stats(),
+        "query_cache": query_cache_stats(),
+        "answer_cache": answer_cache_stats(),
+        "completion_cache": await completion_cache_stats(),
+        "vector_index": vector_index_stats(),
+        "lexical_index": lexical_index_stats(),
+        "llm_scheduler": llm_scheduler_stats(),
+        "single_flight": {
+            "llm": llm_single_flight_stats(),
+            "embeddings": embedding_single_flight_stats(),
+        },
+    }
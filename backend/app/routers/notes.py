@@ -2,10 +2,13 @@ from __future__ import annotations
 
 from typing import Optional
 from fastapi import APIRouter, Depends, HTTPException
-from app.models.schemas import NotesRequest, NotesResponse, SaveNotesRequest, TokenPayload
-from app.services.notes_service import generate_notes, save_notes, get_saved_notes, get_note_by_id, delete_note, restore_note, get_deleted_notes
+from fastapi.responses import StreamingResponse
+from app.models.schemas import NotesRequest, NotesResponse, NotesStreamRequest, SaveNotesRequest, TokenPayload
+from app.rag.llm_scheduler import LLMOverloaded
+from app.services.notes_service import build_notes_context, generate_notes, stream_notes, save_notes, get_saved_notes, get_note_by_id, delete_note, restore_note, get_deleted_notes
 from app.services.subject_service import get_subject_by_id
 from app.utils.auth import get_current_teacher
+from app.utils.sse import SSE_HEADERS, sse_event
 
 router = APIRouter(tags=["notes"])
 
@@ -20,13 +23,50 @@ async def generate_notes_endpoint(
         raise HTTPException(status_code=404, detail="Subject not found")
 
     try:
-        result = await generate_notes(body.subject_id, teacher.sub, body.topic)
+        result = await generate_notes(body.subject_id, teacher.sub, body.topic, body.no_cache)
         return result
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/generate-notes/stream")
+async def generate_notes_stream_endpoint(
+    body: NotesStreamRequest,
+    teacher: TokenPayload = Depends(get_current_teacher),
+):
+    """Server-Sent Events: `section` events with Markdown, then `done` (or `error`)."""
+    subject = await get_subject_by_id(body.subject_id, teacher.sub)
+    if not subject:
+        raise HTTPException(status_code=404, detail="Subject not found")
+
+    try:
+        context = await build_notes_context(body.subject_id, teacher.sub, body.topic)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+    async def events():
+        yield sse_event("meta", {"subject": subject["name"]})
+        try:
+            async for event, data in stream_notes(
+                body.subject_id, teacher.sub, context, body.topic, body.save, body.title, body.no_cache
+            ):
+                yield sse_event(event, data)
+        except LLMOverloaded as e:
+            yield sse_event("error", {"detail": e.detail, "retry_after": e.retry_after})
+        except Exception as e:
+            print(f"[NOTES STREAM] Failed: {e}")
+            yield sse_event("error", {"detail": str(e)})
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
 
 @router.post("/save-notes")
 async def save_notes_endpoint(
@@ -28,11 +28,14 @@ async def generate_quiz_endpoint(
             body.mcq_count,
             body.short_count,
             body.long_count,
-            body.fill_blanks_count
+            body.fill_blanks_count,
+            body.no_cache,
         )
         return result
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
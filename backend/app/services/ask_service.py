@@ -1,40 +1,196 @@
-from app.rag.retriever import retrieve_relevant_chunks, format_context
-from app.rag.llm import generate_response
+import asyncio
+import time
+from typing import AsyncIterator, Optional
 
+from app.config import get_settings
+from app.rag.answer_cache import get_answer_cache
+from app.rag.context_packer import pack_chunks
+from app.rag.retriever import embed_queries, embed_query, retrieve_relevant_chunks, format_context
+from app.rag.llm import generate_response, stream_response
+from app.rag.llm_scheduler import LANE_GENERATION, LANE_INTERACTIVE, set_llm_priority
 
-async def ask_question(
-    question: str,
-    subject_id: str,
-    teacher_id: str,
-) -> dict:
-    chunks = await retrieve_relevant_chunks(question, subject_id, teacher_id)
+NO_CONTEXT_ANSWER = (
+    "I couldn't find any relevant information in your uploaded documents for this subject. "
+    "Please upload more materials or rephrase your question."
+)
 
-    if not chunks:
-        return {
-            "answer": "I couldn't find any relevant information in your uploaded documents for this subject. Please upload more materials or rephrase your question.",
-            "sources": [],
-        }
+SYSTEM_PROMPT = (
+    "You are a helpful teaching assistant. Answer the teacher's question "
+    "based ONLY on the provided context from their course materials. "
+    "If the context doesn't contain enough information, say so clearly. "
+    "Use clear, professional language suitable for educators."
+)
 
-    context = format_context(chunks)
 
-    system_prompt = (
-        "You are a helpful teaching assistant. Answer the teacher's question "
-        "based ONLY on the provided context from their course materials. "
-        "If the context doesn't contain enough information, say so clearly. "
-        "Use clear, professional language suitable for educators."
+async def _retrieve(
+    question: str, subject_id: str, teacher_id: str, question_embedding: list[float]
+) -> list[dict]:
+    chunks = await retrieve_relevant_chunks(
+        question, subject_id, teacher_id, query_embedding=question_embedding
     )
+    budget = get_settings().ask_context_tokens
+    if chunks and budget:
+        # Packed before formatting so the returned sources match the numbered context.
+        chunks = pack_chunks(chunks, budget)
+    return chunks
+
+
+def _prompt(question: str, chunks: list[dict]) -> str:
+    return f"Context:\n{format_context(chunks)}\n\nQuestion: {question}"
 
-    prompt = f"Context:\n{context}\n\nQuestion: {question}"
 
-    answer = await generate_response(prompt, system_prompt)
+async def _generate(question: str, chunks: list[dict]) -> str:
+    return await generate_response(_prompt(question, chunks), SYSTEM_PROMPT)
 
-    sources = [
+
+def _sources(chunks: list[dict]) -> list[dict]:
+    return [
         {
             "content": c["content"][:200] + "...",
             "page_number": c.get("page_number"),
+            "page_end": c.get("page_end"),
             "similarity": round(c.get("similarity", 0), 4),
         }
         for c in chunks
     ]
 
-    return {"answer": answer, "sources": sources}
+
+async def _answer(
+    question: str,
+    subject_id: str,
+    teacher_id: str,
+    question_embedding: list[float],
+    llm_slots: Optional[asyncio.Semaphore] = None,
+) -> dict:
+    answer_cache = get_answer_cache()
+    generation = None
+    if answer_cache is not None:
+        generation = answer_cache.generation(subject_id)
+        hit = answer_cache.get(subject_id, question_embedding)
+        if hit is not None:
+            return {"answer": hit["answer"], "sources": hit["sources"], "cached": True}
+
+    chunks = await _retrieve(question, subject_id, teacher_id, question_embedding)
+    if not chunks:
+        return {"answer": NO_CONTEXT_ANSWER, "sources": [], "cached": False}
+
+    if llm_slots is None:
+        answer = await _generate(question, chunks)
+    else:
+        async with llm_slots:
+            answer = await _generate(question, chunks)
+    sources = _sources(chunks)
+
+    # generate_response reports LLM failures as "**Error:**" text; don't serve those again.
+    if answer_cache is not None and not answer.startswith("**Error:**"):
+        answer_cache.put(
+            subject_id, question_embedding, {"answer": answer, "sources": sources}, generation
+        )
+    return {"answer": answer, "sources": sources, "cached": False}
+
+
+async def ask_question(
+    question: str,
+    subject_id: str,
+    teacher_id: str,
+) -> dict:
+    set_llm_priority(LANE_INTERACTIVE, teacher_id)
+    question_embedding = await embed_query(question)
+    return await _answer(question, subject_id, teacher_id, question_embedding)
+
+
+async def ask_questions(
+    questions: list[str],
+    subject_id: str,
+    teacher_id: str,
+) -> list[dict]:
+    """
+    Answer many questions about one subject. All questions are embedded in one
+    batched call and retrieved concurrently; at most `ask_batch_llm_concurrency`
+    LLM generations run at once. Results are in input order, and a question that
+    fails gets an `error` instead of failing the batch.
+    """
+    # A batch is bulk work: it queues behind interactive /ask traffic.
+    set_llm_priority(LANE_GENERATION, teacher_id)
+    embeddings = await embed_queries(questions)
+    llm_slots = asyncio.Semaphore(max(1, get_settings().ask_batch_llm_concurrency))
+    results = await asyncio.gather(
+        *(
+            _answer(question, subject_id, teacher_id, embedding, llm_slots)
+            for question, embedding in zip(questions, embeddings)
+        ),
+        return_exceptions=True,
+    )
+
+    items = []
+    for question, result in zip(questions, results):
+        if isinstance(result, Exception):
+            print(f"[ASK BATCH] Question failed: {result}")
+            items.append({"question": question, "answer": None, "sources": [], "error": str(result)})
+        elif isinstance(result, BaseException):
+            raise result
+        else:
+            items.append({"question": question, **result})
+    return items
+
+
+async def ask_question_stream(
+    question: str,
+    subject_id: str,
+    teacher_id: str,
+) -> AsyncIterator[tuple[str, dict]]:
+    """
+    `ask_question` as (event, data) pairs for SSE: one "sources" event, "token"
+    events as the LLM produces text, then "done" with timings and token counts.
+    """
+    set_llm_priority(LANE_INTERACTIVE, teacher_id)
+    started = time.perf_counter()
+
+    def elapsed_ms() -> float:
+        return round((time.perf_counter() - started) * 1000, 1)
+
+    question_embedding = await embed_query(question)
+    answer_cache = get_answer_cache()
+    generation = None
+    if answer_cache is not None:
+        generation = answer_cache.generation(subject_id)
+        hit = answer_cache.get(subject_id, question_embedding)
+        if hit is not None:
+            yield "sources", {"sources": hit["sources"], "cached": True}
+            yield "token", {"text": hit["answer"]}
+            yield "done", {"cached": True, "time_to_first_token_ms": elapsed_ms(), "total_ms": elapsed_ms()}
+            return
+
+    chunks = await _retrieve(question, subject_id, teacher_id, question_embedding)
+    retrieval_ms = elapsed_ms()
+    sources = _sources(chunks)
+    yield "sources", {"sources": sources, "cached": False}
+    if not chunks:
+        yield "token", {"text": NO_CONTEXT_ANSWER}
+        yield "done", {"cached": False, "retrieval_ms": retrieval_ms, "total_ms": elapsed_ms()}
+        return
+
+    parts: list[str] = []
+    first_token_ms = None
+    stats: dict = {}
+    async for item in stream_response(_prompt(question, chunks), SYSTEM_PROMPT):
+        if "token" in item:
+            if first_token_ms is None:
+                first_token_ms = elapsed_ms()
+            parts.append(item["token"])
+            yield "token", {"text": item["token"]}
+        else:
+            stats = {k: v for k, v in item.items() if k != "done"}
+
+    answer = "".join(parts).strip()
+    if answer_cache is not None and answer and not answer.startswith("**Error:**"):
+        answer_cache.put(
+            subject_id, question_embedding, {"answer": answer, "sources": sources}, generation
+        )
+    yield "done", {
+        "cached": False,
+        "retrieval_ms": retrieval_ms,
+        "time_to_first_token_ms": first_token_ms,
+        "total_ms": elapsed_ms(),
+        **stats,
+    }
@@ -1,10 +1,20 @@
+import asyncio
 import re
-from typing import Optional
+import uuid
+from typing import Awaitable, Callable, Optional
 
 from app.utils.supabase_client import get_supabase
-from app.rag.pdf_parser import extract_pages_from_pdf
-from app.rag.chunker import extract_page_chunks
-from app.rag.embeddings import generate_embedding
+from app.rag.chunker import chunker_version
+from app.rag.lexical_index import term_frequencies
+from app.rag.llm_scheduler import LANE_INGESTION, set_llm_priority
+from app.rag.corpus_events import (
+    DOCUMENT_ADDED,
+    DOCUMENT_REMOVED,
+    DOCUMENT_REPLACED,
+    notify_corpus_change,
+)
+from app.rag.pdf_parser import get_page_count_async, iter_pages_async, spooled_pdf
+from app.rag.pipeline import run_ingestion_pipeline
 from app.config import get_settings
 
 
@@ -29,87 +39,399 @@ def _resolve_storage_object_path(
     return f"{teacher_id}/{document_id}/{_safe_storage_filename(fn)}"
 
 
-async def process_and_store_pdf(
-    pdf_bytes: bytes,
-    filename: str,
-    subject_id: str,
-    teacher_id: str,
-) -> dict:
+def current_index_version() -> str:
+    """Chunker settings plus embedding model that every chunk of a fresh document is built with."""
     settings = get_settings()
-    supabase = get_supabase()
+    version = chunker_version(settings.chunk_size, settings.chunk_overlap)
+    return f"{version}|{settings.ollama_embed_model}"
+
+
+# Unique key of each chunk table; retried batches upsert on it instead of inserting twice.
+_CHUNK_CONFLICT_KEYS = {
+    "document_chunks": "subject_id,id",
+    "document_chunks_staging": "id",
+}
 
-    pages = extract_pages_from_pdf(pdf_bytes)
-    page_count = len(pages)
 
-    chunks = extract_page_chunks(
-        pages,
-        chunk_size=settings.chunk_size,
-        chunk_overlap=settings.chunk_overlap,
+async def _insert_chunk_rows(rows: list[dict], table: str = "document_chunks") -> None:
+    """
+    Write one batch of chunk rows in a single PostgREST request, retrying on failure.
+
+    Rows carry client-generated ids, so a retry after a request that committed but
+    timed out on the way back skips the rows already stored.
+    """
+    settings = get_settings()
+    supabase = get_supabase()
+    request = supabase.table(table).upsert(
+        rows, on_conflict=_CHUNK_CONFLICT_KEYS[table], ignore_duplicates=True
     )
+    attempts = max(1, settings.chunk_insert_max_retries + 1)
+    for attempt in range(1, attempts + 1):
+        try:
+            await asyncio.to_thread(request.execute)
+            return
+        except Exception as e:
+            if attempt == attempts:
+                raise
+            delay = settings.chunk_insert_retry_backoff * (2 ** (attempt - 1))
+            print(
+                f"[INGEST] chunk batch insert failed (attempt {attempt}/{attempts}, "
+                f"{len(rows)} rows), retrying in {delay:.1f}s: {e}"
+            )
+            await asyncio.sleep(delay)
+
+
+def discard_document(document_id: str, storage_key: Optional[str]) -> None:
+    """Remove a partially ingested document; its chunks go with it via ON DELETE CASCADE."""
+    settings = get_settings()
+    supabase = get_supabase()
+    if storage_key and settings.documents_bucket:
+        try:
+            supabase.storage.from_(settings.documents_bucket).remove([storage_key])
+        except Exception as e:
+            print(f"[STORAGE] cleanup remove failed: {e}")
+    try:
+        supabase.table("documents").delete().eq("id", document_id).execute()
+    except Exception as e:
+        print(f"[INGEST] cleanup of document {document_id} failed: {e}")
 
-    doc_result = (
+
+def create_document_record(
+    filename: str,
+    subject_id: str,
+    teacher_id: str,
+    status: str = "processing",
+    content_sha256: Optional[str] = None,
+) -> dict:
+    supabase = get_supabase()
+    result = (
         supabase.table("documents")
         .insert({
             "teacher_id": teacher_id,
             "subject_id": subject_id,
             "filename": filename,
-            "page_count": page_count,
-            "chunk_count": len(chunks),
+            "page_count": 0,
+            "chunk_count": 0,
+            "status": status,
+            "content_sha256": content_sha256,
         })
         .execute()
     )
-    document = doc_result.data[0]
-    document_id = document["id"]
+    return result.data[0]
 
-    storage_key_result: Optional[str] = None
-    bucket = settings.documents_bucket
-    if bucket:
-        try:
+
+def find_indexed_duplicate(teacher_id: str, content_sha256: str) -> Optional[dict]:
+    """A fully indexed document of this teacher with byte-identical PDF content."""
+    supabase = get_supabase()
+    result = (
+        supabase.table("documents")
+        .select("*")
+        .eq("teacher_id", teacher_id)
+        .eq("content_sha256", content_sha256)
+        .eq("status", "ready")
+        .eq("index_version", current_index_version())
+        .order("created_at", desc=False)
+        .limit(1)
+        .execute()
+    )
+    return result.data[0] if result.data else None
+
+
+async def clone_indexed_document(
+    source: dict,
+    filename: str,
+    subject_id: str,
+    pdf_bytes: bytes,
+) -> dict:
+    """
+    Create a new document in `subject_id` from an already indexed duplicate.
+
+    Chunk rows and embeddings are copied server-side by the copy_document_chunks
+    RPC, so nothing is parsed or embedded again.
+    """
+    # The storage copy and the RPC are synchronous and can take a while for large files.
+    document = await asyncio.to_thread(_clone_document, source, filename, subject_id, pdf_bytes)
+    notify_corpus_change(subject_id, document["id"], DOCUMENT_ADDED)
+    return document
+
+
+def _clone_document(
+    source: dict,
+    filename: str,
+    subject_id: str,
+    pdf_bytes: bytes,
+) -> dict:
+    settings = get_settings()
+    supabase = get_supabase()
+    teacher_id = source["teacher_id"]
+    document = create_document_record(
+        filename, subject_id, teacher_id, content_sha256=source["content_sha256"]
+    )
+    document_id = document["id"]
+    storage_key: Optional[str] = None
+    try:
+        bucket = settings.documents_bucket
+        source_key = source.get("storage_path")
+        if bucket and source_key:
             storage_key = f"{teacher_id}/{document_id}/{_safe_storage_filename(filename)}"
-            supabase.storage.from_(bucket).upload(
-                storage_key,
-                pdf_bytes,
-                file_options={
-                    "content-type": "application/pdf",
-                    "upsert": "true",
-                },
-            )
             try:
+                supabase.storage.from_(bucket).copy(source_key, storage_key)
                 supabase.table("documents").update({"storage_path": storage_key}).eq(
                     "id", document_id
                 ).execute()
             except Exception as e:
-                print(
-                    f"[STORAGE] storage_path update skipped (add column via migration): {e}"
-                )
-            storage_key_result = storage_key
+                print(f"[STORAGE] server-side copy failed, uploading instead: {e}")
+                storage_key = store_document_pdf(document_id, teacher_id, filename, pdf_bytes)
+        else:
+            storage_key = store_document_pdf(document_id, teacher_id, filename, pdf_bytes)
+
+        copied = supabase.rpc(
+            "copy_document_chunks",
+            {
+                "source_document_id": source["id"],
+                "target_document_id": document_id,
+                "target_subject_id": subject_id,
+            },
+        ).execute()
+        chunk_count = copied.data if isinstance(copied.data, int) else source["chunk_count"]
+
+        result = (
+            supabase.table("documents")
+            .update({
+                "page_count": source["page_count"],
+                "chunk_count": chunk_count,
+                "status": "ready",
+                "index_version": source["index_version"],
+            })
+            .eq("id", document_id)
+            .execute()
+        )
+    except BaseException:
+        discard_document(document_id, storage_key)
+        raise
+    return result.data[0]
+
+
+def store_document_pdf(
+    document_id: str,
+    teacher_id: str,
+    filename: str,
+    pdf_bytes: bytes,
+) -> Optional[str]:
+    """Upload the original PDF to Storage. Returns the object key, or None when skipped."""
+    settings = get_settings()
+    supabase = get_supabase()
+    bucket = settings.documents_bucket
+    if not bucket:
+        return None
+    try:
+        storage_key = f"{teacher_id}/{document_id}/{_safe_storage_filename(filename)}"
+        supabase.storage.from_(bucket).upload(
+            storage_key,
+            pdf_bytes,
+            file_options={
+                "content-type": "application/pdf",
+                "upsert": "true",
+            },
+        )
+        try:
+            supabase.table("documents").update({"storage_path": storage_key}).eq(
+                "id", document_id
+            ).execute()
         except Exception as e:
-            print(f"[STORAGE] PDF upload skipped or failed: {e}")
+            print(
+                f"[STORAGE] storage_path update skipped (add column via migration): {e}"
+            )
+        return storage_key
+    except Exception as e:
+        print(f"[STORAGE] PDF upload skipped or failed: {e}")
+        return None
 
-    for chunk in chunks:
-        embedding = await generate_embedding(chunk["content"])
 
-        supabase.table("document_chunks").insert({
-            "teacher_id": teacher_id,
-            "subject_id": subject_id,
-            "document_id": document_id,
-            "content": chunk["content"],
-            "embedding": embedding,
-            "page_number": chunk["page_number"],
-        }).execute()
+def download_document_pdf(storage_key: str) -> bytes:
+    settings = get_settings()
+    supabase = get_supabase()
+    return supabase.storage.from_(settings.documents_bucket).download(storage_key)
+
+
+async def _build_chunks(
+    document: dict,
+    pdf_bytes: bytes,
+    table: str,
+    on_progress: Optional[Callable[[int, int, int], Awaitable[None]]] = None,
+) -> tuple[int, int]:
+    """Stream the PDF through the ingestion pipeline into `table`. Returns (page_count, chunk_count)."""
+    settings = get_settings()
+    document_id = document["id"]
+    teacher_id = document["teacher_id"]
+    subject_id = document["subject_id"]
+    # Document embeddings wait behind every question and generation request.
+    set_llm_priority(LANE_INGESTION, teacher_id)
+    version = chunker_version(settings.chunk_size, settings.chunk_overlap)
+    embed_model = settings.ollama_embed_model
+
+    # Parse workers open a temporary copy instead of receiving the bytes per page range.
+    async with spooled_pdf(pdf_bytes) as pdf_path:
+        page_count = await get_page_count_async(pdf_path)
+        if on_progress:
+            await on_progress(0, 0, page_count)
+
+        stored = 0
+
+        async def flush(chunks: list[dict]) -> None:
+            nonlocal stored
+            rows = [
+                {
+                    "id": str(uuid.uuid4()),
+                    "teacher_id": teacher_id,
+                    "subject_id": subject_id,
+                    "document_id": document_id,
+                    "content": chunk["content"],
+                    "embedding": chunk["embedding"],
+                    "page_number": chunk["page_number"],
+                    "page_end": chunk["page_end"],
+                    "chunk_index": stored + i,
+                    "token_count": chunk["token_count"],
+                    "overlap_tokens": chunk["overlap_tokens"],
+                    "lexical_terms": term_frequencies(chunk["content"]),
+                    "chunker_version": version,
+                    "embed_model": embed_model,
+                }
+                for i, chunk in enumerate(chunks)
+            ]
+            await _insert_chunk_rows(rows, table)
+            stored += len(rows)
+            if on_progress:
+                await on_progress(stored, chunks[-1]["page_number"], page_count)
+
+        chunk_count = await run_ingestion_pipeline(
+            iter_pages_async(pdf_path, page_count),
+            flush,
+            chunk_size=settings.chunk_size,
+            chunk_overlap=settings.chunk_overlap,
+            embed_batch_size=max(1, settings.embed_batch_size * settings.embed_max_concurrency),
+            flush_batch_size=max(1, settings.chunk_insert_batch_size),
+            queue_size=settings.ingest_queue_size,
+        )
+    return page_count, chunk_count
+
+
+async def index_document(
+    document: dict,
+    pdf_bytes: bytes,
+    on_progress: Optional[Callable[[int, int, int], Awaitable[None]]] = None,
+) -> dict:
+    """
+    Parse, chunk, embed and store one document's chunks, then mark it ready.
+
+    Runs as a streaming pipeline (see app/rag/pipeline.py), so memory stays flat
+    in the page count. `on_progress(stored_chunks, pages_done, page_count)` is
+    awaited after every stored batch. Callers own cleanup: on failure they should
+    `discard_document` so nothing half-indexed remains.
+    """
+    supabase = get_supabase()
+    index_version = current_index_version()
+    page_count, chunk_count = await _build_chunks(
+        document, pdf_bytes, "document_chunks", on_progress
+    )
+
+    result = await asyncio.to_thread(
+        supabase.table("documents")
+        .update({
+            "page_count": page_count,
+            "chunk_count": chunk_count,
+            "status": "ready",
+            "index_version": index_version,
+        })
+        .eq("id", document["id"])
+        .execute
+    )
+    notify_corpus_change(document["subject_id"], document["id"], DOCUMENT_ADDED)
+
+    return result.data[0] if result.data else {
+        **document,
+        "page_count": page_count,
+        "chunk_count": chunk_count,
+        "status": "ready",
+        "index_version": index_version,
+    }
+
+
+def _delete_staging_chunks(document_id: str) -> None:
+    supabase = get_supabase()
+    supabase.table("document_chunks_staging").delete().eq("document_id", document_id).execute()
+
+
+async def reindex_document(
+    document: dict,
+    on_progress: Optional[Callable[[int, int, int], Awaitable[None]]] = None,
+) -> dict:
+    """
+    Rebuild a ready document's chunks with the current chunker and embedding model.
+
+    New chunks are built in document_chunks_staging from the stored PDF and then
+    swapped in by one swap_document_chunks transaction, so retrieval sees either
+    the old chunks or the new ones, never a mix.
+    """
+    supabase = get_supabase()
+    document_id = document["id"]
+    if not document.get("storage_path"):
+        raise ValueError("Original PDF is not in storage; re-upload the document")
+
+    index_version = current_index_version()
+    await asyncio.to_thread(_delete_staging_chunks, document_id)
+    try:
+        pdf_bytes = await asyncio.to_thread(download_document_pdf, document["storage_path"])
+        page_count, chunk_count = await _build_chunks(
+            document, pdf_bytes, "document_chunks_staging", on_progress
+        )
+        await asyncio.to_thread(
+            supabase.rpc(
+                "swap_document_chunks",
+                {
+                    "p_document_id": document_id,
+                    "p_index_version": index_version,
+                    "p_page_count": page_count,
+                    "p_chunk_count": chunk_count,
+                },
+            ).execute
+        )
+    except BaseException:
+        try:
+            await asyncio.to_thread(_delete_staging_chunks, document_id)
+        except Exception as e:
+            print(f"[REINDEX] staging cleanup for {document_id} failed: {e}")
+        raise
+    notify_corpus_change(document["subject_id"], document_id, DOCUMENT_REPLACED)
 
     return {
-        "id": document_id,
-        "subject_id": subject_id,
-        "teacher_id": teacher_id,
-        "filename": filename,
+        **document,
         "page_count": page_count,
-        "chunk_count": len(chunks),
-        "created_at": document["created_at"],
-        "storage_path": storage_key_result,
+        "chunk_count": chunk_count,
+        "index_version": index_version,
     }
 
 
+def find_stale_documents(teacher_id: str, subject_id: Optional[str] = None) -> list[dict]:
+    """Ready documents whose chunks were built with other chunker settings or embed model."""
+    supabase = get_supabase()
+    query = (
+        supabase.table("documents")
+        .select("*")
+        .eq("teacher_id", teacher_id)
+        .eq("status", "ready")
+        .or_(f"index_version.is.null,index_version.neq.{current_index_version()}")
+    )
+    if subject_id:
+        query = query.eq("subject_id", subject_id)
+    return query.order("created_at", desc=False).execute().data
+
+
+def delete_document_chunks(document_id: str) -> None:
+    supabase = get_supabase()
+    supabase.table("document_chunks").delete().eq("document_id", document_id).execute()
+
+
 async def update_document_filename(
     document_id: str, teacher_id: str, filename: str
 ) -> Optional[dict]:
@@ -211,5 +533,6 @@ async def delete_document(document_id: str, teacher_id: str) -> bool:
         .eq("teacher_id", teacher_id)
         .execute()
     )
+    notify_corpus_change(existing.data[0]["subject_id"], document_id, DOCUMENT_REMOVED)
     # PostgREST often returns empty `data` on successful DELETE; we already verified the row exists above.
     return True
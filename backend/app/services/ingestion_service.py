@@ -0,0 +1,427 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from app.config import get_settings
+from app.services.document_service import (
+    clone_indexed_document,
+    create_document_record,
+    delete_document_chunks,
+    discard_document,
+    download_document_pdf,
+    find_indexed_duplicate,
+    find_stale_documents,
+    index_document,
+    reindex_document,
+    store_document_pdf,
+)
+from app.utils.supabase_client import get_supabase
+
+ACTIVE_STATUSES = ("queued", "processing")
+
+
+class IngestionQueueFull(Exception):
+    pass
+
+
+_queue: Optional[asyncio.Queue] = None
+_workers: list[asyncio.Task] = []
+# PDFs that could not be put in Storage (no bucket configured, or the upload failed).
+# Everything else is downloaded by the worker, so queued jobs don't hold whole files.
+_unstored_pdfs: dict[str, bytes] = {}
+_running: dict[str, asyncio.Task] = {}
+_reindex_tasks: set[asyncio.Task] = set()
+_reindex_semaphore: Optional[asyncio.Semaphore] = None
+_shutting_down = False
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _update_job(job_id: str, **fields) -> None:
+    supabase = get_supabase()
+    fields["updated_at"] = _now()
+    supabase.table("ingestion_jobs").update(fields).eq("id", job_id).execute()
+
+
+def _insert_job(row: dict) -> dict:
+    supabase = get_supabase()
+    return supabase.table("ingestion_jobs").insert(row).execute().data[0]
+
+
+def _get_document(document_id: str) -> Optional[dict]:
+    supabase = get_supabase()
+    result = supabase.table("documents").select("*").eq("id", document_id).execute()
+    return result.data[0] if result.data else None
+
+
+def _get_queue() -> asyncio.Queue:
+    global _queue
+    if _queue is None:
+        _queue = asyncio.Queue(maxsize=max(1, get_settings().ingestion_queue_size))
+    return _queue
+
+
+async def enqueue_pdf_ingestion(
+    pdf_bytes: bytes,
+    filename: str,
+    subject_id: str,
+    teacher_id: str,
+) -> dict:
+    """
+    Create the document and its job, store the PDF, and hand the job to a worker.
+
+    Byte-identical PDFs this teacher already indexed are cloned instead; the job
+    is then returned already completed.
+    """
+    # Supabase calls are synchronous; each one runs in a thread so an upload or a slow
+    # round-trip does not stall other requests and streams.
+    content_sha256 = hashlib.sha256(pdf_bytes).hexdigest()
+    duplicate = await asyncio.to_thread(find_indexed_duplicate, teacher_id, content_sha256)
+    if duplicate:
+        document = await clone_indexed_document(duplicate, filename, subject_id, pdf_bytes)
+        return await asyncio.to_thread(_insert_job, {
+            "teacher_id": teacher_id,
+            "subject_id": subject_id,
+            "document_id": document["id"],
+            "filename": filename,
+            "status": "completed",
+            "progress": 100,
+            "processed_chunks": document["chunk_count"],
+            "total_chunks": document["chunk_count"],
+        })
+
+    queue = _get_queue()
+    if queue.full():
+        raise IngestionQueueFull("Ingestion queue is full, try again shortly")
+
+    document = await asyncio.to_thread(
+        create_document_record, filename, subject_id, teacher_id, content_sha256=content_sha256
+    )
+    # Storing the PDF first lets a restarted server pick the job back up.
+    storage_key = await asyncio.to_thread(
+        store_document_pdf, document["id"], teacher_id, filename, pdf_bytes
+    )
+    if storage_key:
+        document["storage_path"] = storage_key
+
+    try:
+        job = await asyncio.to_thread(_insert_job, {
+            "teacher_id": teacher_id,
+            "subject_id": subject_id,
+            "document_id": document["id"],
+            "filename": filename,
+            "status": "queued",
+        })
+    except Exception:
+        # Without a job nothing would ever process or clean up the document.
+        await asyncio.to_thread(discard_document, document["id"], storage_key)
+        raise
+
+    try:
+        # Other uploads may have filled the queue while this one was being stored.
+        queue.put_nowait(job["id"])
+    except asyncio.QueueFull:
+        await asyncio.to_thread(discard_document, document["id"], storage_key)
+        await asyncio.to_thread(
+            _update_job, job["id"], status="failed", error="Ingestion queue was full"
+        )
+        raise IngestionQueueFull("Ingestion queue is full, try again shortly")
+    if not storage_key:
+        _unstored_pdfs[job["id"]] = pdf_bytes
+    return job
+
+
+async def get_job(job_id: str, teacher_id: str) -> Optional[dict]:
+    supabase = get_supabase()
+    result = await asyncio.to_thread(
+        supabase.table("ingestion_jobs")
+        .select("*")
+        .eq("id", job_id)
+        .eq("teacher_id", teacher_id)
+        .execute
+    )
+    return result.data[0] if result.data else None
+
+
+async def cancel_job(job_id: str, teacher_id: str) -> Optional[dict]:
+    job = await get_job(job_id, teacher_id)
+    if not job:
+        return None
+    if job["status"] not in ACTIVE_STATUSES:
+        return job
+
+    task = _running.get(job_id)
+    if task is not None:
+        # The worker records the cancellation once the document has been cleaned up.
+        task.cancel()
+    elif job.get("kind") == "reindex":
+        # A queued re-index leaves the document and its current chunks untouched.
+        await asyncio.to_thread(_update_job, job_id, status="cancelled")
+    else:
+        _unstored_pdfs.pop(job_id, None)
+        if job.get("document_id"):
+            await asyncio.to_thread(_discard_job_document, job["document_id"])
+        await asyncio.to_thread(_update_job, job_id, status="cancelled")
+    return await get_job(job_id, teacher_id)
+
+
+def _discard_job_document(document_id: str) -> None:
+    document = _get_document(document_id)
+    if document:
+        discard_document(document_id, document.get("storage_path"))
+
+
+def _claim_job(job_id: str) -> Optional[dict]:
+    """Move a queued job to processing; None if it was cancelled or claimed elsewhere."""
+    supabase = get_supabase()
+    result = (
+        supabase.table("ingestion_jobs")
+        .update({"status": "processing", "updated_at": _now()})
+        .eq("id", job_id)
+        .eq("status", "queued")
+        .execute()
+    )
+    return result.data[0] if result.data else None
+
+
+async def _run_job(job: dict) -> None:
+    job_id = job["id"]
+    document = await asyncio.to_thread(_get_document, job["document_id"])
+    if not document:
+        raise ValueError("Document was deleted before ingestion started")
+
+    pdf_bytes = _unstored_pdfs.pop(job_id, None)
+    if pdf_bytes is None:
+        if not document.get("storage_path"):
+            raise ValueError("Original PDF is not available in storage; please re-upload")
+        pdf_bytes = await asyncio.to_thread(download_document_pdf, document["storage_path"])
+
+    async def on_progress(stored_chunks: int, pages_done: int, page_count: int) -> None:
+        progress = int(pages_done * 100 / page_count) if page_count else 0
+        await asyncio.to_thread(
+            _update_job,
+            job_id,
+            processed_chunks=stored_chunks,
+            progress=min(progress, 99),
+        )
+
+    try:
+        indexed = await index_document(document, pdf_bytes, on_progress=on_progress)
+    except asyncio.CancelledError:
+        if not _shutting_down:
+            await asyncio.to_thread(discard_document, document["id"], document.get("storage_path"))
+        # On shutdown keep the document and stored PDF; _recover_jobs resumes it.
+        raise
+    except BaseException:
+        await asyncio.to_thread(discard_document, document["id"], document.get("storage_path"))
+        raise
+    await asyncio.to_thread(
+        _update_job,
+        job_id,
+        status="completed",
+        progress=100,
+        processed_chunks=indexed["chunk_count"],
+        total_chunks=indexed["chunk_count"],
+    )
+
+
+async def _worker(worker_id: int) -> None:
+    queue = _get_queue()
+    while True:
+        job_id = await queue.get()
+        try:
+            job = await asyncio.to_thread(_claim_job, job_id)
+            if job is None:
+                _unstored_pdfs.pop(job_id, None)
+                continue
+            task = asyncio.create_task(_run_job(job))
+            _running[job_id] = task
+            try:
+                await task
+            except asyncio.CancelledError:
+                if _shutting_down:
+                    task.cancel()
+                    await asyncio.to_thread(_update_job, job_id, status="queued")
+                    raise
+                await asyncio.to_thread(_update_job, job_id, status="cancelled")
+            except Exception as e:
+                print(f"[INGEST] worker {worker_id} job {job_id} failed: {e}")
+                await asyncio.to_thread(_update_job, job_id, status="failed", error=str(e)[:1000])
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"[INGEST] worker {worker_id} could not run job {job_id}: {e}")
+        finally:
+            _running.pop(job_id, None)
+            queue.task_done()
+
+
+def _active_jobs() -> list[dict]:
+    supabase = get_supabase()
+    result = (
+        supabase.table("ingestion_jobs")
+        .select("*")
+        .in_("status", list(ACTIVE_STATUSES))
+        .order("created_at", desc=False)
+        .execute()
+    )
+    return result.data or []
+
+
+async def _recover_jobs() -> None:
+    """
+    Re-queue jobs left behind by a crashed or restarted server.
+
+    Runs alongside the workers and waits for room in the queue, so a backlog larger
+    than the queue is worked off instead of being left "queued" forever.
+    """
+    settings = get_settings()
+    stale_before = datetime.now(timezone.utc) - timedelta(
+        seconds=settings.ingestion_stale_after
+    )
+    queue = _get_queue()
+    reindex_jobs = []
+    for job in await asyncio.to_thread(_active_jobs):
+        # A recently updated "processing" job may belong to another live server process.
+        updated_at = datetime.fromisoformat(job["updated_at"])
+        if job["status"] == "processing" and updated_at > stale_before:
+            continue
+        if job.get("kind") == "reindex":
+            await asyncio.to_thread(
+                _update_job, job["id"], status="queued", processed_chunks=0, progress=0
+            )
+            reindex_jobs.append(job)
+            continue
+        if job.get("document_id"):
+            await asyncio.to_thread(delete_document_chunks, job["document_id"])
+        await asyncio.to_thread(
+            _update_job, job["id"], status="queued", processed_chunks=0, progress=0
+        )
+        await queue.put(job["id"])
+        print(f"[INGEST] re-queued job {job['id']} ({job.get('filename')})")
+    if reindex_jobs:
+        _spawn_reindex(reindex_jobs)
+        print(f"[REINDEX] resumed {len(reindex_jobs)} re-index job(s)")
+
+
+async def _recover_jobs_safely() -> None:
+    try:
+        await _recover_jobs()
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        print(f"[INGEST] job recovery skipped: {e}")
+
+
+def _get_reindex_semaphore() -> asyncio.Semaphore:
+    global _reindex_semaphore
+    if _reindex_semaphore is None:
+        _reindex_semaphore = asyncio.Semaphore(max(1, get_settings().reindex_max_concurrency))
+    return _reindex_semaphore
+
+
+async def start_reindex(teacher_id: str, subject_id: Optional[str] = None) -> list[dict]:
+    """
+    Queue a re-index job for every stale document of this teacher (optionally one
+    subject) and run them in the background, at most `reindex_max_concurrency`
+    at a time across the server.
+    """
+    supabase = get_supabase()
+    stale = await asyncio.to_thread(find_stale_documents, teacher_id, subject_id)
+    if not stale:
+        return []
+
+    active = await asyncio.to_thread(
+        supabase.table("ingestion_jobs")
+        .select("document_id")
+        .eq("teacher_id", teacher_id)
+        .eq("kind", "reindex")
+        .in_("status", list(ACTIVE_STATUSES))
+        .execute
+    )
+    already_queued = {row["document_id"] for row in active.data or []}
+    rows = [
+        {
+            "teacher_id": teacher_id,
+            "subject_id": doc["subject_id"],
+            "document_id": doc["id"],
+            "filename": doc["filename"],
+            "kind": "reindex",
+            "status": "queued",
+        }
+        for doc in stale
+        if doc["id"] not in already_queued
+    ]
+    if not rows:
+        return []
+    jobs = (await asyncio.to_thread(supabase.table("ingestion_jobs").insert(rows).execute)).data
+    _spawn_reindex(jobs)
+    return jobs
+
+
+def _spawn_reindex(jobs: list[dict]) -> None:
+    for job in jobs:
+        task = asyncio.create_task(_run_reindex_job(job))
+        _reindex_tasks.add(task)
+        task.add_done_callback(_reindex_tasks.discard)
+
+
+async def _run_reindex_job(job: dict) -> None:
+    job_id = job["id"]
+    async with _get_reindex_semaphore():
+        if await asyncio.to_thread(_claim_job, job_id) is None:
+            return
+        _running[job_id] = asyncio.current_task()
+        try:
+            document = await asyncio.to_thread(_get_document, job["document_id"])
+            if not document:
+                raise ValueError("Document was deleted before re-indexing started")
+
+            async def on_progress(stored_chunks: int, pages_done: int, page_count: int) -> None:
+                progress = int(pages_done * 100 / page_count) if page_count else 0
+                await asyncio.to_thread(
+                    _update_job, job_id, processed_chunks=stored_chunks, progress=min(progress, 99)
+                )
+
+            indexed = await reindex_document(document, on_progress=on_progress)
+            await asyncio.to_thread(
+                _update_job,
+                job_id,
+                status="completed",
+                progress=100,
+                processed_chunks=indexed["chunk_count"],
+                total_chunks=indexed["chunk_count"],
+            )
+        except asyncio.CancelledError:
+            await asyncio.to_thread(
+                _update_job, job_id, status="queued" if _shutting_down else "cancelled"
+            )
+            raise
+        except Exception as e:
+            print(f"[REINDEX] job {job_id} failed: {e}")
+            await asyncio.to_thread(_update_job, job_id, status="failed", error=str(e)[:1000])
+        finally:
+            _running.pop(job_id, None)
+
+
+async def start_ingestion_workers() -> None:
+    settings = get_settings()
+    for i in range(max(1, settings.ingestion_workers)):
+        _workers.append(asyncio.create_task(_worker(i)))
+    # Cancelled with the workers on shutdown; unrecovered jobs stay "queued" for next time.
+    _workers.append(asyncio.create_task(_recover_jobs_safely()))
+
+
+async def stop_ingestion_workers() -> None:
+    global _shutting_down
+    _shutting_down = True
+    tasks = [*_workers, *_reindex_tasks]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    _workers.clear()
@@ -1,26 +1,48 @@
 from __future__ import annotations
 
-from typing import Optional
-from app.rag.retriever import retrieve_relevant_chunks, format_context
-from app.rag.llm import generate_notes_text
+import re
+import time
+from typing import AsyncIterator, Optional
+from app.config import get_settings
+from app.rag.retriever import retrieve_diverse_chunks, format_context
+from app.rag.completion_cache import set_completion_scope
+from app.rag.llm import generate_notes_text, stream_notes_text
+from app.rag.llm_scheduler import LANE_GENERATION, set_llm_priority
 from app.services.subject_service import get_subject_by_id
 from app.utils.supabase_client import get_supabase
 
+DEFAULT_NOTES_QUERY = "all key concepts, definitions, and important topics"
 
-async def generate_notes(
+# Start of a "# Title" or "## Section" line, where streamed notes are cut, or of a
+# code fence line: a "# comment" inside a fenced block is not a heading.
+_HEADING_RE = re.compile(r"^(?:(?P<fence> {0,3}(?:`{3,}|~{3,}))|#{1,2} )", re.MULTILINE)
+
+
+async def build_notes_context(
     subject_id: str,
     teacher_id: str,
     topic: Optional[str] = None,
-) -> dict:
-    query = topic if topic else "all key concepts, definitions, and important topics"
-    chunks = await retrieve_relevant_chunks(
+) -> str:
+    set_llm_priority(LANE_GENERATION, teacher_id)
+    query = topic if topic else DEFAULT_NOTES_QUERY
+    chunks = await retrieve_diverse_chunks(
         query, subject_id, teacher_id, top_k=10
     )
 
     if not chunks:
         raise ValueError("No documents found for this subject. Upload materials first.")
 
-    context = format_context(chunks)
+    return format_context(chunks, get_settings().notes_context_tokens)
+
+
+async def generate_notes(
+    subject_id: str,
+    teacher_id: str,
+    topic: Optional[str] = None,
+    no_cache: bool = False,
+) -> dict:
+    set_completion_scope(subject_id, no_cache)
+    context = await build_notes_context(subject_id, teacher_id, topic)
     notes = await generate_notes_text(context, topic or "")
 
     subject = await get_subject_by_id(subject_id, teacher_id)
@@ -32,6 +54,75 @@ async def generate_notes(
     }
 
 
+def _split_sections(buffer: str) -> tuple[list[str], str]:
+    """Complete Markdown sections in `buffer` (each ends where a `#`/`##` heading starts) and the rest."""
+    sections: list[str] = []
+    start = 0
+    fence = None  # marker of the open code block, if any
+    for match in _HEADING_RE.finditer(buffer):
+        marker = match.group("fence")
+        if marker:
+            marker = marker.lstrip()
+            if fence is None:
+                fence = marker
+            elif marker[0] == fence[0] and len(marker) >= len(fence):
+                fence = None
+            continue
+        if fence is not None:
+            continue
+        if match.start() > start and buffer[start:match.start()].strip():
+            sections.append(buffer[start:match.start()])
+            start = match.start()
+    return sections, buffer[start:]
+
+
+async def stream_notes(
+    subject_id: str,
+    teacher_id: str,
+    context: str,
+    topic: Optional[str] = None,
+    save: bool = False,
+    title: Optional[str] = None,
+    no_cache: bool = False,
+) -> AsyncIterator[tuple[str, dict]]:
+    """
+    Notes as (event, data) pairs for SSE: a "section" event with the Markdown of each
+    top-level section as soon as it is complete, then "done" with timings, token
+    counts and, when `save` is set, the note stored through `save_notes`.
+    """
+    set_llm_priority(LANE_GENERATION, teacher_id)
+    set_completion_scope(subject_id, no_cache)
+    started = time.perf_counter()
+    parts: list[str] = []
+    buffer = ""
+    first_section_ms = None
+    stats: dict = {}
+    async for item in stream_notes_text(context, topic or ""):
+        if "token" not in item:
+            stats = {k: v for k, v in item.items() if k != "done"}
+            continue
+        parts.append(item["token"])
+        buffer += item["token"]
+        sections, buffer = _split_sections(buffer)
+        for section in sections:
+            if first_section_ms is None:
+                first_section_ms = round((time.perf_counter() - started) * 1000, 1)
+            yield "section", {"markdown": section}
+    if buffer.strip():
+        yield "section", {"markdown": buffer}
+
+    notes = "".join(parts).strip()
+    note = None
+    if save and notes and not notes.startswith("**Error:**"):
+        note = await save_notes(teacher_id, subject_id, title or topic or "General", notes)
+    yield "done", {
+        "note": note,
+        "time_to_first_section_ms": first_section_ms,
+        "total_ms": round((time.perf_counter() - started) * 1000, 1),
+        **stats,
+    }
+
+
 async def save_notes(
     teacher_id: str,
     subject_id: str,
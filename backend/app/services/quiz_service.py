@@ -1,11 +1,16 @@
 from __future__ import annotations
 
 from typing import Optional
-from app.rag.retriever import retrieve_relevant_chunks, format_context
+from app.config import get_settings
+from app.rag.retriever import retrieve_diverse_chunks, format_context
+from app.rag.completion_cache import set_completion_scope
 from app.rag.llm import generate_quiz_json
+from app.rag.llm_scheduler import LANE_GENERATION, set_llm_priority
 from app.services.subject_service import get_subject_by_id
 from app.utils.supabase_client import get_supabase
 
+DEFAULT_QUIZ_QUERY = "key concepts and important topics"
+
 
 async def generate_quiz(
     subject_id: str,
@@ -16,18 +21,21 @@ async def generate_quiz(
     short_count: int = 0,
     long_count: int = 0,
     fill_blanks_count: int = 0,
+    no_cache: bool = False,
 ) -> dict:
-    query = topic if topic else "key concepts and important topics"
+    set_llm_priority(LANE_GENERATION, teacher_id)
+    set_completion_scope(subject_id, no_cache)
+    query = topic if topic else DEFAULT_QUIZ_QUERY
     if instructions:
         query += f" ({instructions})"
-    chunks = await retrieve_relevant_chunks(
+    chunks = await retrieve_diverse_chunks(
         query, subject_id, teacher_id, top_k=10
     )
 
     if not chunks:
         raise ValueError("No documents found for this subject. Upload materials first.")
 
-    context = format_context(chunks)
+    context = format_context(chunks, get_settings().quiz_context_tokens)
     questions = await generate_quiz_json(
         context, topic or "", instructions or "", mcq_count, short_count, long_count, fill_blanks_count
     )
@@ -2,6 +2,7 @@ from __future__ import annotations
 
 from typing import Optional
 
+from app.rag.corpus_events import SUBJECT_REMOVED, notify_corpus_change
 from app.services.organization_service import get_organization_by_id
 from app.utils.supabase_client import get_supabase
 
@@ -65,6 +66,8 @@ async def delete_subject(subject_id: str, teacher_id: str) -> bool:
         .eq("teacher_id", teacher_id)
         .execute()
     )
+    if result.data:
+        notify_corpus_change(subject_id, change=SUBJECT_REMOVED)
     return len(result.data) > 0
 
 
@@ -0,0 +1,41 @@
+from __future__ import annotations
+
+from typing import Optional
+
+import httpx
+from app.config import get_settings
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+def _build_client() -> httpx.AsyncClient:
+    settings = get_settings()
+    limits = httpx.Limits(
+        max_connections=settings.ollama_max_connections,
+        max_keepalive_connections=settings.ollama_max_keepalive_connections,
+        keepalive_expiry=settings.ollama_keepalive_expiry,
+    )
+    timeout = httpx.Timeout(settings.ollama_read_timeout, connect=settings.ollama_connect_timeout)
+    return httpx.AsyncClient(limits=limits, timeout=timeout)
+
+
+async def init_http_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None or _client.is_closed:
+        _client = _build_client()
+    return _client
+
+
+async def close_http_client() -> None:
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Pooled client shared by all Ollama calls. Created in the app lifespan; lazily for scripts."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = _build_client()
+    return _client
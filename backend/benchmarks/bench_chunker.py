@@ -0,0 +1,134 @@
+"""
+Chunker speed and page-attribution accuracy on a synthetic 2,000-page document.
+
+Compares the previous `extract_page_chunks` (whole-document concatenation,
+`find(chunk[:50])` and a linear page scan) with the current linear chunker, and
+checks that every chunk's first and last characters really come from the pages
+it is attributed to.
+
+    cd backend && python -m benchmarks.bench_chunker --pages 2000
+"""
+import argparse
+import json
+import random
+import time
+
+from app.rag.chunker import chunk_text, extract_page_chunks
+
+WORDS = (
+    "cell membrane osmosis diffusion enzyme substrate catalyst protein ribosome "
+    "nucleus chromosome allele genotype phenotype mitosis meiosis photosynthesis "
+    "chlorophyll glucose respiration ATP NADH equation theorem derivative integral"
+).split()
+
+
+def legacy_extract_page_chunks(pages: list[dict], chunk_size: int, chunk_overlap: int) -> list[dict]:
+    """The implementation this benchmark replaced, kept verbatim for comparison."""
+    result: list[dict] = []
+    accumulated_text = ""
+    for page in pages:
+        page_text = page["text"].strip()
+        if not page_text:
+            continue
+        if accumulated_text:
+            accumulated_text += "\n" + page_text
+        else:
+            accumulated_text = page_text
+    if not accumulated_text:
+        return result
+
+    raw_chunks = chunk_text(accumulated_text, chunk_size, chunk_overlap)
+
+    text_cursor = 0
+    page_boundaries: list[int] = []
+    running = 0
+    for page in pages:
+        running += len(page["text"])
+        page_boundaries.append(running)
+
+    for chunk in raw_chunks:
+        chunk_start = accumulated_text.find(chunk[:50], text_cursor)
+        if chunk_start == -1:
+            chunk_start = text_cursor
+        best_page = 1
+        for i, boundary in enumerate(page_boundaries):
+            if chunk_start < boundary:
+                best_page = pages[i]["page_number"]
+                break
+            best_page = pages[-1]["page_number"]
+        result.append({"content": chunk, "page_number": best_page})
+        text_cursor = max(text_cursor, chunk_start + 1)
+    return result
+
+
+def build_pages(count: int, seed: int = 7) -> list[dict]:
+    rng = random.Random(seed)
+    pages = []
+    for i in range(count):
+        if rng.random() < 0.03:
+            text = "   \n"  # blank/scanned page
+        else:
+            n = rng.randint(80, 450)
+            text = f"Page {i + 1}. " + " ".join(rng.choice(WORDS) for _ in range(n)) + "\n"
+        pages.append({"page_number": i + 1, "text": text})
+    return pages
+
+
+def _attribution_errors(chunks: list[dict], pages: list[dict]) -> int:
+    """Chunks whose first/last line is not found on the page(s) they claim."""
+    by_number = {p["page_number"]: p["text"] for p in pages}
+    errors = 0
+    for chunk in chunks:
+        lines = chunk["content"].split("\n")
+        head, tail = lines[0][:40], lines[-1][-40:]
+        end = chunk.get("page_end", chunk["page_number"])
+        if head not in by_number[chunk["page_number"]] or tail not in by_number[end]:
+            errors += 1
+    return errors
+
+
+def _time(fn, repeats: int) -> tuple[float, list[dict]]:
+    best, out = float("inf"), []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        out = fn()
+        best = min(best, time.perf_counter() - t0)
+    return best, out
+
+
+def main(page_count: int, chunk_size: int, chunk_overlap: int, repeats: int) -> None:
+    pages = build_pages(page_count)
+    extract_page_chunks(pages[:5], chunk_size, chunk_overlap)  # load the encoder
+
+    legacy_s, legacy = _time(lambda: legacy_extract_page_chunks(pages, chunk_size, chunk_overlap), repeats)
+    new_s, new = _time(lambda: extract_page_chunks(pages, chunk_size, chunk_overlap), repeats)
+
+    report = {
+        "pages": page_count,
+        "chunk_size": chunk_size,
+        "chunk_overlap": chunk_overlap,
+        "legacy": {
+            "seconds": round(legacy_s, 4),
+            "chunks": len(legacy),
+            "attribution_errors": _attribution_errors(legacy, pages),
+        },
+        "linear": {
+            "seconds": round(new_s, 4),
+            "chunks": len(new),
+            "attribution_errors": _attribution_errors(new, pages),
+            "multi_page_chunks": sum(1 for c in new if c["page_end"] != c["page_number"]),
+        },
+        "speedup": round(legacy_s / new_s, 2) if new_s else None,
+    }
+    print(json.dumps(report, indent=2))
+    assert report["linear"]["attribution_errors"] == 0, "page attribution is not exact"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=2000)
+    parser.add_argument("--chunk-size", type=int, default=300)
+    parser.add_argument("--chunk-overlap", type=int, default=30)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+    main(args.pages, args.chunk_size, args.chunk_overlap, args.repeats)
@@ -0,0 +1,101 @@
+"""
+Per-call latency of Ollama embedding requests: a fresh httpx.AsyncClient per
+call (the old behaviour) versus the shared pooled client.
+
+Runs against a tiny local stub that speaks just enough HTTP/1.1 keep-alive to
+answer /api/embeddings, so the numbers isolate connection overhead.
+
+    cd backend && python -m benchmarks.bench_http_client --calls 500
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import time
+
+EMBEDDING = [0.0] * 768
+
+
+async def _handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    body = json.dumps({"embedding": EMBEDDING}).encode()
+    try:
+        while True:
+            head = await reader.readuntil(b"\r\n\r\n")
+            length = 0
+            for line in head.split(b"\r\n"):
+                if line.lower().startswith(b"content-length:"):
+                    length = int(line.split(b":", 1)[1])
+            if length:
+                await reader.readexactly(length)
+            writer.write(
+                b"HTTP/1.1 200 OK\r\n"
+                b"Content-Type: application/json\r\n"
+                + f"Content-Length: {len(body)}\r\n\r\n".encode()
+                + body
+            )
+            await writer.drain()
+    except (asyncio.IncompleteReadError, ConnectionResetError):
+        pass
+    finally:
+        writer.close()
+
+
+async def _time_calls(fn, calls: int) -> list[float]:
+    samples = []
+    for _ in range(calls):
+        t0 = time.perf_counter()
+        await fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+    return samples
+
+
+def _report(label: str, samples: list[float]) -> dict:
+    samples = sorted(samples)
+    return {
+        "mode": label,
+        "mean_ms": round(statistics.mean(samples), 3),
+        "p50_ms": round(samples[len(samples) // 2], 3),
+        "p95_ms": round(samples[int(len(samples) * 0.95) - 1], 3),
+    }
+
+
+async def main(calls: int) -> None:
+    server = await asyncio.start_server(_handle, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    os.environ.setdefault("SUPABASE_URL", "http://localhost")
+    os.environ.setdefault("SUPABASE_SERVICE_KEY", "bench")
+    os.environ["OLLAMA_BASE_URL"] = f"http://127.0.0.1:{port}"
+
+    import httpx
+    from app.rag.embeddings import generate_embedding
+    from app.utils.http_client import close_http_client, init_http_client
+
+    url = f"http://127.0.0.1:{port}/api/embeddings"
+    payload = {"model": "stub", "prompt": "hello"}
+
+    async def per_call_client():
+        async with httpx.AsyncClient(timeout=httpx.Timeout(120.0, connect=30.0)) as client:
+            (await client.post(url, json=payload)).json()
+
+    async def pooled_client():
+        await generate_embedding("hello")
+
+    async with server:
+        await init_http_client()
+        await pooled_client()  # warm the pool
+        results = [
+            _report("client_per_call", await _time_calls(per_call_client, calls)),
+            _report("pooled_client", await _time_calls(pooled_client, calls)),
+        ]
+        await close_http_client()
+
+    saved = results[0]["mean_ms"] - results[1]["mean_ms"]
+    print(json.dumps({"calls": calls, "results": results, "saved_mean_ms": round(saved, 3)}, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=500)
+    args = parser.parse_args()
+    asyncio.run(main(args.calls))
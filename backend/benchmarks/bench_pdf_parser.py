@@ -0,0 +1,76 @@
+"""
+PDF text extraction throughput (pages/sec) with 1, 2, 4 and 8 worker processes.
+
+Builds a synthetic text-heavy PDF with PyMuPDF, then streams it through
+`iter_pages_async` (the ingestion path, reading a `spooled_pdf` file) with a
+dedicated ProcessPoolExecutor per run.
+
+    cd backend && python -m benchmarks.bench_pdf_parser --pages 800
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import fitz
+
+LINE = "The mitochondria is the powerhouse of the cell; ATP synthesis follows oxidative phosphorylation."
+
+
+def build_pdf(pages: int) -> bytes:
+    doc = fitz.open()
+    for i in range(pages):
+        page = doc.new_page()
+        text = f"Chapter {i // 20 + 1}, page {i + 1}\n" + "\n".join(LINE for _ in range(45))
+        page.insert_textbox(fitz.Rect(36, 36, 576, 806), text, fontsize=9)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+async def extract(pdf_bytes: bytes, executor: ProcessPoolExecutor, workers: int) -> list[dict]:
+    from app.rag.pdf_parser import get_page_count_async, iter_pages_async, spooled_pdf
+
+    async with spooled_pdf(pdf_bytes) as path:
+        page_count = await get_page_count_async(path, executor)
+        return [p async for p in iter_pages_async(path, page_count, executor, workers)]
+
+
+async def run(pdf_bytes: bytes, workers: int, repeats: int) -> dict:
+    with ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        await extract(pdf_bytes, executor, workers)  # warm up
+        best = float("inf")
+        page_count = 0
+        for _ in range(repeats):
+            t0 = time.perf_counter()
+            pages = await extract(pdf_bytes, executor, workers)
+            best = min(best, time.perf_counter() - t0)
+            page_count = len(pages)
+            assert [p["page_number"] for p in pages] == list(range(1, page_count + 1))
+    return {
+        "workers": workers,
+        "pages": page_count,
+        "seconds": round(best, 4),
+        "pages_per_sec": round(page_count / best, 1),
+    }
+
+
+async def main(pages: int, repeats: int) -> None:
+    os.environ.setdefault("SUPABASE_URL", "http://localhost")
+    os.environ.setdefault("SUPABASE_SERVICE_KEY", "bench")
+    pdf_bytes = build_pdf(pages)
+    results = [await run(pdf_bytes, w, repeats) for w in (1, 2, 4, 8)]
+    print(json.dumps({"cpu_count": os.cpu_count(), "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=800)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+    asyncio.run(main(args.pages, args.repeats))
@@ -0,0 +1,91 @@
+"""
+Recall and memory of quantized candidate search with full-precision re-ranking.
+
+Builds a synthetic subject of clustered unit vectors (real embeddings are far from
+isotropic), then compares exact search with int8 and binary candidate search at
+several re-rank depths. Recall@k is the overlap with the exact top-k.
+
+    cd backend && python -m benchmarks.bench_quantization --chunks 20000 --dim 768
+"""
+import argparse
+import json
+import statistics
+import time
+
+import numpy as np
+
+from app.rag.vector_index import SubjectIndex, normalize_rows
+
+
+def build_vectors(count: int, dim: int, clusters: int, seed: int = 7) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, clusters, size=count)
+    noise = rng.normal(scale=0.6, size=(count, dim)).astype(np.float32)
+    return normalize_rows(centers[labels] + noise)
+
+
+def build_queries(matrix: np.ndarray, count: int, seed: int = 11) -> np.ndarray:
+    # Queries near stored chunks, like a question paraphrasing a passage.
+    rng = np.random.default_rng(seed)
+    picks = matrix[rng.integers(0, matrix.shape[0], size=count)]
+    return normalize_rows(picks + rng.normal(scale=0.05, size=picks.shape).astype(np.float32))
+
+
+def _run(index: SubjectIndex, queries: np.ndarray, k: int) -> tuple[list[list[str]], list[float]]:
+    results, latencies = [], []
+    for query in queries:
+        t0 = time.perf_counter()
+        hits = index.search(query, k)
+        latencies.append((time.perf_counter() - t0) * 1000)
+        results.append([h["id"] for h in hits])
+    return results, latencies
+
+
+def main(count: int, dim: int, clusters: int, query_count: int, k: int) -> None:
+    matrix = build_vectors(count, dim, clusters)
+    queries = build_queries(matrix, query_count)
+    rows = [{"id": str(i), "teacher_id": "t", "document_id": "d"} for i in range(count)]
+
+    exact_index = SubjectIndex("bench", rows, matrix)
+    exact, exact_ms = _run(exact_index, queries, k)
+    report = {
+        "chunks": count,
+        "dim": dim,
+        "k": k,
+        "queries": query_count,
+        "exact": {
+            "bytes": exact_index.nbytes,
+            "p50_ms": round(statistics.median(exact_ms), 3),
+        },
+        "quantized": [],
+    }
+
+    for kind in ("int8", "binary"):
+        for depth in (k, 50, 200, 500):
+            index = SubjectIndex("bench", rows, matrix, quantization=kind, rerank_candidates=depth)
+            index.prepare()
+            found, ms = _run(index, queries, k)
+            recall = statistics.mean(
+                len(set(a) & set(b)) / k for a, b in zip(found, exact)
+            )
+            report["quantized"].append({
+                "quantization": kind,
+                "rerank_candidates": depth,
+                "compact_bytes": index.quantized.nbytes,
+                "compression": round(exact_index.nbytes / index.quantized.nbytes, 1),
+                "recall_at_k": round(recall, 4),
+                "p50_ms": round(statistics.median(ms), 3),
+            })
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=20000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--clusters", type=int, default=64)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+    main(args.chunks, args.dim, args.clusters, args.queries, args.k)
@@ -0,0 +1,251 @@
+"""
+Retrieval latency and quality on synthetic subjects, fully offline.
+
+Builds subjects of roughly 1k, 10k and 100k chunks from generated course text,
+chunked with `extract_page_chunks` for each (chunk_size, chunk_overlap) pair and
+embedded by a deterministic feature-hashing embedder (no Ollama). Each subject
+is installed in the in-process indexes and every configuration runs the same
+queries through `retrieve_relevant_chunks` and `format_context`.
+
+Per configuration it reports p50/p95 latency, queries/sec, recall@k against a
+brute-force exact top-k over the same embeddings, hit rate of the chunk holding
+the planted fact each query asks about, and context token counts (optionally
+packed to --context-tokens, see app/rag/context_packer.py). The pgvector
+RPC backend needs a database and is covered by bench_subject_partitions.py.
+
+    cd backend && python -m benchmarks.bench_retrieval --sizes 1000,10000,100000 --output retrieval.json
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import statistics
+import subprocess
+import time
+
+import numpy as np
+
+from app.config import get_settings
+from app.rag import lexical_index, vector_index
+from app.rag.chunker import count_tokens, extract_page_chunks
+from app.rag.lexical_index import LexicalIndexStore, SubjectLexicalIndex, term_frequencies, tokenize
+from app.rag.retriever import format_context, retrieve_relevant_chunks
+from app.rag.vector_index import SubjectIndex, VectorIndexStore, normalize_rows, top_k_indices
+
+SUBJECT_ID = "bench-subject"
+TEACHER_ID = "bench-teacher"
+WORDS_PER_PAGE = 400
+TOPICS = 40
+WORDS_PER_TOPIC = 120
+COMMON = "the of and a to in is that for it as with was on are by this be from or".split()
+
+
+class HashingEmbedder:
+    """
+    Deterministic bag-of-words embedding: each BM25 token adds ±1 to a few hashed
+    dimensions, so vectors are dense enough for quantization to behave realistically.
+    """
+
+    SLOTS_PER_TERM = 8
+
+    def __init__(self, dim: int):
+        self.dim = dim
+        self._slots: dict[str, tuple[np.ndarray, np.ndarray]] = {}
+
+    def _slot(self, term: str) -> tuple[np.ndarray, np.ndarray]:
+        slot = self._slots.get(term)
+        if slot is None:
+            digest = hashlib.blake2b(term.encode(), digest_size=8 * self.SLOTS_PER_TERM).digest()
+            hashes = np.frombuffer(digest, dtype=np.uint64)
+            slot = self._slots[term] = (
+                (hashes % self.dim).astype(np.int64),
+                np.where((hashes >> np.uint64(40)) & np.uint64(1), 1.0, -1.0).astype(np.float32),
+            )
+        return slot
+
+    def embed(self, text: str) -> np.ndarray:
+        vec = np.zeros(self.dim, dtype=np.float32)
+        for term in tokenize(text):
+            idx, signs = self._slot(term)
+            np.add.at(vec, idx, signs)
+        norm = float(np.linalg.norm(vec))
+        return vec / norm if norm else vec
+
+
+def _vocabulary(rng: random.Random) -> list[list[str]]:
+    syllables = ["ka", "lo", "mi", "ne", "ru", "sa", "ti", "vo", "ze", "pha", "gen", "tor", "lux", "cyt", "bio"]
+    topics = []
+    for _ in range(TOPICS):
+        words = set()
+        while len(words) < WORDS_PER_TOPIC:
+            words.add("".join(rng.choice(syllables) for _ in range(rng.randint(2, 4))))
+        topics.append(sorted(words))
+    return topics
+
+
+def build_corpus(target_chunks: int, chunk_size: int, chunk_overlap: int, seed: int = 7):
+    """Pages of topical text with planted facts; returns (chunks, facts)."""
+    rng = random.Random(seed)
+    topics = _vocabulary(rng)
+    # Rough words needed: ~1.3 tokens per generated word, one new window every (size - overlap).
+    words_needed = int(target_chunks * max(1, chunk_size - chunk_overlap) / 1.3)
+    pages, facts = [], []
+    page_number = 0
+    while words_needed > 0:
+        page_number += 1
+        topic = topics[rng.randrange(TOPICS)]
+        words = [rng.choice(topic) if rng.random() < 0.7 else rng.choice(COMMON) for _ in range(WORDS_PER_PAGE)]
+        if rng.random() < 0.5:
+            code = f"ref-{len(facts):05d}"
+            keywords = rng.sample(topic, 3)
+            sentence = f"Definition {code}: {' '.join(keywords)} governs {rng.choice(topic)}."
+            words.insert(rng.randrange(len(words)), sentence)
+            facts.append({"code": code, "query": f"What does {code} say about {keywords[0]} and {keywords[1]}?"})
+        pages.append({"page_number": page_number, "text": " ".join(words)})
+        words_needed -= WORDS_PER_PAGE
+    chunks = extract_page_chunks(pages, chunk_size, chunk_overlap)
+    return chunks, facts
+
+
+def build_indexes(chunks: list[dict], embedder: HashingEmbedder):
+    rows = [
+        {
+            "id": f"c{i}",
+            "teacher_id": TEACHER_ID,
+            "subject_id": SUBJECT_ID,
+            "document_id": "bench-document",
+            "content": chunk["content"],
+            "page_number": chunk["page_number"],
+            "page_end": chunk["page_end"],
+            "chunk_index": i,
+            "token_count": chunk["token_count"],
+            "overlap_tokens": chunk["overlap_tokens"],
+        }
+        for i, chunk in enumerate(chunks)
+    ]
+    matrix = normalize_rows(np.stack([embedder.embed(c["content"]) for c in chunks]))
+    terms = [term_frequencies(c["content"]) for c in chunks]
+    return rows, matrix, terms
+
+
+def _install(rows, matrix, terms, quantization: str, rerank_candidates: int) -> None:
+    # Fresh stores that never consult the database (refresh is disabled).
+    store = VectorIndexStore(
+        memory_budget=1 << 40,
+        refresh_seconds=float("inf"),
+        quantization=quantization,
+        rerank_candidates=rerank_candidates,
+    )
+    store.put(SubjectIndex(SUBJECT_ID, rows, matrix, quantization, rerank_candidates))
+    vector_index._store = store
+    lexical = LexicalIndexStore(max_subjects=1, refresh_seconds=float("inf"))
+    lexical.put(SubjectLexicalIndex(SUBJECT_ID, rows, terms))
+    lexical_index._store = lexical
+
+
+async def run_config(rows, matrix, facts, queries, embedder, config: dict) -> dict:
+    settings = get_settings()
+    settings.retrieval_backend = "numpy"
+    settings.vector_quantization = config["quantization"]
+    settings.hybrid_retrieval = config["hybrid"]
+    k = config["top_k"]
+
+    latencies, context_tokens, recalls, hits = [], [], [], []
+    started = time.perf_counter()
+    for fact, query in zip(facts, queries):
+        q_vec = embedder.embed(query)
+        t0 = time.perf_counter()
+        chunks = await retrieve_relevant_chunks(
+            query, SUBJECT_ID, TEACHER_ID, top_k=k, query_embedding=q_vec.tolist()
+        )
+        context = format_context(chunks, config["context_tokens"])
+        latencies.append((time.perf_counter() - t0) * 1000)
+        context_tokens.append(count_tokens(context))
+
+        exact = {rows[i]["id"] for i in top_k_indices(matrix @ q_vec, k)}
+        found = [c["id"] for c in chunks]
+        recalls.append(len(exact & set(found)) / k)
+        hits.append(fact["code"] in context)
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        **config,
+        "p50_ms": round(latencies[len(latencies) // 2], 3),
+        "p95_ms": round(latencies[max(0, int(len(latencies) * 0.95) - 1)], 3),
+        "queries_per_sec": round(len(queries) / elapsed, 1),
+        "recall_at_k": round(statistics.mean(recalls), 4),
+        "fact_hit_rate": round(float(statistics.mean(hits)), 4),
+        "context_tokens_mean": round(statistics.mean(context_tokens), 1),
+        "context_tokens_max": max(context_tokens),
+    }
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except Exception:
+        return "unknown"
+
+
+async def main(sizes, chunk_configs, top_ks, query_count, dim, rerank_candidates, context_tokens) -> dict:
+    embedder = HashingEmbedder(dim)
+    report = {"commit": _git_commit(), "dim": dim, "queries": query_count, "subjects": []}
+    for size in sizes:
+        for chunk_size, chunk_overlap in chunk_configs:
+            t0 = time.perf_counter()
+            chunks, facts = build_corpus(size, chunk_size, chunk_overlap)
+            rows, matrix, terms = build_indexes(chunks, embedder)
+            build_s = time.perf_counter() - t0
+            sample = random.Random(3).sample(facts, min(query_count, len(facts)))
+            queries = [f["query"] for f in sample]
+
+            results = []
+            for quantization in ("none", "int8", "binary"):
+                _install(rows, matrix, terms, quantization, rerank_candidates)
+                for hybrid in (False, True):
+                    for k in top_ks:
+                        config = {
+                            "quantization": quantization,
+                            "hybrid": hybrid,
+                            "top_k": k,
+                            "context_tokens": context_tokens,
+                        }
+                        results.append(await run_config(rows, matrix, sample, queries, embedder, config))
+            report["subjects"].append({
+                "target_chunks": size,
+                "chunks": len(chunks),
+                "chunk_size": chunk_size,
+                "chunk_overlap": chunk_overlap,
+                "build_seconds": round(build_s, 2),
+                "results": results,
+            })
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="1000,10000,100000")
+    parser.add_argument("--chunk-configs", default="300:30,800:150", help="size:overlap pairs")
+    parser.add_argument("--top-k", default="5,10")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--rerank-candidates", type=int, default=200)
+    parser.add_argument("--context-tokens", type=int, default=0, help="format_context budget (0 = unpacked)")
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args()
+    result = asyncio.run(main(
+        [int(s) for s in args.sizes.split(",")],
+        [tuple(int(v) for v in pair.split(":")) for pair in args.chunk_configs.split(",")],
+        [int(k) for k in args.top_k.split(",")],
+        args.queries,
+        args.dim,
+        args.rerank_candidates,
+        args.context_tokens,
+    ))
+    text = json.dumps(result, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
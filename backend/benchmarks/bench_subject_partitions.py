@@ -0,0 +1,182 @@
+"""
+Filtered vector search latency on the real database as the chunk table grows.
+
+Creates a throwaway organization with one small "probe" subject and filler subjects,
+then grows the total number of chunks step by step. After each step it runs the
+probe subject's query through `explain_match_document_chunks` (EXPLAIN ANALYZE,
+see supabase_migration_subject_partitions.sql) and `match_document_chunks`, both
+with the exact-scan fallback and with HNSW forced (threshold 0). It reports server
+execution time, buffers, rows returned and recall@k against an exact NumPy search.
+With partitioning and iterative scans these should stay flat as the total grows.
+
+Needs SUPABASE_URL / SUPABASE_SERVICE_KEY of a development project. Everything it
+inserts is deleted at the end unless --keep is given.
+
+    cd backend && python -m benchmarks.bench_subject_partitions --totals 10000,50000,100000
+"""
+import argparse
+import json
+import statistics
+import time
+import uuid
+
+import numpy as np
+
+from app.rag.vector_index import normalize_rows, top_k_indices
+from app.utils.supabase_client import get_supabase
+
+DIM = 768
+INSERT_BATCH = 500
+
+
+def _vectors(rng: np.random.Generator, count: int, center: np.ndarray) -> np.ndarray:
+    return normalize_rows(center + rng.normal(scale=0.8, size=(count, DIM)).astype(np.float32))
+
+
+def _create_subject(supabase, teacher_id: str, organization_id: str, name: str) -> tuple[str, str]:
+    subject = supabase.table("subjects").insert({
+        "teacher_id": teacher_id,
+        "organization_id": organization_id,
+        "name": name,
+    }).execute().data[0]
+    document = supabase.table("documents").insert({
+        "teacher_id": teacher_id,
+        "subject_id": subject["id"],
+        "filename": f"{name}.pdf",
+        "status": "ready",
+    }).execute().data[0]
+    return subject["id"], document["id"]
+
+
+def _insert_chunks(supabase, teacher_id, subject_id, document_id, vectors: np.ndarray) -> None:
+    for start in range(0, len(vectors), INSERT_BATCH):
+        batch = vectors[start:start + INSERT_BATCH]
+        supabase.table("document_chunks").insert([
+            {
+                "teacher_id": teacher_id,
+                "subject_id": subject_id,
+                "document_id": document_id,
+                "content": f"synthetic chunk {start + i}",
+                "embedding": vec.round(5).tolist(),
+                "page_number": 1,
+            }
+            for i, vec in enumerate(batch)
+        ]).execute()
+    # match_document_chunks sizes subjects by documents.chunk_count.
+    current = supabase.table("documents").select("chunk_count").eq("id", document_id).execute()
+    supabase.table("documents").update({
+        "chunk_count": current.data[0]["chunk_count"] + len(vectors),
+    }).eq("id", document_id).execute()
+
+
+def _plan_stats(explained: dict) -> dict:
+    plan = explained["plan"][0]
+    root = plan["Plan"]
+    nodes, stack = [], [root]
+    while stack:
+        node = stack.pop()
+        nodes.append(node["Node Type"] + (f" on {node['Index Name']}" if "Index Name" in node else ""))
+        stack.extend(node.get("Plans", []))
+    return {
+        "execution_ms": plan["Execution Time"],
+        "shared_buffers": root.get("Shared Hit Blocks", 0) + root.get("Shared Read Blocks", 0),
+        "exact_scan": explained["exact_scan"],
+        "nodes": nodes,
+    }
+
+
+def _probe(supabase, teacher_id, subject_id, probe_vectors, queries, k, threshold) -> dict:
+    params_base = {
+        "match_count": k,
+        "filter_subject_id": subject_id,
+        "filter_teacher_id": teacher_id,
+        "exact_scan_threshold": threshold,
+    }
+    exec_ms, rpc_ms, buffers, returned, recalls, nodes, exact_scan = [], [], [], [], [], None, None
+    for query in queries:
+        params = {**params_base, "query_embedding": query.round(5).tolist()}
+        stats = _plan_stats(supabase.rpc("explain_match_document_chunks", params).execute().data)
+        exec_ms.append(stats["execution_ms"])
+        buffers.append(stats["shared_buffers"])
+        nodes, exact_scan = stats["nodes"], stats["exact_scan"]
+
+        t0 = time.perf_counter()
+        rows = supabase.rpc("match_document_chunks", params).execute().data
+        rpc_ms.append((time.perf_counter() - t0) * 1000)
+        returned.append(len(rows))
+        exact = {f"synthetic chunk {i}" for i in top_k_indices(probe_vectors @ query, k)}
+        recalls.append(len(exact & {r["content"] for r in rows}) / k)
+    return {
+        "exact_scan": exact_scan,
+        "plan_nodes": nodes,
+        "execution_ms_p50": round(statistics.median(exec_ms), 3),
+        "rpc_ms_p50": round(statistics.median(rpc_ms), 2),
+        "shared_buffers_p50": statistics.median(buffers),
+        "rows_returned_min": min(returned),
+        "recall_at_k": round(statistics.mean(recalls), 4),
+    }
+
+
+def main(totals: list[int], probe_size: int, filler_subject_size: int, k: int, query_count: int, keep: bool):
+    supabase = get_supabase()
+    rng = np.random.default_rng(5)
+    teacher_id = str(uuid.uuid4())
+    organization = supabase.table("organizations").insert({
+        "teacher_id": teacher_id,
+        "name": "bench_subject_partitions",
+    }).execute().data[0]
+
+    report = {"probe_chunks": probe_size, "k": k, "steps": []}
+    try:
+        probe_center = rng.normal(size=DIM).astype(np.float32)
+        probe_subject, probe_document = _create_subject(supabase, teacher_id, organization["id"], "probe")
+        probe_vectors = _vectors(rng, probe_size, probe_center)
+        _insert_chunks(supabase, teacher_id, probe_subject, probe_document, probe_vectors)
+        queries = _vectors(rng, query_count, probe_center)
+
+        total = probe_size
+        filler_index = 0
+        for target in sorted(totals):
+            while total < target:
+                count = min(filler_subject_size, target - total)
+                subject_id, document_id = _create_subject(
+                    supabase, teacher_id, organization["id"], f"filler-{filler_index}"
+                )
+                center = rng.normal(size=DIM).astype(np.float32)
+                _insert_chunks(supabase, teacher_id, subject_id, document_id, _vectors(rng, count, center))
+                total += count
+                filler_index += 1
+            report["steps"].append({
+                "total_chunks": total,
+                "exact_fallback": _probe(
+                    supabase, teacher_id, probe_subject, probe_vectors, queries, k, threshold=probe_size
+                ),
+                "hnsw": _probe(
+                    supabase, teacher_id, probe_subject, probe_vectors, queries, k, threshold=0
+                ),
+            })
+            print(json.dumps(report["steps"][-1]), flush=True)
+    finally:
+        if not keep:
+            # Cascades to subjects, documents and chunks.
+            supabase.table("organizations").delete().eq("id", organization["id"]).execute()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--totals", default="10000,50000,100000")
+    parser.add_argument("--probe-size", type=int, default=300)
+    parser.add_argument("--filler-subject-size", type=int, default=5000)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=20)
+    parser.add_argument("--keep", action="store_true", help="leave the synthetic data in place")
+    args = parser.parse_args()
+    main(
+        [int(t) for t in args.totals.split(",")],
+        args.probe_size,
+        args.filler_subject_size,
+        args.k,
+        args.queries,
+        args.keep,
+    )
@@ -0,0 +1,83 @@
+-- Binary-quantized embeddings for fast candidate search (VECTOR_QUANTIZATION=binary).
+-- Opt-in and not part of supabase_schema.sql: the extra column and index cost storage
+-- and write-time index maintenance. Requires pgvector >= 0.7.
+--
+-- Prerequisites: supabase_migration_subject_partitions.sql,
+-- supabase_migration_context_packing.sql and supabase_migration_ready_documents.sql
+-- (or a database created from the current supabase_schema.sql). Safe to re-run; run it
+-- again after any migration that recreates document_chunks.
+--
+-- embedding_bq is generated from embedding on every insert, so ingestion, duplicate
+-- copies and re-index swaps fill it without any application change. 768 bits = 96
+-- bytes per chunk vs 3 KB for the float vector.
+
+ALTER TABLE public.document_chunks
+    ADD COLUMN IF NOT EXISTS embedding_bq bit(768)
+    GENERATED ALWAYS AS (binary_quantize(embedding)::bit(768)) STORED;
+
+-- Created on the parent, so every partition gets its own copy.
+CREATE INDEX IF NOT EXISTS idx_chunks_embedding_bq ON public.document_chunks
+    USING hnsw (embedding_bq bit_hamming_ops);
+
+-- Earlier versions returned fewer columns, so the function is dropped and recreated.
+DROP FUNCTION IF EXISTS match_document_chunks_bq(vector, integer, uuid, uuid, integer);
+
+-- Same result shape as match_document_chunks: the nearest `candidate_count` chunks by
+-- Hamming distance are re-ranked by exact cosine distance on the full vectors.
+CREATE OR REPLACE FUNCTION match_document_chunks_bq(
+    query_embedding vector(768),
+    match_count INTEGER DEFAULT 5,
+    filter_subject_id UUID DEFAULT NULL,
+    filter_teacher_id UUID DEFAULT NULL,
+    candidate_count INTEGER DEFAULT 200
+)
+RETURNS TABLE (
+    id UUID,
+    teacher_id UUID,
+    subject_id UUID,
+    document_id UUID,
+    content TEXT,
+    page_number INTEGER,
+    page_end INTEGER,
+    chunk_index INTEGER,
+    token_count INTEGER,
+    overlap_tokens INTEGER,
+    similarity FLOAT
+)
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    PERFORM enable_hnsw_iterative_scan();
+
+    RETURN QUERY
+    SELECT
+        c.id,
+        c.teacher_id,
+        c.subject_id,
+        c.document_id,
+        c.content,
+        c.page_number,
+        c.page_end,
+        c.chunk_index,
+        c.token_count,
+        c.overlap_tokens,
+        1 - (c.embedding <=> query_embedding) AS similarity
+    FROM (
+        SELECT dc.*
+        FROM public.document_chunks dc
+        WHERE
+            (filter_subject_id IS NULL OR dc.subject_id = filter_subject_id)
+            AND (filter_teacher_id IS NULL OR dc.teacher_id = filter_teacher_id)
+            AND EXISTS (
+                SELECT 1 FROM public.documents d
+                WHERE d.id = dc.document_id AND d.status = 'ready'
+            )
+        ORDER BY dc.embedding_bq <~> binary_quantize(query_embedding)::bit(768)
+        LIMIT GREATEST(candidate_count, match_count)
+    ) c
+    ORDER BY c.embedding <=> query_embedding
+    LIMIT match_count;
+END;
+$$;
+
+NOTIFY pgrst, 'reload schema';
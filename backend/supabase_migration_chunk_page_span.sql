@@ -0,0 +1,76 @@
+-- Record the last page each chunk spans (page_number is the first). Run once in SQL Editor.
+-- Prerequisites: supabase_migration_document_dedup.sql.
+-- Run order: see supabase_schema.sql.
+
+ALTER TABLE public.document_chunks
+    ADD COLUMN IF NOT EXISTS page_end INTEGER;
+
+UPDATE public.document_chunks SET page_end = page_number WHERE page_end IS NULL;
+
+-- Return type changes, so the function must be dropped first.
+DROP FUNCTION IF EXISTS match_document_chunks(vector, INTEGER, UUID, UUID);
+
+CREATE OR REPLACE FUNCTION match_document_chunks(
+    query_embedding vector(768),
+    match_count INTEGER DEFAULT 5,
+    filter_subject_id UUID DEFAULT NULL,
+    filter_teacher_id UUID DEFAULT NULL
+)
+RETURNS TABLE (
+    id UUID,
+    teacher_id UUID,
+    subject_id UUID,
+    document_id UUID,
+    content TEXT,
+    page_number INTEGER,
+    page_end INTEGER,
+    similarity FLOAT
+)
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    RETURN QUERY
+    SELECT
+        dc.id,
+        dc.teacher_id,
+        dc.subject_id,
+        dc.document_id,
+        dc.content,
+        dc.page_number,
+        dc.page_end,
+        1 - (dc.embedding <=> query_embedding) AS similarity
+    FROM public.document_chunks dc
+    WHERE
+        (filter_subject_id IS NULL OR dc.subject_id = filter_subject_id)
+        AND (filter_teacher_id IS NULL OR dc.teacher_id = filter_teacher_id)
+    ORDER BY dc.embedding <=> query_embedding
+    LIMIT match_count;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION copy_document_chunks(
+    source_document_id UUID,
+    target_document_id UUID,
+    target_subject_id UUID
+)
+RETURNS INTEGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    copied INTEGER;
+BEGIN
+    INSERT INTO public.document_chunks (
+        teacher_id, subject_id, document_id, content, embedding, page_number, page_end
+    )
+    SELECT
+        dc.teacher_id, target_subject_id, target_document_id, dc.content, dc.embedding,
+        dc.page_number, dc.page_end
+    FROM public.document_chunks dc
+    WHERE dc.document_id = source_document_id;
+
+    GET DIAGNOSTICS copied = ROW_COUNT;
+    RETURN copied;
+END;
+$$;
+
+NOTIFY pgrst, 'reload schema';
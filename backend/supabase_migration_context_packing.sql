@@ -0,0 +1,169 @@
+-- Per-chunk position and token counts for token-budgeted context packing. Run once in
+-- SQL Editor. Chunks ingested before this migration keep NULLs; the packer then
+-- estimates their size from the text and only merges them on overlapping text.
+-- Prerequisites: supabase_migration_subject_partitions.sql.
+-- Run order: see supabase_schema.sql.
+
+ALTER TABLE public.document_chunks
+    ADD COLUMN IF NOT EXISTS chunk_index INTEGER,
+    ADD COLUMN IF NOT EXISTS token_count INTEGER,
+    ADD COLUMN IF NOT EXISTS overlap_tokens INTEGER;
+
+ALTER TABLE public.document_chunks_staging
+    ADD COLUMN IF NOT EXISTS chunk_index INTEGER,
+    ADD COLUMN IF NOT EXISTS token_count INTEGER,
+    ADD COLUMN IF NOT EXISTS overlap_tokens INTEGER;
+
+-- The result columns change, so the search functions are dropped and recreated.
+DROP FUNCTION IF EXISTS match_document_chunks(vector, integer, uuid, uuid, integer);
+
+CREATE OR REPLACE FUNCTION match_document_chunks(
+    query_embedding vector(768),
+    match_count INTEGER DEFAULT 5,
+    filter_subject_id UUID DEFAULT NULL,
+    filter_teacher_id UUID DEFAULT NULL,
+    exact_scan_threshold INTEGER DEFAULT 5000
+)
+RETURNS TABLE (
+    id UUID,
+    teacher_id UUID,
+    subject_id UUID,
+    document_id UUID,
+    content TEXT,
+    page_number INTEGER,
+    page_end INTEGER,
+    chunk_index INTEGER,
+    token_count INTEGER,
+    overlap_tokens INTEGER,
+    similarity FLOAT
+)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    subject_chunks BIGINT;
+BEGIN
+    IF filter_subject_id IS NOT NULL THEN
+        SELECT COALESCE(SUM(d.chunk_count), 0) INTO subject_chunks
+        FROM public.documents d
+        WHERE d.subject_id = filter_subject_id;
+
+        IF subject_chunks <= exact_scan_threshold THEN
+            -- "+ 0" keeps the planner on idx_chunks_subject instead of the HNSW index.
+            RETURN QUERY
+            SELECT
+                dc.id, dc.teacher_id, dc.subject_id, dc.document_id, dc.content,
+                dc.page_number, dc.page_end, dc.chunk_index, dc.token_count, dc.overlap_tokens,
+                1 - (dc.embedding <=> query_embedding) AS similarity
+            FROM public.document_chunks dc
+            WHERE dc.subject_id = filter_subject_id
+                AND (filter_teacher_id IS NULL OR dc.teacher_id = filter_teacher_id)
+            ORDER BY (dc.embedding <=> query_embedding) + 0
+            LIMIT match_count;
+            RETURN;
+        END IF;
+    END IF;
+
+    PERFORM enable_hnsw_iterative_scan();
+    PERFORM set_config('hnsw.ef_search', GREATEST(40, match_count * 4)::text, true);
+
+    IF filter_subject_id IS NOT NULL THEN
+        -- A plain equality (no "IS NULL OR") lets the executor prune to one partition.
+        RETURN QUERY
+        SELECT m.* FROM (
+            SELECT
+                dc.id, dc.teacher_id, dc.subject_id, dc.document_id, dc.content,
+                dc.page_number, dc.page_end, dc.chunk_index, dc.token_count, dc.overlap_tokens,
+                1 - (dc.embedding <=> query_embedding) AS similarity
+            FROM public.document_chunks dc
+            WHERE dc.subject_id = filter_subject_id
+                AND (filter_teacher_id IS NULL OR dc.teacher_id = filter_teacher_id)
+            ORDER BY dc.embedding <=> query_embedding
+            LIMIT match_count
+        ) m
+        ORDER BY m.similarity DESC;
+        RETURN;
+    END IF;
+
+    RETURN QUERY
+    SELECT m.* FROM (
+        SELECT
+            dc.id, dc.teacher_id, dc.subject_id, dc.document_id, dc.content,
+            dc.page_number, dc.page_end, dc.chunk_index, dc.token_count, dc.overlap_tokens,
+            1 - (dc.embedding <=> query_embedding) AS similarity
+        FROM public.document_chunks dc
+        WHERE filter_teacher_id IS NULL OR dc.teacher_id = filter_teacher_id
+        ORDER BY dc.embedding <=> query_embedding
+        LIMIT match_count
+    ) m
+    -- relaxed_order may return neighbours slightly out of order.
+    ORDER BY m.similarity DESC;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION copy_document_chunks(
+    source_document_id UUID,
+    target_document_id UUID,
+    target_subject_id UUID
+)
+RETURNS INTEGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    copied INTEGER;
+BEGIN
+    INSERT INTO public.document_chunks (
+        teacher_id, subject_id, document_id, content, embedding, page_number, page_end,
+        chunk_index, token_count, overlap_tokens, lexical_terms, chunker_version, embed_model
+    )
+    SELECT
+        dc.teacher_id, target_subject_id, target_document_id, dc.content, dc.embedding,
+        dc.page_number, dc.page_end, dc.chunk_index, dc.token_count, dc.overlap_tokens,
+        dc.lexical_terms, dc.chunker_version, dc.embed_model
+    FROM public.document_chunks dc
+    WHERE dc.document_id = source_document_id;
+
+    GET DIAGNOSTICS copied = ROW_COUNT;
+    RETURN copied;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION swap_document_chunks(
+    p_document_id UUID,
+    p_index_version TEXT,
+    p_page_count INTEGER,
+    p_chunk_count INTEGER
+)
+RETURNS VOID
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    PERFORM 1 FROM public.documents WHERE id = p_document_id FOR UPDATE;
+    IF NOT FOUND THEN
+        RAISE EXCEPTION 'document % not found', p_document_id;
+    END IF;
+
+    DELETE FROM public.document_chunks WHERE document_id = p_document_id;
+
+    INSERT INTO public.document_chunks (
+        teacher_id, subject_id, document_id, content, embedding,
+        page_number, page_end, chunk_index, token_count, overlap_tokens,
+        lexical_terms, chunker_version, embed_model
+    )
+    SELECT
+        s.teacher_id, s.subject_id, s.document_id, s.content, s.embedding,
+        s.page_number, s.page_end, s.chunk_index, s.token_count, s.overlap_tokens,
+        s.lexical_terms, s.chunker_version, s.embed_model
+    FROM public.document_chunks_staging s
+    WHERE s.document_id = p_document_id;
+
+    DELETE FROM public.document_chunks_staging WHERE document_id = p_document_id;
+
+    UPDATE public.documents
+    SET index_version = p_index_version,
+        page_count = p_page_count,
+        chunk_count = p_chunk_count
+    WHERE id = p_document_id;
+END;
+$$;
+
+NOTIFY pgrst, 'reload schema';
@@ -0,0 +1,36 @@
+-- Whole-document deduplication by PDF content hash. Run once in SQL Editor.
+-- Prerequisites: none. copy_document_chunks is redefined by later migrations.
+-- Run order: see supabase_schema.sql.
+
+ALTER TABLE public.documents
+    ADD COLUMN IF NOT EXISTS content_sha256 TEXT;
+
+CREATE INDEX IF NOT EXISTS idx_documents_teacher_sha256
+    ON public.documents(teacher_id, content_sha256);
+
+-- Copy an indexed document's chunks (text + embeddings) into another document in one statement.
+CREATE OR REPLACE FUNCTION copy_document_chunks(
+    source_document_id UUID,
+    target_document_id UUID,
+    target_subject_id UUID
+)
+RETURNS INTEGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    copied INTEGER;
+BEGIN
+    INSERT INTO public.document_chunks (
+        teacher_id, subject_id, document_id, content, embedding, page_number
+    )
+    SELECT
+        dc.teacher_id, target_subject_id, target_document_id, dc.content, dc.embedding, dc.page_number
+    FROM public.document_chunks dc
+    WHERE dc.document_id = source_document_id;
+
+    GET DIAGNOSTICS copied = ROW_COUNT;
+    RETURN copied;
+END;
+$$;
+
+NOTIFY pgrst, 'reload schema';
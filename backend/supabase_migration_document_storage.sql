@@ -1,4 +1,6 @@
 -- Add storage path for PDF preview (Supabase Storage). Run in SQL Editor after creating bucket "documents".
+-- Prerequisites: none.
+-- Run order: see supabase_schema.sql.
 
 ALTER TABLE public.documents
     ADD COLUMN IF NOT EXISTS storage_path TEXT;
@@ -0,0 +1,35 @@
+-- Background PDF ingestion: document status + job tracking. Run once in SQL Editor.
+-- Prerequisites: none.
+-- Run order: see supabase_schema.sql.
+
+ALTER TABLE public.documents
+    ADD COLUMN IF NOT EXISTS status TEXT NOT NULL DEFAULT 'ready'
+    CHECK (status IN ('processing', 'ready'));
+
+CREATE TABLE IF NOT EXISTS public.ingestion_jobs (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    teacher_id UUID NOT NULL,
+    subject_id UUID NOT NULL REFERENCES public.subjects(id) ON DELETE CASCADE,
+    document_id UUID REFERENCES public.documents(id) ON DELETE SET NULL,
+    filename TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued'
+        CHECK (status IN ('queued', 'processing', 'completed', 'failed', 'cancelled')),
+    progress INTEGER NOT NULL DEFAULT 0,
+    processed_chunks INTEGER NOT NULL DEFAULT 0,
+    total_chunks INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    created_at TIMESTAMPTZ DEFAULT now(),
+    updated_at TIMESTAMPTZ DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS idx_ingestion_jobs_teacher ON public.ingestion_jobs(teacher_id);
+CREATE INDEX IF NOT EXISTS idx_ingestion_jobs_active ON public.ingestion_jobs(status)
+    WHERE status IN ('queued', 'processing');
+
+ALTER TABLE public.ingestion_jobs ENABLE ROW LEVEL SECURITY;
+
+DROP POLICY IF EXISTS "Service role full access ingestion_jobs" ON public.ingestion_jobs;
+CREATE POLICY "Service role full access ingestion_jobs" ON public.ingestion_jobs
+    FOR ALL USING (true) WITH CHECK (true);
+
+NOTIFY pgrst, 'reload schema';
@@ -0,0 +1,76 @@
+-- Per-chunk term counts for hybrid BM25 + vector retrieval. Run once in SQL Editor.
+-- Chunks ingested before this migration keep NULL and are tokenized when a subject's
+-- lexical index is first built.
+-- Prerequisites: supabase_migration_reindex.sql.
+-- Run order: see supabase_schema.sql.
+
+ALTER TABLE public.document_chunks
+    ADD COLUMN IF NOT EXISTS lexical_terms JSONB;
+
+ALTER TABLE public.document_chunks_staging
+    ADD COLUMN IF NOT EXISTS lexical_terms JSONB;
+
+CREATE OR REPLACE FUNCTION copy_document_chunks(
+    source_document_id UUID,
+    target_document_id UUID,
+    target_subject_id UUID
+)
+RETURNS INTEGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    copied INTEGER;
+BEGIN
+    INSERT INTO public.document_chunks (
+        teacher_id, subject_id, document_id, content, embedding, page_number, page_end,
+        lexical_terms, chunker_version, embed_model
+    )
+    SELECT
+        dc.teacher_id, target_subject_id, target_document_id, dc.content, dc.embedding,
+        dc.page_number, dc.page_end, dc.lexical_terms, dc.chunker_version, dc.embed_model
+    FROM public.document_chunks dc
+    WHERE dc.document_id = source_document_id;
+
+    GET DIAGNOSTICS copied = ROW_COUNT;
+    RETURN copied;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION swap_document_chunks(
+    p_document_id UUID,
+    p_index_version TEXT,
+    p_page_count INTEGER,
+    p_chunk_count INTEGER
+)
+RETURNS VOID
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    PERFORM 1 FROM public.documents WHERE id = p_document_id FOR UPDATE;
+    IF NOT FOUND THEN
+        RAISE EXCEPTION 'document % not found', p_document_id;
+    END IF;
+
+    DELETE FROM public.document_chunks WHERE document_id = p_document_id;
+
+    INSERT INTO public.document_chunks (
+        teacher_id, subject_id, document_id, content, embedding,
+        page_number, page_end, lexical_terms, chunker_version, embed_model
+    )
+    SELECT
+        s.teacher_id, s.subject_id, s.document_id, s.content, s.embedding,
+        s.page_number, s.page_end, s.lexical_terms, s.chunker_version, s.embed_model
+    FROM public.document_chunks_staging s
+    WHERE s.document_id = p_document_id;
+
+    DELETE FROM public.document_chunks_staging WHERE document_id = p_document_id;
+
+    UPDATE public.documents
+    SET index_version = p_index_version,
+        page_count = p_page_count,
+        chunk_count = p_chunk_count
+    WHERE id = p_document_id;
+END;
+$$;
+
+NOTIFY pgrst, 'reload schema';
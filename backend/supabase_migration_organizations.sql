@@ -1,5 +1,7 @@
 -- Run once on existing EduRAG databases (after initial supabase_schema.sql without organizations).
 -- Creates organizations, links subjects, enables RLS.
+-- Prerequisites: none (a database created from an older supabase_schema.sql).
+-- Run order: see supabase_schema.sql.
 
 CREATE TABLE IF NOT EXISTS public.organizations (
     id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
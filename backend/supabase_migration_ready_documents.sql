@@ -0,0 +1,165 @@
+-- Keep chunks of documents that are still being ingested out of vector search. Run
+-- once in SQL Editor. Chunks are stored batch by batch while a document is
+-- "processing", and a cancelled or failed ingestion deletes them again; until the
+-- document is "ready" they must not be cited (the numpy and lexical backends already
+-- skip them).
+-- Prerequisites: supabase_migration_ingestion_jobs.sql and
+-- supabase_migration_context_packing.sql.
+-- Run order: see supabase_schema.sql.
+
+CREATE OR REPLACE FUNCTION match_document_chunks(
+    query_embedding vector(768),
+    match_count INTEGER DEFAULT 5,
+    filter_subject_id UUID DEFAULT NULL,
+    filter_teacher_id UUID DEFAULT NULL,
+    exact_scan_threshold INTEGER DEFAULT 5000
+)
+RETURNS TABLE (
+    id UUID,
+    teacher_id UUID,
+    subject_id UUID,
+    document_id UUID,
+    content TEXT,
+    page_number INTEGER,
+    page_end INTEGER,
+    chunk_index INTEGER,
+    token_count INTEGER,
+    overlap_tokens INTEGER,
+    similarity FLOAT
+)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    subject_chunks BIGINT;
+BEGIN
+    IF filter_subject_id IS NOT NULL THEN
+        SELECT COALESCE(SUM(d.chunk_count), 0) INTO subject_chunks
+        FROM public.documents d
+        WHERE d.subject_id = filter_subject_id AND d.status = 'ready';
+
+        IF subject_chunks <= exact_scan_threshold THEN
+            -- "+ 0" keeps the planner on idx_chunks_subject instead of the HNSW index.
+            RETURN QUERY
+            SELECT
+                dc.id, dc.teacher_id, dc.subject_id, dc.document_id, dc.content,
+                dc.page_number, dc.page_end, dc.chunk_index, dc.token_count, dc.overlap_tokens,
+                1 - (dc.embedding <=> query_embedding) AS similarity
+            FROM public.document_chunks dc
+            WHERE dc.subject_id = filter_subject_id
+                AND (filter_teacher_id IS NULL OR dc.teacher_id = filter_teacher_id)
+                AND EXISTS (
+                    SELECT 1 FROM public.documents d
+                    WHERE d.id = dc.document_id AND d.status = 'ready'
+                )
+            ORDER BY (dc.embedding <=> query_embedding) + 0
+            LIMIT match_count;
+            RETURN;
+        END IF;
+    END IF;
+
+    PERFORM enable_hnsw_iterative_scan();
+    PERFORM set_config('hnsw.ef_search', GREATEST(40, match_count * 4)::text, true);
+
+    IF filter_subject_id IS NOT NULL THEN
+        -- A plain equality (no "IS NULL OR") lets the executor prune to one partition.
+        RETURN QUERY
+        SELECT m.* FROM (
+            SELECT
+                dc.id, dc.teacher_id, dc.subject_id, dc.document_id, dc.content,
+                dc.page_number, dc.page_end, dc.chunk_index, dc.token_count, dc.overlap_tokens,
+                1 - (dc.embedding <=> query_embedding) AS similarity
+            FROM public.document_chunks dc
+            WHERE dc.subject_id = filter_subject_id
+                AND (filter_teacher_id IS NULL OR dc.teacher_id = filter_teacher_id)
+                AND EXISTS (
+                    SELECT 1 FROM public.documents d
+                    WHERE d.id = dc.document_id AND d.status = 'ready'
+                )
+            ORDER BY dc.embedding <=> query_embedding
+            LIMIT match_count
+        ) m
+        ORDER BY m.similarity DESC;
+        RETURN;
+    END IF;
+
+    RETURN QUERY
+    SELECT m.* FROM (
+        SELECT
+            dc.id, dc.teacher_id, dc.subject_id, dc.document_id, dc.content,
+            dc.page_number, dc.page_end, dc.chunk_index, dc.token_count, dc.overlap_tokens,
+            1 - (dc.embedding <=> query_embedding) AS similarity
+        FROM public.document_chunks dc
+        WHERE (filter_teacher_id IS NULL OR dc.teacher_id = filter_teacher_id)
+            AND EXISTS (
+                SELECT 1 FROM public.documents d
+                WHERE d.id = dc.document_id AND d.status = 'ready'
+            )
+        ORDER BY dc.embedding <=> query_embedding
+        LIMIT match_count
+    ) m
+    -- relaxed_order may return neighbours slightly out of order.
+    ORDER BY m.similarity DESC;
+END;
+$$;
+
+-- EXPLAIN (ANALYZE, BUFFERS) of the query match_document_chunks would run, for
+-- benchmarks/bench_subject_partitions.py. Service role only.
+CREATE OR REPLACE FUNCTION explain_match_document_chunks(
+    query_embedding vector(768),
+    match_count INTEGER DEFAULT 5,
+    filter_subject_id UUID DEFAULT NULL,
+    filter_teacher_id UUID DEFAULT NULL,
+    exact_scan_threshold INTEGER DEFAULT 5000
+)
+RETURNS JSON
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    subject_chunks BIGINT;
+    plan JSON;
+BEGIN
+    SELECT COALESCE(SUM(d.chunk_count), 0) INTO subject_chunks
+    FROM public.documents d
+    WHERE d.subject_id = filter_subject_id AND d.status = 'ready';
+
+    IF filter_subject_id IS NULL THEN
+        RAISE EXCEPTION 'filter_subject_id is required';
+    END IF;
+
+    IF subject_chunks <= exact_scan_threshold THEN
+        EXECUTE
+            'EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) '
+            'SELECT dc.id, 1 - (dc.embedding <=> $1) AS similarity '
+            'FROM public.document_chunks dc '
+            'WHERE dc.subject_id = $3 AND ($4::uuid IS NULL OR dc.teacher_id = $4) '
+            'AND EXISTS (SELECT 1 FROM public.documents d '
+            'WHERE d.id = dc.document_id AND d.status = ''ready'') '
+            'ORDER BY (dc.embedding <=> $1) + 0 LIMIT $2'
+        INTO plan
+        USING query_embedding, match_count, filter_subject_id, filter_teacher_id;
+    ELSE
+        PERFORM enable_hnsw_iterative_scan();
+        PERFORM set_config('hnsw.ef_search', GREATEST(40, match_count * 4)::text, true);
+        EXECUTE
+            'EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) '
+            'SELECT dc.id, 1 - (dc.embedding <=> $1) AS similarity '
+            'FROM public.document_chunks dc '
+            'WHERE dc.subject_id = $3 AND ($4::uuid IS NULL OR dc.teacher_id = $4) '
+            'AND EXISTS (SELECT 1 FROM public.documents d '
+            'WHERE d.id = dc.document_id AND d.status = ''ready'') '
+            'ORDER BY dc.embedding <=> $1 LIMIT $2'
+        INTO plan
+        USING query_embedding, match_count, filter_subject_id, filter_teacher_id;
+    END IF;
+    RETURN json_build_object(
+        'exact_scan', subject_chunks <= exact_scan_threshold,
+        'subject_chunks', subject_chunks,
+        'plan', plan
+    );
+END;
+$$;
+
+REVOKE EXECUTE ON FUNCTION explain_match_document_chunks(vector, integer, uuid, uuid, integer)
+    FROM PUBLIC, anon, authenticated;
+
+NOTIFY pgrst, 'reload schema';
@@ -0,0 +1,106 @@
+-- Versioned chunks + incremental re-indexing. Run once in SQL Editor.
+-- Prerequisites: supabase_migration_chunk_page_span.sql.
+-- Run order: see supabase_schema.sql.
+
+-- Which chunker settings / embedding model each chunk was built with.
+ALTER TABLE public.document_chunks
+    ADD COLUMN IF NOT EXISTS chunker_version TEXT,
+    ADD COLUMN IF NOT EXISTS embed_model TEXT;
+
+-- "<chunker_version>|<embed_model>" of the document's current chunks; NULL = built before versioning.
+ALTER TABLE public.documents
+    ADD COLUMN IF NOT EXISTS index_version TEXT;
+
+ALTER TABLE public.ingestion_jobs
+    ADD COLUMN IF NOT EXISTS kind TEXT NOT NULL DEFAULT 'ingest'
+    CHECK (kind IN ('ingest', 'reindex'));
+
+-- New chunks are built here, invisible to retrieval, then swapped in atomically.
+CREATE TABLE IF NOT EXISTS public.document_chunks_staging (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    teacher_id UUID NOT NULL,
+    subject_id UUID NOT NULL REFERENCES public.subjects(id) ON DELETE CASCADE,
+    document_id UUID NOT NULL REFERENCES public.documents(id) ON DELETE CASCADE,
+    content TEXT NOT NULL,
+    embedding vector(768),
+    page_number INTEGER NOT NULL DEFAULT 1,
+    page_end INTEGER,
+    chunker_version TEXT,
+    embed_model TEXT,
+    created_at TIMESTAMPTZ DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS idx_chunks_staging_document ON public.document_chunks_staging(document_id);
+
+ALTER TABLE public.document_chunks_staging ENABLE ROW LEVEL SECURITY;
+
+DROP POLICY IF EXISTS "Service role full access chunks_staging" ON public.document_chunks_staging;
+CREATE POLICY "Service role full access chunks_staging" ON public.document_chunks_staging
+    FOR ALL USING (true) WITH CHECK (true);
+
+-- Replace a document's chunks with its staged chunks in one transaction.
+CREATE OR REPLACE FUNCTION swap_document_chunks(
+    p_document_id UUID,
+    p_index_version TEXT,
+    p_page_count INTEGER,
+    p_chunk_count INTEGER
+)
+RETURNS VOID
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    -- Serialize with concurrent swaps/deletes of the same document.
+    PERFORM 1 FROM public.documents WHERE id = p_document_id FOR UPDATE;
+    IF NOT FOUND THEN
+        RAISE EXCEPTION 'document % not found', p_document_id;
+    END IF;
+
+    DELETE FROM public.document_chunks WHERE document_id = p_document_id;
+
+    INSERT INTO public.document_chunks (
+        teacher_id, subject_id, document_id, content, embedding,
+        page_number, page_end, chunker_version, embed_model
+    )
+    SELECT
+        s.teacher_id, s.subject_id, s.document_id, s.content, s.embedding,
+        s.page_number, s.page_end, s.chunker_version, s.embed_model
+    FROM public.document_chunks_staging s
+    WHERE s.document_id = p_document_id;
+
+    DELETE FROM public.document_chunks_staging WHERE document_id = p_document_id;
+
+    UPDATE public.documents
+    SET index_version = p_index_version,
+        page_count = p_page_count,
+        chunk_count = p_chunk_count
+    WHERE id = p_document_id;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION copy_document_chunks(
+    source_document_id UUID,
+    target_document_id UUID,
+    target_subject_id UUID
+)
+RETURNS INTEGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    copied INTEGER;
+BEGIN
+    INSERT INTO public.document_chunks (
+        teacher_id, subject_id, document_id, content, embedding, page_number, page_end,
+        chunker_version, embed_model
+    )
+    SELECT
+        dc.teacher_id, target_subject_id, target_document_id, dc.content, dc.embedding,
+        dc.page_number, dc.page_end, dc.chunker_version, dc.embed_model
+    FROM public.document_chunks dc
+    WHERE dc.document_id = source_document_id;
+
+    GET DIAGNOSTICS copied = ROW_COUNT;
+    RETURN copied;
+END;
+$$;
+
+NOTIFY pgrst, 'reload schema';
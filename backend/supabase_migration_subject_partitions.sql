@@ -0,0 +1,233 @@
+-- Subject-partitioned chunk storage so filtered vector search stays fast as the table grows.
+-- Run once in SQL Editor. Iterative index scans need pgvector >= 0.8; on older versions
+-- they are skipped (see enable_hnsw_iterative_scan below).
+--
+-- document_chunks becomes hash-partitioned by subject_id. Each partition has its own
+-- HNSW index, so a query for one subject only walks the graph of ~1/16 of all chunks
+-- and partition pruning skips the rest. match_document_chunks additionally:
+--   * scans small subjects exactly (no ANN, always match_count rows, perfect recall);
+--   * enables hnsw.iterative_scan for large subjects so the subject filter can no
+--     longer leave it with fewer than match_count rows.
+-- Prerequisites: supabase_migration_lexical_terms.sql.
+-- Run order: see supabase_schema.sql.
+
+BEGIN;
+
+ALTER TABLE public.document_chunks RENAME TO document_chunks_unpartitioned;
+DROP INDEX IF EXISTS idx_chunks_subject;
+DROP INDEX IF EXISTS idx_chunks_teacher;
+DROP INDEX IF EXISTS idx_chunks_document;
+DROP INDEX IF EXISTS idx_chunks_embedding;
+DROP INDEX IF EXISTS idx_chunks_embedding_bq;
+
+CREATE TABLE public.document_chunks (
+    id UUID NOT NULL DEFAULT gen_random_uuid(),
+    teacher_id UUID NOT NULL,
+    subject_id UUID NOT NULL REFERENCES public.subjects(id) ON DELETE CASCADE,
+    document_id UUID NOT NULL REFERENCES public.documents(id) ON DELETE CASCADE,
+    content TEXT NOT NULL,
+    embedding vector(768),
+    page_number INTEGER NOT NULL DEFAULT 1,
+    page_end INTEGER,
+    lexical_terms JSONB,
+    chunker_version TEXT,
+    embed_model TEXT,
+    created_at TIMESTAMPTZ DEFAULT now(),
+    PRIMARY KEY (subject_id, id)
+) PARTITION BY HASH (subject_id);
+
+DO $$
+BEGIN
+    FOR i IN 0..15 LOOP
+        EXECUTE format(
+            'CREATE TABLE public.document_chunks_p%s PARTITION OF public.document_chunks '
+            'FOR VALUES WITH (MODULUS 16, REMAINDER %s)',
+            i, i
+        );
+    END LOOP;
+END;
+$$;
+
+INSERT INTO public.document_chunks (
+    id, teacher_id, subject_id, document_id, content, embedding, page_number, page_end,
+    lexical_terms, chunker_version, embed_model, created_at
+)
+SELECT
+    id, teacher_id, subject_id, document_id, content, embedding, page_number, page_end,
+    lexical_terms, chunker_version, embed_model, created_at
+FROM public.document_chunks_unpartitioned;
+
+-- Indexes are built after the bulk copy: building each HNSW graph once is much faster
+-- than inserting every copied row into it. Created on the parent, so every partition
+-- gets its own copy.
+CREATE INDEX idx_chunks_subject ON public.document_chunks(subject_id);
+CREATE INDEX idx_chunks_teacher ON public.document_chunks(teacher_id);
+CREATE INDEX idx_chunks_document ON public.document_chunks(document_id);
+CREATE INDEX idx_chunks_embedding ON public.document_chunks
+    USING hnsw (embedding vector_cosine_ops)
+    WITH (m = 16, ef_construction = 64);
+
+DROP TABLE public.document_chunks_unpartitioned;
+
+ALTER TABLE public.document_chunks ENABLE ROW LEVEL SECURITY;
+CREATE POLICY "Service role full access chunks" ON public.document_chunks
+    FOR ALL USING (true) WITH CHECK (true);
+
+-- hnsw.iterative_scan needs pgvector >= 0.8. On older versions the setting is skipped:
+-- search still works, but a filtered HNSW scan may return fewer than match_count rows.
+CREATE OR REPLACE FUNCTION enable_hnsw_iterative_scan()
+RETURNS VOID
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    PERFORM set_config('hnsw.iterative_scan', 'relaxed_order', true);
+EXCEPTION
+    WHEN invalid_name OR undefined_object OR invalid_parameter_value THEN
+        NULL;
+END;
+$$;
+
+-- Subjects with at most exact_scan_threshold chunks are scanned exactly.
+DROP FUNCTION IF EXISTS match_document_chunks(vector, integer, uuid, uuid);
+-- The new table has no embedding_bq column. Deployments using binary quantization
+-- re-run supabase_migration_binary_quantization.sql after this migration.
+DROP FUNCTION IF EXISTS match_document_chunks_bq(vector, integer, uuid, uuid, integer);
+CREATE OR REPLACE FUNCTION match_document_chunks(
+    query_embedding vector(768),
+    match_count INTEGER DEFAULT 5,
+    filter_subject_id UUID DEFAULT NULL,
+    filter_teacher_id UUID DEFAULT NULL,
+    exact_scan_threshold INTEGER DEFAULT 5000
+)
+RETURNS TABLE (
+    id UUID,
+    teacher_id UUID,
+    subject_id UUID,
+    document_id UUID,
+    content TEXT,
+    page_number INTEGER,
+    page_end INTEGER,
+    similarity FLOAT
+)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    subject_chunks BIGINT;
+BEGIN
+    IF filter_subject_id IS NOT NULL THEN
+        SELECT COALESCE(SUM(d.chunk_count), 0) INTO subject_chunks
+        FROM public.documents d
+        WHERE d.subject_id = filter_subject_id;
+
+        IF subject_chunks <= exact_scan_threshold THEN
+            -- "+ 0" keeps the planner on idx_chunks_subject instead of the HNSW index.
+            RETURN QUERY
+            SELECT
+                dc.id, dc.teacher_id, dc.subject_id, dc.document_id, dc.content,
+                dc.page_number, dc.page_end,
+                1 - (dc.embedding <=> query_embedding) AS similarity
+            FROM public.document_chunks dc
+            WHERE dc.subject_id = filter_subject_id
+                AND (filter_teacher_id IS NULL OR dc.teacher_id = filter_teacher_id)
+            ORDER BY (dc.embedding <=> query_embedding) + 0
+            LIMIT match_count;
+            RETURN;
+        END IF;
+    END IF;
+
+    PERFORM enable_hnsw_iterative_scan();
+    PERFORM set_config('hnsw.ef_search', GREATEST(40, match_count * 4)::text, true);
+
+    IF filter_subject_id IS NOT NULL THEN
+        -- A plain equality (no "IS NULL OR") lets the executor prune to one partition.
+        RETURN QUERY
+        SELECT m.* FROM (
+            SELECT
+                dc.id, dc.teacher_id, dc.subject_id, dc.document_id, dc.content,
+                dc.page_number, dc.page_end,
+                1 - (dc.embedding <=> query_embedding) AS similarity
+            FROM public.document_chunks dc
+            WHERE dc.subject_id = filter_subject_id
+                AND (filter_teacher_id IS NULL OR dc.teacher_id = filter_teacher_id)
+            ORDER BY dc.embedding <=> query_embedding
+            LIMIT match_count
+        ) m
+        ORDER BY m.similarity DESC;
+        RETURN;
+    END IF;
+
+    RETURN QUERY
+    SELECT m.* FROM (
+        SELECT
+            dc.id, dc.teacher_id, dc.subject_id, dc.document_id, dc.content,
+            dc.page_number, dc.page_end,
+            1 - (dc.embedding <=> query_embedding) AS similarity
+        FROM public.document_chunks dc
+        WHERE filter_teacher_id IS NULL OR dc.teacher_id = filter_teacher_id
+        ORDER BY dc.embedding <=> query_embedding
+        LIMIT match_count
+    ) m
+    -- relaxed_order may return neighbours slightly out of order.
+    ORDER BY m.similarity DESC;
+END;
+$$;
+
+-- EXPLAIN (ANALYZE, BUFFERS) of the query match_document_chunks would run, for
+-- benchmarks/bench_subject_partitions.py. Service role only.
+CREATE OR REPLACE FUNCTION explain_match_document_chunks(
+    query_embedding vector(768),
+    match_count INTEGER DEFAULT 5,
+    filter_subject_id UUID DEFAULT NULL,
+    filter_teacher_id UUID DEFAULT NULL,
+    exact_scan_threshold INTEGER DEFAULT 5000
+)
+RETURNS JSON
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    subject_chunks BIGINT;
+    plan JSON;
+BEGIN
+    SELECT COALESCE(SUM(d.chunk_count), 0) INTO subject_chunks
+    FROM public.documents d
+    WHERE d.subject_id = filter_subject_id;
+
+    IF filter_subject_id IS NULL THEN
+        RAISE EXCEPTION 'filter_subject_id is required';
+    END IF;
+
+    IF subject_chunks <= exact_scan_threshold THEN
+        EXECUTE
+            'EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) '
+            'SELECT dc.id, 1 - (dc.embedding <=> $1) AS similarity '
+            'FROM public.document_chunks dc '
+            'WHERE dc.subject_id = $3 AND ($4::uuid IS NULL OR dc.teacher_id = $4) '
+            'ORDER BY (dc.embedding <=> $1) + 0 LIMIT $2'
+        INTO plan
+        USING query_embedding, match_count, filter_subject_id, filter_teacher_id;
+    ELSE
+        PERFORM enable_hnsw_iterative_scan();
+        PERFORM set_config('hnsw.ef_search', GREATEST(40, match_count * 4)::text, true);
+        EXECUTE
+            'EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) '
+            'SELECT dc.id, 1 - (dc.embedding <=> $1) AS similarity '
+            'FROM public.document_chunks dc '
+            'WHERE dc.subject_id = $3 AND ($4::uuid IS NULL OR dc.teacher_id = $4) '
+            'ORDER BY dc.embedding <=> $1 LIMIT $2'
+        INTO plan
+        USING query_embedding, match_count, filter_subject_id, filter_teacher_id;
+    END IF;
+    RETURN json_build_object(
+        'exact_scan', subject_chunks <= exact_scan_threshold,
+        'subject_chunks', subject_chunks,
+        'plan', plan
+    );
+END;
+$$;
+
+REVOKE EXECUTE ON FUNCTION explain_match_document_chunks(vector, integer, uuid, uuid, integer)
+    FROM PUBLIC, anon, authenticated;
+
+COMMIT;
+
+NOTIFY pgrst, 'reload schema';
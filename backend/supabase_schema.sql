@@ -1,6 +1,22 @@
 -- ============================================================
 -- EduRAG — Supabase SQL Setup
 -- Run this in Supabase SQL Editor (Dashboard > SQL Editor)
+--
+-- New databases only need this file; it holds the current definition of every table
+-- and function. Existing databases apply the migrations they are missing, in order:
+--   supabase_migration_organizations.sql
+--   supabase_migration_document_storage.sql
+--   supabase_migration_ingestion_jobs.sql
+--   supabase_migration_document_dedup.sql
+--   supabase_migration_chunk_page_span.sql
+--   supabase_migration_reindex.sql
+--   supabase_migration_lexical_terms.sql
+--   supabase_migration_subject_partitions.sql
+--   supabase_migration_context_packing.sql
+--   supabase_migration_ready_documents.sql
+-- Several of them redefine copy_document_chunks, swap_document_chunks and
+-- match_document_chunks; the last one applied wins. Binary quantization is opt-in:
+--   supabase_migration_binary_quantization.sql (after all of the above)
 -- ============================================================
 
 -- 1. Enable pgvector extension
@@ -39,29 +55,103 @@ CREATE TABLE IF NOT EXISTS public.documents (
     page_count INTEGER NOT NULL DEFAULT 0,
     chunk_count INTEGER NOT NULL DEFAULT 0,
     storage_path TEXT,
+    status TEXT NOT NULL DEFAULT 'ready' CHECK (status IN ('processing', 'ready')),
+    content_sha256 TEXT,
+    -- "<chunker_version>|<embed_model>" of the current chunks (see app/services/document_service.py)
+    index_version TEXT,
     created_at TIMESTAMPTZ DEFAULT now()
 );
 
 CREATE INDEX IF NOT EXISTS idx_documents_subject ON public.documents(subject_id);
 CREATE INDEX IF NOT EXISTS idx_documents_teacher ON public.documents(teacher_id);
+CREATE INDEX IF NOT EXISTS idx_documents_teacher_sha256 ON public.documents(teacher_id, content_sha256);
 
--- 5. Document chunks table with vector embeddings
-CREATE TABLE IF NOT EXISTS public.document_chunks (
+-- 4b. Background ingestion jobs (one per uploaded PDF)
+CREATE TABLE IF NOT EXISTS public.ingestion_jobs (
     id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
     teacher_id UUID NOT NULL,
     subject_id UUID NOT NULL REFERENCES public.subjects(id) ON DELETE CASCADE,
+    document_id UUID REFERENCES public.documents(id) ON DELETE SET NULL,
+    filename TEXT NOT NULL,
+    kind TEXT NOT NULL DEFAULT 'ingest' CHECK (kind IN ('ingest', 'reindex')),
+    status TEXT NOT NULL DEFAULT 'queued'
+        CHECK (status IN ('queued', 'processing', 'completed', 'failed', 'cancelled')),
+    progress INTEGER NOT NULL DEFAULT 0,
+    processed_chunks INTEGER NOT NULL DEFAULT 0,
+    total_chunks INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    created_at TIMESTAMPTZ DEFAULT now(),
+    updated_at TIMESTAMPTZ DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS idx_ingestion_jobs_teacher ON public.ingestion_jobs(teacher_id);
+CREATE INDEX IF NOT EXISTS idx_ingestion_jobs_active ON public.ingestion_jobs(status)
+    WHERE status IN ('queued', 'processing');
+
+-- 5. Document chunks table with vector embeddings, hash-partitioned by subject so
+-- each partition has its own (smaller) HNSW index and subject queries prune to one
+CREATE TABLE IF NOT EXISTS public.document_chunks (
+    id UUID NOT NULL DEFAULT gen_random_uuid(),
+    teacher_id UUID NOT NULL,
+    subject_id UUID NOT NULL REFERENCES public.subjects(id) ON DELETE CASCADE,
     document_id UUID NOT NULL REFERENCES public.documents(id) ON DELETE CASCADE,
     content TEXT NOT NULL,
     embedding vector(768),
     page_number INTEGER NOT NULL DEFAULT 1,
-    created_at TIMESTAMPTZ DEFAULT now()
-);
+    page_end INTEGER,
+    -- Position in the document and tiktoken counts for context packing (app/rag/context_packer.py)
+    chunk_index INTEGER,
+    token_count INTEGER,
+    overlap_tokens INTEGER,
+    -- {term: count} for BM25 (app/rag/lexical_index.py)
+    lexical_terms JSONB,
+    chunker_version TEXT,
+    embed_model TEXT,
+    created_at TIMESTAMPTZ DEFAULT now(),
+    PRIMARY KEY (subject_id, id)
+) PARTITION BY HASH (subject_id);
+
+DO $$
+BEGIN
+    FOR i IN 0..15 LOOP
+        EXECUTE format(
+            'CREATE TABLE IF NOT EXISTS public.document_chunks_p%s PARTITION OF public.document_chunks '
+            'FOR VALUES WITH (MODULUS 16, REMAINDER %s)',
+            i, i
+        );
+    END LOOP;
+END;
+$$;
 
 CREATE INDEX IF NOT EXISTS idx_chunks_subject ON public.document_chunks(subject_id);
 CREATE INDEX IF NOT EXISTS idx_chunks_teacher ON public.document_chunks(teacher_id);
 CREATE INDEX IF NOT EXISTS idx_chunks_document ON public.document_chunks(document_id);
 
--- HNSW index for fast cosine similarity search
+-- 5a. Re-index staging: new chunks are built here and swapped in atomically
+CREATE TABLE IF NOT EXISTS public.document_chunks_staging (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    teacher_id UUID NOT NULL,
+    subject_id UUID NOT NULL REFERENCES public.subjects(id) ON DELETE CASCADE,
+    document_id UUID NOT NULL REFERENCES public.documents(id) ON DELETE CASCADE,
+    content TEXT NOT NULL,
+    embedding vector(768),
+    page_number INTEGER NOT NULL DEFAULT 1,
+    page_end INTEGER,
+    -- Position in the document and tiktoken counts for context packing (app/rag/context_packer.py)
+    chunk_index INTEGER,
+    token_count INTEGER,
+    overlap_tokens INTEGER,
+    -- {term: count} for BM25 (app/rag/lexical_index.py)
+    lexical_terms JSONB,
+    chunker_version TEXT,
+    embed_model TEXT,
+    created_at TIMESTAMPTZ DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS idx_chunks_staging_document ON public.document_chunks_staging(document_id);
+
+-- HNSW index (one per partition) for cosine similarity. Binary quantization
+-- (VECTOR_QUANTIZATION=binary) is opt-in: run supabase_migration_binary_quantization.sql.
 CREATE INDEX IF NOT EXISTS idx_chunks_embedding ON public.document_chunks
     USING hnsw (embedding vector_cosine_ops)
     WITH (m = 16, ef_construction = 64);
@@ -79,12 +169,27 @@ CREATE TABLE IF NOT EXISTS public.quizzes (
 CREATE INDEX IF NOT EXISTS idx_quizzes_subject ON public.quizzes(subject_id);
 CREATE INDEX IF NOT EXISTS idx_quizzes_teacher ON public.quizzes(teacher_id);
 
+-- hnsw.iterative_scan needs pgvector >= 0.8. On older versions the setting is skipped:
+-- search still works, but a filtered HNSW scan may return fewer than match_count rows.
+CREATE OR REPLACE FUNCTION enable_hnsw_iterative_scan()
+RETURNS VOID
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    PERFORM set_config('hnsw.iterative_scan', 'relaxed_order', true);
+EXCEPTION
+    WHEN invalid_name OR undefined_object OR invalid_parameter_value THEN
+        NULL;
+END;
+$$;
+
 -- 6. Similarity search function used by the backend
 CREATE OR REPLACE FUNCTION match_document_chunks(
     query_embedding vector(768),
     match_count INTEGER DEFAULT 5,
     filter_subject_id UUID DEFAULT NULL,
-    filter_teacher_id UUID DEFAULT NULL
+    filter_teacher_id UUID DEFAULT NULL,
+    exact_scan_threshold INTEGER DEFAULT 5000
 )
 RETURNS TABLE (
     id UUID,
@@ -93,26 +198,212 @@ RETURNS TABLE (
     document_id UUID,
     content TEXT,
     page_number INTEGER,
+    page_end INTEGER,
+    chunk_index INTEGER,
+    token_count INTEGER,
+    overlap_tokens INTEGER,
     similarity FLOAT
 )
 LANGUAGE plpgsql
 AS $$
+DECLARE
+    subject_chunks BIGINT;
 BEGIN
+    IF filter_subject_id IS NOT NULL THEN
+        SELECT COALESCE(SUM(d.chunk_count), 0) INTO subject_chunks
+        FROM public.documents d
+        WHERE d.subject_id = filter_subject_id AND d.status = 'ready';
+
+        IF subject_chunks <= exact_scan_threshold THEN
+            -- "+ 0" keeps the planner on idx_chunks_subject instead of the HNSW index.
+            RETURN QUERY
+            SELECT
+                dc.id, dc.teacher_id, dc.subject_id, dc.document_id, dc.content,
+                dc.page_number, dc.page_end, dc.chunk_index, dc.token_count, dc.overlap_tokens,
+                1 - (dc.embedding <=> query_embedding) AS similarity
+            FROM public.document_chunks dc
+            WHERE dc.subject_id = filter_subject_id
+                AND (filter_teacher_id IS NULL OR dc.teacher_id = filter_teacher_id)
+                AND EXISTS (
+                    SELECT 1 FROM public.documents d
+                    WHERE d.id = dc.document_id AND d.status = 'ready'
+                )
+            ORDER BY (dc.embedding <=> query_embedding) + 0
+            LIMIT match_count;
+            RETURN;
+        END IF;
+    END IF;
+
+    PERFORM enable_hnsw_iterative_scan();
+    PERFORM set_config('hnsw.ef_search', GREATEST(40, match_count * 4)::text, true);
+
+    IF filter_subject_id IS NOT NULL THEN
+        -- A plain equality (no "IS NULL OR") lets the executor prune to one partition.
+        RETURN QUERY
+        SELECT m.* FROM (
+            SELECT
+                dc.id, dc.teacher_id, dc.subject_id, dc.document_id, dc.content,
+                dc.page_number, dc.page_end, dc.chunk_index, dc.token_count, dc.overlap_tokens,
+                1 - (dc.embedding <=> query_embedding) AS similarity
+            FROM public.document_chunks dc
+            WHERE dc.subject_id = filter_subject_id
+                AND (filter_teacher_id IS NULL OR dc.teacher_id = filter_teacher_id)
+                AND EXISTS (
+                    SELECT 1 FROM public.documents d
+                    WHERE d.id = dc.document_id AND d.status = 'ready'
+                )
+            ORDER BY dc.embedding <=> query_embedding
+            LIMIT match_count
+        ) m
+        ORDER BY m.similarity DESC;
+        RETURN;
+    END IF;
+
     RETURN QUERY
+    SELECT m.* FROM (
+        SELECT
+            dc.id, dc.teacher_id, dc.subject_id, dc.document_id, dc.content,
+            dc.page_number, dc.page_end, dc.chunk_index, dc.token_count, dc.overlap_tokens,
+            1 - (dc.embedding <=> query_embedding) AS similarity
+        FROM public.document_chunks dc
+        WHERE (filter_teacher_id IS NULL OR dc.teacher_id = filter_teacher_id)
+            AND EXISTS (
+                SELECT 1 FROM public.documents d
+                WHERE d.id = dc.document_id AND d.status = 'ready'
+            )
+        ORDER BY dc.embedding <=> query_embedding
+        LIMIT match_count
+    ) m
+    -- relaxed_order may return neighbours slightly out of order.
+    ORDER BY m.similarity DESC;
+END;
+$$;
+
+-- 6a1. EXPLAIN (ANALYZE, BUFFERS) of the query match_document_chunks would run, for
+-- benchmarks/bench_subject_partitions.py. Service role only.
+CREATE OR REPLACE FUNCTION explain_match_document_chunks(
+    query_embedding vector(768),
+    match_count INTEGER DEFAULT 5,
+    filter_subject_id UUID DEFAULT NULL,
+    filter_teacher_id UUID DEFAULT NULL,
+    exact_scan_threshold INTEGER DEFAULT 5000
+)
+RETURNS JSON
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    subject_chunks BIGINT;
+    plan JSON;
+BEGIN
+    SELECT COALESCE(SUM(d.chunk_count), 0) INTO subject_chunks
+    FROM public.documents d
+    WHERE d.subject_id = filter_subject_id AND d.status = 'ready';
+
+    IF filter_subject_id IS NULL THEN
+        RAISE EXCEPTION 'filter_subject_id is required';
+    END IF;
+
+    IF subject_chunks <= exact_scan_threshold THEN
+        EXECUTE
+            'EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) '
+            'SELECT dc.id, 1 - (dc.embedding <=> $1) AS similarity '
+            'FROM public.document_chunks dc '
+            'WHERE dc.subject_id = $3 AND ($4::uuid IS NULL OR dc.teacher_id = $4) '
+            'AND EXISTS (SELECT 1 FROM public.documents d '
+            'WHERE d.id = dc.document_id AND d.status = ''ready'') '
+            'ORDER BY (dc.embedding <=> $1) + 0 LIMIT $2'
+        INTO plan
+        USING query_embedding, match_count, filter_subject_id, filter_teacher_id;
+    ELSE
+        PERFORM enable_hnsw_iterative_scan();
+        PERFORM set_config('hnsw.ef_search', GREATEST(40, match_count * 4)::text, true);
+        EXECUTE
+            'EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) '
+            'SELECT dc.id, 1 - (dc.embedding <=> $1) AS similarity '
+            'FROM public.document_chunks dc '
+            'WHERE dc.subject_id = $3 AND ($4::uuid IS NULL OR dc.teacher_id = $4) '
+            'AND EXISTS (SELECT 1 FROM public.documents d '
+            'WHERE d.id = dc.document_id AND d.status = ''ready'') '
+            'ORDER BY dc.embedding <=> $1 LIMIT $2'
+        INTO plan
+        USING query_embedding, match_count, filter_subject_id, filter_teacher_id;
+    END IF;
+    RETURN json_build_object(
+        'exact_scan', subject_chunks <= exact_scan_threshold,
+        'subject_chunks', subject_chunks,
+        'plan', plan
+    );
+END;
+$$;
+
+REVOKE EXECUTE ON FUNCTION explain_match_document_chunks(vector, integer, uuid, uuid, integer)
+    FROM PUBLIC, anon, authenticated;
+
+-- 6a. Server-side copy of an indexed document's chunks (duplicate PDF uploads)
+CREATE OR REPLACE FUNCTION copy_document_chunks(
+    source_document_id UUID,
+    target_document_id UUID,
+    target_subject_id UUID
+)
+RETURNS INTEGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    copied INTEGER;
+BEGIN
+    INSERT INTO public.document_chunks (
+        teacher_id, subject_id, document_id, content, embedding, page_number, page_end,
+        chunk_index, token_count, overlap_tokens, lexical_terms, chunker_version, embed_model
+    )
     SELECT
-        dc.id,
-        dc.teacher_id,
-        dc.subject_id,
-        dc.document_id,
-        dc.content,
-        dc.page_number,
-        1 - (dc.embedding <=> query_embedding) AS similarity
+        dc.teacher_id, target_subject_id, target_document_id, dc.content, dc.embedding,
+        dc.page_number, dc.page_end, dc.chunk_index, dc.token_count, dc.overlap_tokens,
+        dc.lexical_terms, dc.chunker_version, dc.embed_model
     FROM public.document_chunks dc
-    WHERE
-        (filter_subject_id IS NULL OR dc.subject_id = filter_subject_id)
-        AND (filter_teacher_id IS NULL OR dc.teacher_id = filter_teacher_id)
-    ORDER BY dc.embedding <=> query_embedding
-    LIMIT match_count;
+    WHERE dc.document_id = source_document_id;
+
+    GET DIAGNOSTICS copied = ROW_COUNT;
+    RETURN copied;
+END;
+$$;
+
+-- 6a2. Atomically replace a document's chunks with its staged re-indexed chunks
+CREATE OR REPLACE FUNCTION swap_document_chunks(
+    p_document_id UUID,
+    p_index_version TEXT,
+    p_page_count INTEGER,
+    p_chunk_count INTEGER
+)
+RETURNS VOID
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    PERFORM 1 FROM public.documents WHERE id = p_document_id FOR UPDATE;
+    IF NOT FOUND THEN
+        RAISE EXCEPTION 'document % not found', p_document_id;
+    END IF;
+
+    DELETE FROM public.document_chunks WHERE document_id = p_document_id;
+
+    INSERT INTO public.document_chunks (
+        teacher_id, subject_id, document_id, content, embedding,
+        page_number, page_end, chunk_index, token_count, overlap_tokens,
+        lexical_terms, chunker_version, embed_model
+    )
+    SELECT
+        s.teacher_id, s.subject_id, s.document_id, s.content, s.embedding,
+        s.page_number, s.page_end, s.chunk_index, s.token_count, s.overlap_tokens,
+        s.lexical_terms, s.chunker_version, s.embed_model
+    FROM public.document_chunks_staging s
+    WHERE s.document_id = p_document_id;
+
+    DELETE FROM public.document_chunks_staging WHERE document_id = p_document_id;
+
+    UPDATE public.documents
+    SET index_version = p_index_version,
+        page_count = p_page_count,
+        chunk_count = p_chunk_count
+    WHERE id = p_document_id;
 END;
 $$;
 
@@ -152,6 +443,8 @@ ALTER TABLE public.document_chunks ENABLE ROW LEVEL SECURITY;
 ALTER TABLE public.quizzes ENABLE ROW LEVEL SECURITY;
 ALTER TABLE public.generated_notes ENABLE ROW LEVEL SECURITY;
 ALTER TABLE public.chat_messages ENABLE ROW LEVEL SECURITY;
+ALTER TABLE public.ingestion_jobs ENABLE ROW LEVEL SECURITY;
+ALTER TABLE public.document_chunks_staging ENABLE ROW LEVEL SECURITY;
 
 -- Service role bypass (backend uses service_role key)
 CREATE POLICY "Service role full access organizations" ON public.organizations
@@ -174,3 +467,9 @@ CREATE POLICY "Service role full access generated_notes" ON public.generated_not
 
 CREATE POLICY "Service role full access chat_messages" ON public.chat_messages
     FOR ALL USING (true) WITH CHECK (true);
+
+CREATE POLICY "Service role full access ingestion_jobs" ON public.ingestion_jobs
+    FOR ALL USING (true) WITH CHECK (true);
+
+CREATE POLICY "Service role full access chunks_staging" ON public.document_chunks_staging
+    FOR ALL USING (true) WITH CHECK (true);
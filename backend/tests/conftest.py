@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Run from backend/ or the repo root: `app` is imported from backend/.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
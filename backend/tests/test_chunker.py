@@ -0,0 +1,144 @@
+"""
+Page attribution of chunks, checked against character offsets.
+
+The encoder is replaced by one token per character, so a chunk's token window is
+exactly a slice of the pages joined by PAGE_SEPARATOR and the expected page span
+can be computed from plain string offsets (no tiktoken download needed).
+"""
+import asyncio
+import random
+
+import pytest
+
+from app.rag import chunker
+
+
+class CharEncoder:
+    def encode(self, text: str) -> list[int]:
+        return [ord(c) for c in text]
+
+    def decode(self, tokens: list[int]) -> str:
+        return "".join(chr(t) for t in tokens)
+
+
+@pytest.fixture(autouse=True)
+def char_encoder(monkeypatch):
+    monkeypatch.setattr(chunker, "_encoder", CharEncoder())
+
+
+def make_pages(seed: int, count: int = 12) -> list[dict]:
+    rng = random.Random(seed)
+    pages = []
+    for i in range(count):
+        kind = rng.random()
+        if kind < 0.15:
+            text = "  \n "  # blank page: skipped entirely
+        elif kind < 0.35:
+            text = f"p{i + 1}"  # tiny page, often shares a chunk with its neighbours
+        else:
+            words = [f"w{i + 1}.{j}" for j in range(rng.randint(5, 60))]
+            text = " ".join(words)
+            if rng.random() < 0.5:
+                text = text.replace(" ", "\n", 3)  # newlines inside a page are not separators
+        pages.append({"page_number": i + 1, "text": text})
+    return pages
+
+
+def expected_chunks(pages: list[dict], chunk_size: int, chunk_overlap: int) -> list[dict]:
+    """Reference chunking over the joined text, with page spans from character offsets."""
+    sep = chunker.PAGE_SEPARATOR
+    joined = ""
+    owner: list[int | None] = []  # page number per character, None for separators
+    for page in pages:
+        text = page["text"].strip()
+        if not text:
+            continue
+        if joined:
+            joined += sep
+            owner.extend([None] * len(sep))
+        joined += text
+        owner.extend([page["page_number"]] * len(text))
+
+    step = max(1, chunk_size - chunk_overlap)
+    chunks = []
+    for start in range(0, len(joined), step):
+        end = min(start + chunk_size, len(joined))
+        content = joined[start:end].strip()
+        if not content:
+            continue
+        span = [p for p in owner[start:end] if p is not None]
+        chunks.append({
+            "content": content,
+            "page_number": span[0],
+            "page_end": span[-1],
+            "token_count": end - start,
+            "overlap_tokens": min(chunk_size - step, start, end - start),
+        })
+    return chunks
+
+
+async def _aiter(items):
+    for item in items:
+        yield item
+
+
+def stream_chunks(pages: list[dict], chunk_size: int, chunk_overlap: int) -> list[dict]:
+    async def collect():
+        return [c async for c in chunker.iter_page_chunks(_aiter(pages), chunk_size, chunk_overlap)]
+
+    return asyncio.run(collect())
+
+
+SIZES = [(40, 0), (40, 10), (64, 16), (25, 24), (300, 50), (7, 3)]
+
+
+@pytest.mark.parametrize("seed", range(8))
+@pytest.mark.parametrize("chunk_size,chunk_overlap", SIZES)
+def test_extract_page_chunks_matches_character_offsets(seed, chunk_size, chunk_overlap):
+    pages = make_pages(seed)
+    assert chunker.extract_page_chunks(pages, chunk_size, chunk_overlap) == expected_chunks(
+        pages, chunk_size, chunk_overlap
+    )
+
+
+@pytest.mark.parametrize("seed", range(8))
+@pytest.mark.parametrize("chunk_size,chunk_overlap", SIZES)
+def test_iter_page_chunks_matches_character_offsets(seed, chunk_size, chunk_overlap):
+    pages = make_pages(seed)
+    assert stream_chunks(pages, chunk_size, chunk_overlap) == expected_chunks(
+        pages, chunk_size, chunk_overlap
+    )
+
+
+def test_window_starting_on_separator_belongs_to_next_page():
+    # "aaaa" + "\n" + "bbbb": the second window starts exactly on the separator.
+    pages = [{"page_number": 1, "text": "aaaa"}, {"page_number": 2, "text": "bbbb"}]
+    chunks = chunker.extract_page_chunks(pages, chunk_size=4, chunk_overlap=0)
+    assert [(c["content"], c["page_number"], c["page_end"]) for c in chunks] == [
+        ("aaaa", 1, 1),
+        ("bbb", 2, 2),
+        ("b", 2, 2),
+    ]
+
+
+def test_window_ending_on_separator_does_not_claim_next_page():
+    pages = [{"page_number": 3, "text": "abc"}, {"page_number": 4, "text": "def"}]
+    chunks = chunker.extract_page_chunks(pages, chunk_size=4, chunk_overlap=0)
+    assert (chunks[0]["page_number"], chunks[0]["page_end"]) == (3, 3)
+    assert (chunks[1]["page_number"], chunks[1]["page_end"]) == (4, 4)
+
+
+def test_blank_pages_are_skipped_in_spans():
+    pages = [
+        {"page_number": 1, "text": "alpha"},
+        {"page_number": 2, "text": "   "},
+        {"page_number": 3, "text": "omega"},
+    ]
+    chunks = chunker.extract_page_chunks(pages, chunk_size=100, chunk_overlap=0)
+    assert chunks == [{
+        "content": "alpha\nomega",
+        "page_number": 1,
+        "page_end": 3,
+        "token_count": 11,
+        "overlap_tokens": 0,
+    }]
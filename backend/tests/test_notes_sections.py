@@ -0,0 +1,97 @@
+"""Section splitting of streamed notes (notes_service.stream_notes)."""
+import asyncio
+
+import pytest
+
+from app.services import notes_service
+from app.services.notes_service import _split_sections
+
+NOTES = (
+    "# Photosynthesis\n"
+    "Plants turn light into sugar.\n"
+    "## Setup\n"
+    "```bash\n"
+    "# install the toolkit\n"
+    "pip install leafsim\n"
+    "## not a section either\n"
+    "```\n"
+    "Run it once.\n"
+    "## Code\n"
+    "````python\n"
+    "```\n"
+    "# still inside the four-backtick block\n"
+    "````\n"
+    "~~~\n"
+    "# tilde fences count too\n"
+    "~~~\n"
+    "## Summary\n"
+    "Light in, sugar out.\n"
+)
+
+EXPECTED = [
+    "# Photosynthesis\nPlants turn light into sugar.\n",
+    "## Setup\n```bash\n# install the toolkit\npip install leafsim\n"
+    "## not a section either\n```\nRun it once.\n",
+    "## Code\n````python\n```\n# still inside the four-backtick block\n````\n"
+    "~~~\n# tilde fences count too\n~~~\n",
+    "## Summary\nLight in, sugar out.\n",
+]
+
+
+@pytest.fixture
+def model_tokens(monkeypatch):
+    """Tokens the fake model streams to stream_notes; fill the returned list."""
+    tokens: list[str] = []
+
+    async def fake_stream_notes_text(context: str, topic: str):
+        for token in tokens:
+            yield {"token": token}
+        yield {"done": True, "eval_count": len(tokens)}
+
+    monkeypatch.setattr(notes_service, "stream_notes_text", fake_stream_notes_text)
+    return tokens
+
+
+def stream(model_tokens: list[str], tokens: list[str]) -> list[str]:
+    """Markdown of the "section" events stream_notes emits for these model tokens."""
+    model_tokens[:] = tokens
+
+    async def collect():
+        events = [e async for e in notes_service.stream_notes("subject", "teacher", "context")]
+        assert events[-1][0] == "done"
+        assert events[-1][1]["eval_count"] == len(tokens)
+        return [data["markdown"] for event, data in events[:-1] if event == "section"]
+
+    return asyncio.run(collect())
+
+
+def chunks_of(text: str, size: int) -> list[str]:
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def test_headings_inside_code_fences_do_not_split():
+    sections, rest = _split_sections(NOTES)
+    assert sections + [rest] == EXPECTED
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 5, 7, 16, 1000])
+def test_stream_notes_emits_whole_sections(model_tokens, size):
+    # Small sizes split fences ("``" + "`bash") and "# comment" lines across tokens.
+    assert stream(model_tokens, chunks_of(NOTES, size)) == EXPECTED
+
+
+def test_stream_notes_with_fence_straddling_tokens(model_tokens):
+    tokens = [
+        "# Photosynthesis\nPlants turn light into sugar.\n## Se", "tup\n``", "`bash\n#",
+        " install the toolkit\npip install leafsim\n#", "# not a section either\n`",
+        "``\nRun it once.\n", "## Code\n````python\n```\n# still inside the four-backtick ",
+        "block\n```", "`\n~~~\n# tilde fences count too\n~", "~~\n## Summary\nLight in, sugar out.\n",
+    ]
+    assert "".join(tokens) == NOTES
+    assert stream(model_tokens, tokens) == EXPECTED
+
+
+def test_unclosed_fence_keeps_the_rest_in_one_section():
+    sections, rest = _split_sections("## A\n```\n# comment\n## B\n")
+    assert sections == []
+    assert rest == "## A\n```\n# comment\n## B\n"
@@ -0,0 +1,112 @@
+"""Coalesced calls and LLM lanes (single_flight.SingleFlight with llm_scheduler)."""
+import asyncio
+
+from app.rag.llm_scheduler import (
+    LANE_GENERATION,
+    LANE_INGESTION,
+    LANE_INTERACTIVE,
+    LLMScheduler,
+    set_llm_priority,
+)
+from app.rag.single_flight import SingleFlight
+
+
+async def _settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_interactive_follower_raises_an_ingestion_flight():
+    async def scenario():
+        scheduler = LLMScheduler(max_in_flight=1, max_queue=10)
+        flights = SingleFlight()
+        order: list[str] = []
+
+        async def call(name: str) -> str:
+            async with scheduler.slot():
+                order.append(name)
+            return name
+
+        async def caller(lane: str, fn):
+            set_llm_priority(lane, "teacher")
+            return await fn()
+
+        await scheduler.acquire(LANE_GENERATION, "busy")  # hold the only slot
+        leader = asyncio.create_task(
+            caller(LANE_INGESTION, lambda: flights.do("key", lambda: call("shared")))
+        )
+        await _settle()
+        other = asyncio.create_task(caller(LANE_GENERATION, lambda: call("generation")))
+        await _settle()
+        assert scheduler.stats()["lanes"][LANE_INGESTION]["queued"] == 1
+
+        follower = asyncio.create_task(
+            caller(LANE_INTERACTIVE, lambda: flights.do("key", lambda: call("duplicate")))
+        )
+        await _settle()
+        lanes = scheduler.stats()["lanes"]
+        assert lanes[LANE_INTERACTIVE]["queued"] == 1
+        assert lanes[LANE_INGESTION]["queued"] == 0
+
+        scheduler.release()
+        results = await asyncio.gather(leader, follower, other)
+        assert results == ["shared", "shared", "generation"]
+        assert order == ["shared", "generation"]  # the shared call overtook generation
+
+    asyncio.run(scenario())
+
+
+def test_flight_drops_back_when_the_interactive_caller_leaves():
+    async def scenario():
+        scheduler = LLMScheduler(max_in_flight=1, max_queue=10)
+        flights = SingleFlight()
+
+        async def call() -> str:
+            async with scheduler.slot():
+                return "done"
+
+        async def caller(lane: str):
+            set_llm_priority(lane, "teacher")
+            return await flights.do("key", call)
+
+        await scheduler.acquire(LANE_GENERATION, "busy")
+        leader = asyncio.create_task(caller(LANE_INGESTION))
+        await _settle()
+        follower = asyncio.create_task(caller(LANE_INTERACTIVE))
+        await _settle()
+        assert scheduler.stats()["lanes"][LANE_INTERACTIVE]["queued"] == 1
+
+        follower.cancel()
+        await _settle()
+        lanes = scheduler.stats()["lanes"]
+        assert lanes[LANE_INTERACTIVE]["queued"] == 0
+        assert lanes[LANE_INGESTION]["queued"] == 1
+
+        scheduler.release()
+        assert await leader == "done"
+
+    asyncio.run(scenario())
+
+
+def test_interactive_caller_does_not_get_rejected_for_an_ingestion_flight():
+    async def scenario():
+        # The interactive queue is already full, but ingestion work must not fail.
+        scheduler = LLMScheduler(max_in_flight=1, max_queue=0)
+        flights = SingleFlight()
+
+        async def call() -> str:
+            async with scheduler.slot():
+                return "done"
+
+        async def caller(lane: str):
+            set_llm_priority(lane, "teacher")
+            return await flights.do("key", call)
+
+        await scheduler.acquire(LANE_GENERATION, "busy")
+        leader = asyncio.create_task(caller(LANE_INGESTION))
+        follower = asyncio.create_task(caller(LANE_INTERACTIVE))
+        await _settle()
+        scheduler.release()
+        assert await asyncio.gather(leader, follower) == ["done", "done"]
+
+    asyncio.run(scenario())
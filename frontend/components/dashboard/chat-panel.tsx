@@ -7,7 +7,7 @@ import { Input } from "@/components/ui/input";
 import { ScrollArea } from "@/components/ui/scroll-area";
 import { Send, Loader2, User, Bot, Sparkles, FileText, ChevronRight } from "lucide-react";
 import { ChatMessage, Subject } from "@/types";
-import api from "@/lib/api";
+import api, { streamEvents } from "@/lib/api";
 import { cn } from "@/lib/utils";
 
 interface ChatPanelProps {
@@ -18,6 +18,7 @@ export function ChatPanel({ subject }: ChatPanelProps) {
   const [messages, setMessages] = useState<ChatMessage[]>([]);
   const [input, setInput] = useState("");
   const [loading, setLoading] = useState(false);
+  const [streamingId, setStreamingId] = useState<string | null>(null);
   const [initialLoading, setInitialLoading] = useState(true);
   const scrollRef = useRef<HTMLDivElement>(null);
 
@@ -87,24 +88,38 @@ export function ChatPanel({ subject }: ChatPanelProps) {
     await persistMessage("user", question);
 
     try {
-      const { data } = await api.post("/ask", {
-        subject_id: subject.id,
-        question,
+      // Tokens are shown as they arrive from /ask/stream instead of after the full answer.
+      const aiId = crypto.randomUUID();
+      let answer = "";
+      let sources: ChatMessage["sources"] = [];
+      await streamEvents("/ask/stream", { subject_id: subject.id, question }, (event, data) => {
+        if (event === "sources") {
+          sources = data.sources;
+        } else if (event === "token") {
+          answer += data.text;
+          const aiMsg: ChatMessage = {
+            id: aiId,
+            role: "assistant",
+            content: answer,
+            sources,
+            timestamp: new Date(),
+          };
+          setStreamingId(aiId);
+          setMessages((prev) =>
+            prev.some((m) => m.id === aiId)
+              ? prev.map((m) => (m.id === aiId ? aiMsg : m))
+              : [...prev, aiMsg]
+          );
+        } else if (event === "error") {
+          throw new Error(data.detail);
+        }
       });
 
-      const aiMsg: ChatMessage = {
-        id: crypto.randomUUID(),
-        role: "assistant",
-        content: data.answer,
-        sources: data.sources,
-        timestamp: new Date(),
-      };
-
-      setMessages((prev) => [...prev, aiMsg]);
-      await persistMessage("assistant", data.answer, data.sources);
+      await persistMessage("assistant", answer, sources);
     } catch (err: any) {
       const errContent =
         err.response?.data?.detail ||
+        err.message ||
         "Something went wrong. Please try again.";
       const errMsg: ChatMessage = {
         id: crypto.randomUUID(),
@@ -116,6 +131,7 @@ export function ChatPanel({ subject }: ChatPanelProps) {
       await persistMessage("assistant", errContent);
     } finally {
       setLoading(false);
+      setStreamingId(null);
     }
   };
 
@@ -265,7 +281,7 @@ export function ChatPanel({ subject }: ChatPanelProps) {
             </div>
           ))}
 
-          {loading && (
+          {loading && !streamingId && (
             <div className="flex items-start gap-3 animate-pulse">
               <div className="flex h-8 w-8 shrink-0 items-center justify-center rounded-xl bg-primary/10 border border-primary/20">
                 <Bot className="h-4 w-4 text-primary" />
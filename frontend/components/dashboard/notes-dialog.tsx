@@ -24,7 +24,7 @@ import {
   Check,
 } from "lucide-react";
 import { Subject } from "@/types";
-import api from "@/lib/api";
+import api, { streamEvents } from "@/lib/api";
 
 interface NotesDialogProps {
   subject: Subject;
@@ -48,15 +48,22 @@ export function NotesDialog({ subject, onGenerated }: NotesDialogProps) {
     setSaved(false);
 
     try {
-      const { data } = await api.post("/generate-notes", {
-        subject_id: subject.id,
-        topic: topic || undefined,
-      });
-      setNotes(data.notes);
-    } catch (err: any) {
-      setError(
-        err.response?.data?.detail || "Failed to generate notes. Try again."
+      // Sections are rendered as soon as the server finishes each one.
+      let markdown = "";
+      await streamEvents(
+        "/generate-notes/stream",
+        { subject_id: subject.id, topic: topic || undefined },
+        (event, data) => {
+          if (event === "section") {
+            markdown += data.markdown;
+            setNotes(markdown);
+          } else if (event === "error") {
+            throw new Error(data.detail);
+          }
+        }
       );
+    } catch (err: any) {
+      setError(err.message || "Failed to generate notes. Try again.");
     } finally {
       setLoading(false);
     }
@@ -172,6 +179,7 @@ export function NotesDialog({ subject, onGenerated }: NotesDialogProps) {
                   setNotes("");
                   setSaved(false);
                 }}
+                disabled={loading}
                 className="flex-1"
               >
                 Generate Again
@@ -180,7 +188,7 @@ export function NotesDialog({ subject, onGenerated }: NotesDialogProps) {
               <Button
                 variant={saved ? "secondary" : "default"}
                 onClick={handleSave}
-                disabled={saving || saved}
+                disabled={loading || saving || saved}
               >
                 {saving ? (
                   <Loader2 className="mr-2 h-4 w-4 animate-spin" />
@@ -31,4 +31,55 @@ api.interceptors.response.use(
   }
 );
 
+/**
+ * POST to a Server-Sent Events endpoint and call `onEvent` for every event as it
+ * arrives. Uses fetch because axios cannot read a response body incrementally.
+ */
+export async function streamEvents(
+  path: string,
+  body: unknown,
+  onEvent: (event: string, data: any) => void
+): Promise<void> {
+  const {
+    data: { session },
+  } = await supabase.auth.getSession();
+  const response = await fetch(`${api.defaults.baseURL}${path}`, {
+    method: "POST",
+    headers: {
+      "Content-Type": "application/json",
+      ...(session?.access_token ? { Authorization: `Bearer ${session.access_token}` } : {}),
+    },
+    body: JSON.stringify(body),
+  });
+  if (!response.ok || !response.body) {
+    let detail = "Something went wrong. Please try again.";
+    try {
+      detail = (await response.json()).detail || detail;
+    } catch {}
+    throw new Error(detail);
+  }
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+  while (true) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    let boundary = buffer.indexOf("\n\n");
+    while (boundary !== -1) {
+      const frame = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+      let event = "message";
+      let data = "";
+      for (const line of frame.split("\n")) {
+        if (line.startsWith("event: ")) event = line.slice(7);
+        else if (line.startsWith("data: ")) data += line.slice(6);
+      }
+      if (data) onEvent(event, JSON.parse(data));
+      boundary = buffer.indexOf("\n\n");
+    }
+  }
+}
+
 export default api;
@@ -24,6 +24,7 @@ export interface Document {
   chunk_count: number;
   created_at: string;
   storage_path?: string | null;
+  status?: "processing" | "ready";
 }
 
 export interface AskResponse {
@@ -33,6 +34,17 @@ export interface AskResponse {
     page_number: number;
     similarity: number;
   }[];
+  cached?: boolean;
+}
+
+export interface AskBatchResponse {
+  results: {
+    question: string;
+    answer: string | null;
+    sources: AskResponse["sources"];
+    cached: boolean;
+    error?: string | null;
+  }[];
 }
 
 export interface QuizQuestion {